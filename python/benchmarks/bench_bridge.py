@@ -0,0 +1,120 @@
+"""对比消息桥接：逐条 run_coroutine_threadsafe 与 MessageBridge 批量桥接
+
+在本机启动一个 WebSocketServer，连接若干个查看端，由生产线程突发写入消息队列，
+统计全部送达耗时、吞吐和端到端延迟。
+
+用法: python benchmarks/bench_bridge.py [--messages 20000] [--viewers 5]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from queue import Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+from websocket_handler import WebSocketServer
+from message_bridge import MessageBridge
+
+
+class DummyTCPServer:
+    def client_list(self):
+        return []
+
+
+def per_message_bridge(message_queue, ws_server, loop):
+    """原实现：每条消息调度一次协程"""
+    while True:
+        message = message_queue.get()
+        if message is None:
+            break
+        asyncio.run_coroutine_threadsafe(ws_server.notify_web_clients(message), loop)
+
+
+def produce(message_queue, count, size):
+    payload = 'x' * size
+    for i in range(count):
+        message_queue.put({
+            "type": "message",
+            "addr": "BENCH",
+            "data": payload,
+            "seq": i,
+            "ts": time.perf_counter()
+        })
+
+
+async def viewer(port, expected, latencies, done):
+    received = 0
+    async with websockets.connect(f'ws://127.0.0.1:{port}', max_size=None) as ws:
+        await ws.send(json.dumps({"type": "init"}))
+        done.append(None)  # 连接已就绪
+        while received < expected:
+            try:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), 3))
+            except asyncio.TimeoutError:
+                break
+            items = frame["items"] if frame["type"] == "batch" else [frame]
+            now = time.perf_counter()
+            for item in items:
+                if item.get("addr") == "BENCH":
+                    received += 1
+                    latencies.append(now - item["ts"])
+    return received
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_case(name, bridge_factory, args, port):
+    loop = asyncio.get_running_loop()
+    ws_server = WebSocketServer(host='127.0.0.1', port=port, tcp_server=DummyTCPServer())
+    server = await ws_server.start()
+    message_queue = Queue()
+
+    latencies, ready = [], []
+    viewers = [asyncio.create_task(viewer(port, args.messages, latencies, ready)) for _ in range(args.viewers)]
+    while len(ready) < args.viewers:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+
+    bridge_thread = threading.Thread(target=bridge_factory(message_queue, ws_server, loop), daemon=True)
+    bridge_thread.start()
+    begin = time.perf_counter()
+    producer = threading.Thread(target=produce, args=(message_queue, args.messages, args.size), daemon=True)
+    producer.start()
+    received = await asyncio.gather(*viewers)
+    elapsed = time.perf_counter() - begin - (3 if min(received) < args.messages else 0)
+    dropped = sum(v["dropped"] for v in ws_server.get_viewer_stats())
+
+    message_queue.put(None)
+    server.close()
+    await server.wait_closed()
+
+    total = sum(received)
+    print(f"{name:<10} 送达 {total}/{args.messages * args.viewers} 条, 丢弃 {dropped}, "
+          f"耗时 {elapsed:.2f}s, 吞吐 {total / elapsed:,.0f} 条/s, "
+          f"延迟 p50 {percentile(latencies, 0.5) * 1000:.1f} ms / p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--viewers', type=int, default=5)
+    parser.add_argument('--size', type=int, default=120, help='单条消息长度')
+    parser.add_argument('--port', type=int, default=18765)
+    args = parser.parse_args()
+
+    await run_case("逐条桥接", lambda q, s, l: (lambda: per_message_bridge(q, s, l)), args, args.port)
+    await run_case("批量桥接", lambda q, s, l: MessageBridge(q, s, l).run, args, args.port + 1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""分块压缩日志：压缩比与分片读取延迟
+
+用法: python benchmarks/bench_compressed_logs.py [--size-mb 100] [--chunk-size 1000]
+"""
+import os
+import sys
+import gzip
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_index import LineIndex
+from log_store import compress_log
+from bench_log_index import make_log
+
+
+def chunk_latency(path, chunk_size, requests):
+    """返回 (建索引耗时, 平均分片读取耗时, 分片内容列表)"""
+    index = LineIndex(path)
+    begin = time.perf_counter()
+    index.update()
+    build = time.perf_counter() - begin
+    total_chunks = (index.total_lines + chunk_size - 1) // chunk_size
+    random.seed(1)
+    chunks = [0, total_chunks - 1] + [random.randrange(total_chunks) for _ in range(requests - 2)]
+    results, elapsed = [], 0.0
+    for chunk in chunks:
+        start = chunk * chunk_size
+        begin = time.perf_counter()
+        results.append(index.read_lines(start, min(start + chunk_size, index.total_lines)))
+        elapsed += time.perf_counter() - begin
+    return build, elapsed / len(chunks), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'server.log.2026-10-03')
+        make_log(plain, args.size_mb)
+        original = os.path.join(tmp, 'original.log')
+        shutil.copyfile(plain, original)
+
+        begin = time.perf_counter()
+        raw_size, gz_size = compress_log(plain)
+        compress_time = time.perf_counter() - begin
+        compressed = plain + '.gz'
+        print(f"原始大小 {raw_size / 1024 / 1024:.1f} MB, 压缩后 {gz_size / 1024 / 1024:.2f} MB, "
+              f"压缩比 {raw_size / gz_size:.1f}x, 压缩耗时 {compress_time:.2f}s")
+
+        with open(compressed, 'rb') as f, open(original, 'rb') as o:
+            assert gzip.decompress(f.read()) == o.read(), "标准gzip解压结果不一致"
+
+        plain_build, plain_avg, plain_chunks = chunk_latency(original, args.chunk_size, args.requests)
+        gz_build, gz_avg, gz_chunks = chunk_latency(compressed, args.chunk_size, args.requests)
+        assert plain_chunks == gz_chunks, "压缩文件的分片内容不一致"
+        print(f"未压缩: 建索引 {plain_build * 1000:.0f} ms, 分片读取平均 {plain_avg * 1000:.2f} ms")
+        print(f"已压缩: 建索引 {gz_build * 1000:.0f} ms, 分片读取平均 {gz_avg * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
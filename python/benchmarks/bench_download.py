@@ -0,0 +1,134 @@
+"""对比日志下载吞吐：原 8KB read/write+flush 循环 与 sendfile/gzip 传输
+
+用法: python benchmarks/bench_download.py [--size-mb 200] [--clients 4]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from http_handler import LogHandler
+from log_store import DayLogSource
+from bench_log_index import make_log
+
+OLD_PORT = 18091
+NEW_PORT = 18092
+
+
+def start_old_server(path):
+    """原实现：每次读8KB、写入后flush"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(8192)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', OLD_PORT), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_new_server(path):
+    """新实现：LogHandler.send_log（sendfile / Range / gzip）"""
+    handler = LogHandler(ThreadPoolExecutor(max_workers=8))
+
+    async def download(request):
+        return await handler.send_log(request, web.StreamResponse(), lambda: DayLogSource([path]), path, "下载")
+
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_get('/file', download)
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', NEW_PORT).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+
+def fetch(port, path, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', path, headers=headers or {})
+    response = conn.getresponse()
+    received = 0
+    while True:
+        data = response.read(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+    conn.close()
+    return received
+
+
+def measure(label, port, path, clients, rounds, size, headers=None):
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: fetch(port, path, headers), range(clients * rounds)))
+    elapsed = time.perf_counter() - begin
+    wire = sum(results)
+    logical = size * len(results)
+    print(f"{label:<22} 传输 {wire / 1024 / 1024:8.1f} MB, 耗时 {elapsed:6.2f}s, "
+          f"有效吞吐 {logical / elapsed / 1024 / 1024:8.1f} MB/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'server.log')
+        make_log(path, args.size_mb)
+        size = os.path.getsize(path)
+        print(f"测试文件: {size / 1024 / 1024:.1f} MB, 并发 {args.clients}, 每个客户端 {args.rounds} 次")
+
+        start_old_server(path)
+        start_new_server(path)
+        time.sleep(0.2)
+
+        old = measure("8KB read/write+flush", OLD_PORT, '/', args.clients, args.rounds, size)
+        new = measure("sendfile", NEW_PORT, '/file', args.clients, args.rounds, size)
+        measure("gzip Content-Encoding", NEW_PORT, '/file', args.clients, args.rounds, size,
+                {'Accept-Encoding': 'gzip'})
+        print(f"sendfile 相对原实现加速 {old / new:.1f}x")
+
+        # 断点续传：只取后半部分
+        half = size // 2
+        received = fetch(NEW_PORT, '/file', {'Range': f'bytes={half}-'})
+        assert received == size - half, "Range响应长度不一致"
+        print(f"Range续传: 从 {half} 字节处继续，收到 {received} 字节")
+
+
+if __name__ == '__main__':
+    main()
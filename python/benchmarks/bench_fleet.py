@@ -0,0 +1,429 @@
+"""设备集群压测：在本机模拟 N 个设备和 M 个网页查看端，端到端测量整个服务器
+
+默认启动 main.py 子进程（使用 config 中的端口），也可以用 --no-spawn 连接已在运行的服务器。
+每个设备先发送 "Wifi :..., SN:..." 握手，再按指定速率和长度发送日志行，行内带有序号和发送时间；
+查看端按序号统计送达和丢失，按发送时间计算 TCP→WebSocket 延迟。
+
+场景:
+  steady     稳定发送，统计吞吐、延迟、丢失、服务器CPU和内存
+  reconnect  重连风暴：所有设备同时断开并重连若干轮，统计全部重新上线和查看端列表恢复一致的耗时
+  duplicate  重复SN：每个SN再建一个新连接，统计旧连接被断开的数量和查看端看到的设备数
+
+用法: python benchmarks/bench_fleet.py [--scenario all] [--devices 200] [--viewers 5] [--rate 10] [--size 120] [--duration 10]
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+from config import TCP_PORT, WEBSOCKET_PORT, HTTP_PORT
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_DIR = os.path.join(SERVER_DIR, 'logs')
+LINE_PATTERN = re.compile(r'seq=(\d+) ts=(\d+\.\d+)')
+
+
+class ProcessStats:
+    """从 /proc 读取进程及其子进程（多进程接入时的接入进程）的CPU时间和内存（非Linux系统返回None）"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.last = None
+
+    def pids(self):
+        pids, i = [self.pid], 0
+        while i < len(pids):
+            try:
+                with open(f'/proc/{pids[i]}/task/{pids[i]}/children') as f:
+                    pids.extend(int(pid) for pid in f.read().split())
+            except OSError:
+                pass
+            i += 1
+        return pids
+
+    def cpu_seconds(self):
+        """进程和当前子进程的CPU时间之和（已退出的子进程不计）"""
+        total = 0.0
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                total += (int(fields[11]) + int(fields[12])) / self.ticks
+        except (OSError, IndexError, ValueError):
+            return None
+        return total
+
+    def memory(self):
+        """返回 (当前RSS, 峰值RSS)，各进程之和，单位MB"""
+        values = {'VmRSS': 0.0, 'VmHWM': 0.0}
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith(('VmRSS:', 'VmHWM:')):
+                            key, value = line.split(':', 1)
+                            values[key] += int(value.split()[0]) / 1024
+        except OSError:
+            return None, None
+        return values['VmRSS'], values['VmHWM']
+
+    def mark(self):
+        self.last = (time.perf_counter(), self.cpu_seconds())
+
+    def cpu_percent(self):
+        """距上次 mark 的平均CPU占用"""
+        now, cpu = time.perf_counter(), self.cpu_seconds()
+        if self.last is None or cpu is None or self.last[1] is None:
+            return None
+        return (cpu - self.last[1]) / (now - self.last[0]) * 100
+
+
+class Device:
+    """模拟设备：握手后按速率发送带序号和时间戳的日志行"""
+
+    def __init__(self, host, sn, size):
+        self.host = host
+        self.sn = sn
+        self.size = size
+        self.reader = None
+        self.writer = None
+        self.seq = 0
+        self.sent = 0
+
+    async def connect(self, timeout=15):
+        # 多进程接入时HTTP先就绪，接入进程稍后才监听TCP端口，连接被拒绝时重试
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.host, TCP_PORT)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        self.writer.write(f"Wifi :bench, SN:{self.sn}\n".encode())
+        await self.writer.drain()
+
+    def line(self):
+        head = f"seq={self.seq} ts={time.time():.6f} "
+        self.seq += 1
+        return head + 'x' * max(self.size - len(head), 0) + "\n"
+
+    async def send(self, count):
+        self.writer.write(''.join(self.line() for _ in range(count)).encode())
+        self.sent += count
+        await self.writer.drain()
+
+    async def closed_by_server(self, timeout):
+        """等待服务器关闭连接，超时返回False"""
+        try:
+            return await asyncio.wait_for(self.reader.read(), timeout) == b''
+        except (asyncio.TimeoutError, ConnectionError):
+            return False
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class Viewer:
+    """模拟网页查看端：统计设备消息的送达、乱序/丢失和延迟，并按增量事件维护设备列表"""
+
+    def __init__(self, host, prefix):
+        self.host = host
+        self.prefix = prefix
+        self.ws = None
+        self.task = None
+        self.received = 0
+        self.frames = 0
+        self.latencies = []
+        self.last_seq = {}   # {SN: 最后收到的序号}
+        self.gaps = 0        # 序号不连续时缺少的条数
+        self.clients = set()
+        self.ready = asyncio.Event()
+
+    async def start(self):
+        self.ws = await websockets.connect(f'ws://{self.host}:{WEBSOCKET_PORT}', max_size=None)
+        await self.ws.send(json.dumps({"type": "init"}))
+        self.task = asyncio.create_task(self.run())
+        await asyncio.wait_for(self.ready.wait(), 10)
+
+    def reset(self):
+        self.received = 0
+        self.latencies = []
+        self.gaps = 0
+
+    async def run(self):
+        try:
+            async for frame in self.ws:
+                now = time.time()
+                self.frames += 1
+                data = json.loads(frame)
+                for item in data["items"] if data["type"] == "batch" else [data]:
+                    self.handle(item, now)
+        except websockets.ConnectionClosed:
+            pass
+
+    def handle(self, item, now):
+        kind = item.get("type")
+        if kind == "message":
+            name = item.get("addr", "")
+            if not name.startswith(self.prefix):
+                return
+            match = LINE_PATTERN.search(item.get("data", ""))
+            if match is None:
+                return
+            seq = int(match.group(1))
+            last = self.last_seq.get(name)
+            if last is not None and seq > last + 1:
+                self.gaps += seq - last - 1
+            self.last_seq[name] = seq
+            self.received += 1
+            self.latencies.append(now - float(match.group(2)))
+        elif kind == "client_update":
+            self.clients = set(item["clients"])
+            self.ready.set()
+        elif kind == "client_joined":
+            self.clients.add(item["client"])
+        elif kind == "client_left":
+            self.clients.discard(item["client"])
+        elif kind == "client_renamed":
+            self.clients.discard(item["old"])
+            self.clients.add(item["new"])
+
+    def device_count(self):
+        return sum(1 for name in self.clients if name.startswith(self.prefix))
+
+    async def close(self):
+        await self.ws.close()
+        await self.task
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fetch_server_metrics(host):
+    """读取服务器 /api/metrics（失败时返回None）"""
+    try:
+        with urllib.request.urlopen(f'http://{host}:{HTTP_PORT}/api/metrics?limit=0', timeout=5) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+async def wait_until(predicate, timeout):
+    """等待条件成立，返回耗时；超时返回None"""
+    begin = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - begin > timeout:
+            return None
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - begin
+
+
+async def connect_all(devices, batch=200):
+    """分批建立连接，避免超过监听队列"""
+    for i in range(0, len(devices), batch):
+        await asyncio.gather(*(device.connect() for device in devices[i:i + batch]))
+
+
+def report_process(stats, label):
+    if stats is None:
+        return
+    cpu = stats.cpu_percent()
+    rss, peak = stats.memory()
+    if cpu is not None and rss is not None:
+        print(f"  {label}服务器 CPU {cpu:.0f}%, RSS {rss:.1f} MB (峰值 {peak:.1f} MB)")
+
+
+async def run_steady(args, devices, viewers, stats):
+    for viewer in viewers:
+        viewer.reset()
+    for device in devices:
+        device.sent = 0
+    if stats is not None:
+        stats.mark()
+    # 每个设备每 tick 秒发送一批，发送时刻错开
+    tick = 0.1
+    per_tick = args.rate * tick
+
+    async def device_loop(device, offset):
+        await asyncio.sleep(offset)
+        begin = time.perf_counter()
+        owed = 0.0
+        while True:
+            elapsed = time.perf_counter() - begin
+            if elapsed >= args.duration:
+                break
+            owed += per_tick
+            count = int(owed)
+            if count:
+                owed -= count
+                await device.send(count)
+            await asyncio.sleep(tick - (time.perf_counter() - begin - elapsed))
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(device_loop(device, tick * i / len(devices)) for i, device in enumerate(devices)))
+    send_time = time.perf_counter() - begin
+    sent = sum(device.sent for device in devices)
+    # 等待查看端收完（或不再增长）
+    expected = sent
+    last, idle_since = -1, time.perf_counter()
+    while time.perf_counter() - idle_since < 2:
+        current = sum(viewer.received for viewer in viewers)
+        if min(viewer.received for viewer in viewers) >= expected:
+            break
+        if current != last:
+            last, idle_since = current, time.perf_counter()
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - begin
+
+    latencies = [value for viewer in viewers for value in viewer.latencies]
+    received = sum(viewer.received for viewer in viewers)
+    missing = sum(max(expected - viewer.received, 0) for viewer in viewers)
+    print(f"[steady] {len(devices)} 设备 x {args.rate} 条/s x {args.size} B, {len(viewers)} 查看端, 发送 {send_time:.1f}s")
+    print(f"  接收 {sent} 条 ({sent / send_time:,.0f} 条/s, {sent * args.size / send_time / 1024 / 1024:.2f} MB/s), "
+          f"查看端送达 {received}/{expected * len(viewers)} ({received / elapsed:,.0f} 条/s)")
+    print(f"  丢失 {missing} 条 (序号缺口 {sum(viewer.gaps for viewer in viewers)}), "
+          f"TCP→WebSocket 延迟 p50 {percentile(latencies, 0.5) * 1000:.1f} ms / "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms / max {max(latencies, default=0) * 1000:.1f} ms")
+    report_process(stats, "")
+
+
+async def run_reconnect(args, devices, viewers, stats):
+    if stats is not None:
+        stats.mark()
+    frames_before = sum(viewer.frames for viewer in viewers)
+    for round_no in range(args.storm_rounds):
+        begin = time.perf_counter()
+        await asyncio.gather(*(device.close() for device in devices))
+        gone = await wait_until(lambda: all(viewer.device_count() == 0 for viewer in viewers), 30)
+        await connect_all(devices)
+        connected = time.perf_counter() - begin
+        back = await wait_until(lambda: all(viewer.device_count() == len(devices) for viewer in viewers), 30)
+        total = time.perf_counter() - begin
+        print(f"[reconnect] 第 {round_no + 1} 轮: 断开后列表清空 "
+              f"{'超时' if gone is None else f'{gone * 1000:.0f} ms'}, 重连完成 {connected * 1000:.0f} ms, "
+              f"查看端列表恢复 {'超时' if back is None else f'{total * 1000:.0f} ms'}")
+    frames = (sum(viewer.frames for viewer in viewers) - frames_before) / len(viewers)
+    print(f"  每个查看端收到 {frames:.0f} 帧（{args.storm_rounds} 轮 x {len(devices) * 2} 次连接变化）")
+    report_process(stats, "")
+
+
+async def run_duplicate(args, devices, viewers, stats):
+    if stats is not None:
+        stats.mark()
+    duplicates = [Device(args.host, device.sn, args.size) for device in devices]
+    begin = time.perf_counter()
+    await connect_all(duplicates)
+    closed = await asyncio.gather(*(device.closed_by_server(10) for device in devices))
+    elapsed = time.perf_counter() - begin
+    settled = await wait_until(lambda: all(viewer.device_count() == len(devices) for viewer in viewers), 10)
+    # 新连接应继续正常送达
+    for viewer in viewers:
+        viewer.reset()
+    await asyncio.gather(*(device.send(1) for device in duplicates))
+    delivered = await wait_until(lambda: all(viewer.received >= len(duplicates) for viewer in viewers), 10)
+    print(f"[duplicate] {len(devices)} 个重复SN连接: 旧连接被断开 {sum(closed)}/{len(devices)} ({elapsed * 1000:.0f} ms), "
+          f"查看端设备数 {[viewer.device_count() for viewer in viewers][:3]}"
+          f"{'' if settled is not None else '（未恢复一致）'}, 新连接消息送达 {'是' if delivered is not None else '否'}")
+    report_process(stats, "")
+    # 之后的场景使用新连接
+    await asyncio.gather(*(device.close() for device in devices))
+    devices[:] = duplicates
+
+
+def start_server():
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=SERVER_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("服务器启动失败")
+        if fetch_server_metrics('127.0.0.1') is not None:
+            return process
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待服务器启动超时")
+
+
+def remove_bench_logs(prefix):
+    for name in os.listdir(LOG_DIR):
+        if name.startswith(prefix):
+            shutil.rmtree(os.path.join(LOG_DIR, name), ignore_errors=True)
+
+
+async def run(args, stats):
+    devices = [Device(args.host, f"{args.prefix}{i:05d}", args.size) for i in range(args.devices)]
+    viewers = [Viewer(args.host, args.prefix) for _ in range(args.viewers)]
+    await asyncio.gather(*(viewer.start() for viewer in viewers))
+    begin = time.perf_counter()
+    await connect_all(devices)
+    online = await wait_until(lambda: all(viewer.device_count() == len(devices) for viewer in viewers), 30)
+    print(f"{len(devices)} 个设备上线 {time.perf_counter() - begin:.2f}s"
+          f"{'' if online is not None else '（查看端列表未完全同步）'}")
+
+    scenarios = ['steady', 'reconnect', 'duplicate'] if args.scenario == 'all' else [args.scenario]
+    for scenario in scenarios:
+        await {'steady': run_steady, 'reconnect': run_reconnect, 'duplicate': run_duplicate}[scenario](
+            args, devices, viewers, stats)
+
+    server_metrics = fetch_server_metrics(args.host)
+    if server_metrics is not None:
+        dropped = sum(viewer["dropped"] for viewer in server_metrics.get("viewers", []))
+        e2e = server_metrics["histograms"]["e2e_latency_seconds"]
+        print(f"服务器统计: 接收 {server_metrics['ingest']['messages']} 条, 查看端队列丢弃 {dropped} 条, "
+              f"合并连接通知 {server_metrics.get('bridge', {}).get('coalesced', 0)} 条, "
+              f"端到端延迟 p50 ≤{e2e['p50']} s / p99 ≤{e2e['p99']} s")
+
+    await asyncio.gather(*(device.close() for device in devices))
+    await asyncio.gather(*(viewer.close() for viewer in viewers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['all', 'steady', 'reconnect', 'duplicate'], default='all')
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--viewers', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=10, help='每个设备每秒发送的行数')
+    parser.add_argument('--size', type=int, default=120, help='每行长度（字节）')
+    parser.add_argument('--duration', type=float, default=10, help='稳定发送时长（秒）')
+    parser.add_argument('--storm-rounds', type=int, default=3, help='重连风暴轮数')
+    parser.add_argument('--prefix', default='BENCH', help='模拟设备的SN前缀')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--no-spawn', action='store_true', help='连接已在运行的服务器，不启动子进程')
+    parser.add_argument('--keep-logs', action='store_true', help='保留模拟设备产生的日志目录')
+    args = parser.parse_args()
+
+    process = None if args.no_spawn else start_server()
+    stats = ProcessStats(process.pid) if process is not None else None
+    try:
+        asyncio.run(run(args, stats))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+            if not args.keep_logs:
+                remove_bench_logs(args.prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""对比日志分片读取：整文件读取+split 与 稀疏行索引
+
+用法: python benchmarks/bench_log_index.py [--size-mb 200] [--chunk-size 1000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_index import LineIndex
+
+
+def make_log(path, size_mb):
+    """生成与 ColoredFormatter 输出格式相近的测试日志"""
+    rng = random.Random(0)
+    target = size_mb * 1024 * 1024
+    with open(path, 'wb') as f:
+        written = 0
+        seconds = 0
+        while written < target:
+            lines = []
+            for _ in range(1000):
+                seconds += rng.random() * 0.05
+                lines.append(
+                    f"2026-10-03 {int(seconds // 3600) % 24:02d}:{int(seconds // 60) % 60:02d}:{int(seconds) % 60:02d},"
+                    f"{int(seconds * 1000) % 1000:03d} - INFO - [Thread-{rng.randrange(64)}] - "
+                    f"\033[92m收到TCP客户端 SF1PRO{rng.randrange(10 ** 9):09d} 消息: temperature={rng.uniform(20, 40):.2f} "
+                    f"humidity={rng.randrange(100)} seq={rng.getrandbits(32)} 状态正常\033[0m\n"
+                )
+            block = ''.join(lines).encode('utf-8')
+            f.write(block)
+            written += len(block)
+
+
+def read_chunk_full(path, chunk_index, chunk_size):
+    """原实现：每次请求读取整个文件并按行切分"""
+    with open(path, 'rb') as f:
+        lines = f.read().decode('utf-8').split('\n')
+    start = chunk_index * chunk_size
+    end = min(start + chunk_size, len(lines))
+    return '\n'.join(lines[start:end])
+
+
+def timed(func, *args):
+    begin = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - begin, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'server.log')
+        make_log(path, args.size_mb)
+        print(f"测试文件: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        index = LineIndex(path)
+        build_time, _ = timed(index.update)
+        total_chunks = (index.total_lines + args.chunk_size - 1) // args.chunk_size
+        print(f"总行数: {index.total_lines}, 分片数: {total_chunks}")
+        print(f"首次建立索引: {build_time * 1000:.1f} ms, 检查点: {len(index.offsets)}")
+
+        chunks = [0, total_chunks - 1] + [random.randrange(total_chunks) for _ in range(args.requests - 2)]
+        full_times, index_times = [], []
+        for chunk in chunks:
+            t_full, expected = timed(read_chunk_full, path, chunk, args.chunk_size)
+            start = chunk * args.chunk_size
+
+            def read_indexed():
+                index.update()
+                return index.read_lines(start, min(start + args.chunk_size, index.total_lines))
+
+            t_index, actual = timed(read_indexed)
+            assert actual == expected, f"分片 {chunk} 内容不一致"
+            full_times.append(t_full)
+            index_times.append(t_index)
+
+        avg_full = sum(full_times) / len(full_times) * 1000
+        avg_index = sum(index_times) / len(index_times) * 1000
+        print(f"整文件读取: 平均 {avg_full:.2f} ms/分片")
+        print(f"行索引读取: 平均 {avg_index:.3f} ms/分片 (加速 {avg_full / avg_index:.0f}x)")
+
+        # 追加写入后增量扩展索引
+        with open(path, 'ab') as f:
+            f.write(b'appended line\n' * 10000)
+        t_extend, _ = timed(index.update)
+        print(f"追加10000行后增量更新索引: {t_extend * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
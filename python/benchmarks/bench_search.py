@@ -0,0 +1,93 @@
+"""对比日志搜索：逐个文件解压扫描 与 倒排索引过滤后校验
+
+用法: python benchmarks/bench_search.py [--files 20] [--size-mb 5]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_index import LineIndex
+from log_store import compress_log, open_log_source
+from log_search import SearchIndex, StoredSearchIndex, query_tokens, ANSI_PATTERN
+from bench_log_index import make_log
+
+
+def grep_file(path, needle):
+    """原方式：解压整个文件后逐行匹配"""
+    with open_log_source(path) as source:
+        text = source.read(0, source.size).decode('utf-8')
+    return [i + 1 for i, line in enumerate(text.split('\n')) if needle in ANSI_PATTERN.sub('', line).lower()]
+
+
+def search_indexed(path, line_index, index, needle):
+    """只读取候选行组并校验"""
+    result = []
+    candidates = index.candidates(query_tokens(needle))
+    groups = range(index.groups) if candidates is None else candidates
+    offsets = line_index.offsets
+    with open_log_source(path) as source:
+        for group_id in groups:
+            start = offsets[group_id]
+            end = offsets[group_id + 1] if group_id + 1 < len(offsets) else source.size
+            text = source.read(start, end - start).decode('utf-8')
+            for i, line in enumerate(text.split('\n')):
+                if needle in ANSI_PATTERN.sub('', line).lower():
+                    result.append(group_id * index.stride + i + 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--size-mb', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'template.log')
+        make_log(plain, args.size_mb)
+        with open(plain, 'rb') as f:
+            template = f.read()
+
+        files, build_time, index_bytes = [], 0.0, 0
+        for n in range(args.files):
+            path = os.path.join(tmp, f'server.log.2026-10-{n + 1:02d}')
+            with open(path, 'wb') as f:
+                f.write(template)
+                # 每个文件中只有一个文件包含目标错误
+                if n == args.files // 2:
+                    f.write('2026-10-03 23:59:59,999 - ERROR - [Thread-1] - 设备响应超时 watchdog_reset\n'.encode('utf-8'))
+            compress_log(path)
+            path += '.gz'
+            begin = time.perf_counter()
+            line_index = LineIndex(path)
+            line_index.update()
+            index = SearchIndex(line_index.stride)
+            index.line_index = line_index
+            with open_log_source(path) as source:
+                index.extend(source, line_index, complete=True)
+            raw = index.to_bytes()
+            build_time += time.perf_counter() - begin
+            index_bytes += len(raw)
+            # 查询时使用从磁盘加载的索引（含行组偏移，不需要重新扫描文件）
+            index = StoredSearchIndex(raw, path)
+            files.append((path, index.line_index, index))
+        print(f"{args.files} 个压缩日志, 建索引共 {build_time:.2f}s, 索引大小 {index_bytes / 1024 / 1024:.1f} MB")
+
+        for needle in ['watchdog_reset', '响应超时', 'humidity=42']:
+            begin = time.perf_counter()
+            expected = [grep_file(path, needle) for path, _, _ in files]
+            grep_time = time.perf_counter() - begin
+            begin = time.perf_counter()
+            actual = [search_indexed(path, line_index, index, needle) for path, line_index, index in files]
+            index_time = time.perf_counter() - begin
+            assert actual == expected, f"搜索结果不一致: {needle}"
+            print(f"{needle!r}: {sum(map(len, actual))} 条结果, 逐个扫描 {grep_time * 1000:.0f} ms, "
+                  f"索引 {index_time * 1000:.1f} ms (加速 {grep_time / index_time:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
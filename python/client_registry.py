@@ -0,0 +1,96 @@
+import threading
+
+
+class ClientRegistry:
+    """线程安全的TCP客户端登记表，按地址、SN和显示名称建立索引
+
+    客户端的变化以增量事件（client_joined / client_left / client_renamed）交给 on_event，
+    事件在持锁时发出，保证与登记表的变化顺序一致；完整列表只在前端初始化时发送。
+    """
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.lock = threading.Lock()
+        self.by_addr = {}   # {addr_str: TCPClient}，按接入顺序
+        self.by_sn = {}     # {sn: TCPClient}
+        self.by_name = {}   # {显示名称: TCPClient}
+        self.names = {}     # {addr_str: 登记时的显示名称}
+        # 已断开客户端的接收统计，与在线客户端的统计相加即为总数
+        self.closed_rx_messages = 0
+        self.closed_rx_bytes = 0
+
+    def __len__(self):
+        return len(self.by_addr)
+
+    def _emit(self, event):
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def add(self, client):
+        """登记新接入的客户端"""
+        with self.lock:
+            self.by_addr[client.addr_str] = client
+            self.names[client.addr_str] = client.display_name
+            self.by_name[client.display_name] = client
+            self._emit({"type": "client_joined", "client": client.display_name})
+
+    def remove(self, client):
+        """注销客户端，客户端不在登记表中（例如已被同SN的新连接顶替）时返回False"""
+        with self.lock:
+            return self._remove_locked(client)
+
+    def _remove_locked(self, client):
+        addr_str = client.addr_str
+        if self.by_addr.get(addr_str) is not client:
+            return False
+        del self.by_addr[addr_str]
+        name = self.names.pop(addr_str)
+        if self.by_name.get(name) is client:
+            del self.by_name[name]
+        if client.sn and self.by_sn.get(client.sn) is client:
+            del self.by_sn[client.sn]
+        self.closed_rx_messages += client.rx_messages
+        self.closed_rx_bytes += client.rx_bytes
+        self._emit({"type": "client_left", "client": name})
+        return True
+
+    def identify(self, client):
+        """客户端识别出SN后更新索引，返回被顶替的同SN旧客户端（没有时为None）"""
+        with self.lock:
+            if self.by_addr.get(client.addr_str) is not client:
+                return None  # 已经断开
+            replaced = self.by_sn.get(client.sn)
+            if replaced is client:
+                replaced = None
+            if replaced is not None:
+                self._remove_locked(replaced)
+            self.by_sn[client.sn] = client
+            old_name = self.names[client.addr_str]
+            new_name = client.display_name
+            if old_name != new_name:
+                if self.by_name.get(old_name) is client:
+                    del self.by_name[old_name]
+                self.by_name[new_name] = client
+                self.names[client.addr_str] = new_name
+                self._emit({"type": "client_renamed", "old": old_name, "new": new_name})
+            return replaced
+
+    def get_by_addr(self, addr_str):
+        return self.by_addr.get(addr_str)
+
+    def get_by_sn(self, sn):
+        return self.by_sn.get(sn)
+
+    def get_by_name(self, display_name):
+        return self.by_name.get(display_name)
+
+    def clients(self, prefix=None):
+        """当前所有客户端（可按显示名称前缀过滤）"""
+        with self.lock:
+            return [client for addr_str, client in self.by_addr.items()
+                    if not prefix or self.names[addr_str].startswith(prefix)]
+
+    def names_snapshot(self):
+        """当前所有客户端的显示名称（按接入顺序）"""
+        with self.lock:
+            return list(self.names.values())
@@ -0,0 +1,86 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logger_config import logger
+from config import SEND_QUEUE_SIZE, SEND_TIMEOUT, SEND_CONCURRENCY, SEND_IO_WORKERS
+
+
+class CommandSender:
+    """向设备下发指令（在事件循环中使用）
+
+    每个设备的指令按顺序写入，排队数超过 max_pending 时直接返回失败，
+    排队加写入超过 timeout 秒视为失败；写入不阻塞事件循环，慢设备不影响其他设备和Web客户端。
+    多播时最多同时写入 concurrency 个设备，并返回每个设备的发送结果。
+    """
+
+    def __init__(self, tcp_server, max_pending=SEND_QUEUE_SIZE, timeout=SEND_TIMEOUT,
+                 concurrency=SEND_CONCURRENCY, workers=SEND_IO_WORKERS):
+        self.tcp_server = tcp_server
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="TCPSend")
+
+    def resolve_targets(self, targets=None, prefix=None):
+        """解析多播目标：targets 为 "all" 或显示名称（SN）列表，prefix 为SN前缀
+
+        返回 (客户端列表, 未找到的名称列表)
+        """
+        registry = self.tcp_server.registry
+        if targets == "all":
+            return registry.clients(), []
+        clients = registry.clients(prefix) if prefix else []
+        seen = set(clients)
+        missing = []
+        for name in targets or []:
+            client = registry.get_by_name(name)
+            if client is None:
+                missing.append(name)
+            elif client not in seen:
+                seen.add(client)
+                clients.append(client)
+        return clients, missing
+
+    async def send(self, client, data):
+        """向单个设备发送数据，返回发送结果"""
+        name = client.display_name
+        if not client.is_alive:
+            return {"target": name, "ok": False, "error": "客户端已断开"}
+        if client.pending_sends >= self.max_pending:
+            return {"target": name, "ok": False, "error": "发送队列已满"}
+        client.pending_sends += 1
+        try:
+            # 排队等待和写入一起计算超时
+            deadline = time.monotonic() + self.timeout
+            await asyncio.wait_for(self._write_in_order(client, data, deadline), self.timeout)
+            if not client.is_alive:
+                return {"target": name, "ok": False, "error": "客户端已断开"}
+            return {"target": name, "ok": True}
+        except (asyncio.TimeoutError, TimeoutError):
+            client.log('warning', f"向TCP客户端 {name} 发送超时（{self.timeout}s）")
+            return {"target": name, "ok": False, "error": "发送超时"}
+        except Exception as e:
+            client.log('error', f"发送消息到TCP客户端 {name} 失败: {str(e)}")
+            client.is_alive = False
+            return {"target": name, "ok": False, "error": str(e)}
+        finally:
+            client.pending_sends -= 1
+
+    async def _write_in_order(self, client, data, deadline):
+        async with client.send_lock:
+            # 线程模式的阻塞写入按剩余时间自行超时
+            await client.write(data, self.executor, max(0.0, deadline - time.monotonic()))
+
+    async def multicast(self, clients, data):
+        """并发向多个设备发送数据，返回每个设备的发送结果"""
+        async def send_limited(client):
+            async with self.semaphore:
+                return await self.send(client, data)
+
+        results = await asyncio.gather(*(send_limited(client) for client in clients))
+        failed = sum(1 for result in results if not result["ok"])
+        logger.info(f"多播发送到 {len(results)} 个设备，失败 {failed} 个")
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
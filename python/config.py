@@ -7,12 +7,94 @@ TCP_HOST = '0.0.0.0'
 TCP_PORT = 45860
 WEBSOCKET_HOST = '0.0.0.0'
 WEBSOCKET_PORT = 8765
+WS_SEND_QUEUE_SIZE = 1000          # 每个Web客户端的发送队列上限（条）
+WS_OVERFLOW_POLICY = 'drop_oldest'  # 队列满时: 'drop_oldest' 丢弃最旧, 'coalesce' 合并状态并提示跳过, 'disconnect' 断开
+BRIDGE_BATCH_MAX = 500             # 消息桥接每批最多条数
+BRIDGE_BATCH_WINDOW = 0.01         # 消息桥接每批最多等待秒数
+BRIDGE_COALESCE_WINDOW = 0.25      # 连接/断开通知与客户端列表变化的合并窗口（秒），0表示不合并
+BRIDGE_COALESCE_THRESHOLD = 5      # 一个窗口内连接类通知超过此条数时合并为一条汇总
+REPLAY_BUFFER_BYTES = 65536        # 每个设备回放缓冲区最大字节数，保存最近的消息
+REPLAY_BUFFER_SLOTS = 1024         # 每个设备回放缓冲区最多保存的消息条数
+REPLAY_BUFFER_INITIAL_BYTES = 4096  # 设备回放缓冲区初始大小，写满时在总内存允许时倍增到最大值
+REPLAY_TOTAL_BYTES = 64 * 1024 * 1024  # 回放缓冲区总内存上限
+REPLAY_IDLE_SECONDS = 600          # 超过该秒数没有新消息的设备，内存不足时可被淘汰
+REPLAY_MAX_ITEMS = 5000            # 单次回放最多返回的消息条数
+HTTP_IO_WORKERS = 16               # HTTP接口读取日志文件使用的线程数
+HTTP_STREAM_CHUNK_SIZE = 65536     # 查看/下载日志时每次发送的字节数
+HTTP_GZIP_MIN_SIZE = 1024          # 日志大于该字节数且客户端接受gzip时压缩传输
+HTTP_GZIP_LEVEL = 1                # 传输压缩级别（1级压缩比接近6级，速度约为3倍）
+METRICS_RATE_INTERVAL = 5          # 指标接口速率的采样间隔（秒），与采集频率和采集方数量无关
+TCP_MODE = 'asyncio'  # TCP接入模式: 'asyncio' 共享事件循环, 'thread' 每连接一个线程
+TCP_RECV_BUFFER_SIZE = 65536  # 每个连接预分配的接收缓冲区大小
+
+# 向设备下发指令配置
+SEND_QUEUE_SIZE = 16          # 每个设备最多排队的指令数，超过时直接返回失败
+SEND_TIMEOUT = 5              # 单条指令写入超时（秒）
+SEND_CONCURRENCY = 256        # 多播时同时写入的设备数
+SEND_IO_WORKERS = 16          # 线程模式下执行阻塞写入的线程数
+TCP_WRITE_BUFFER_HIGH = 65536  # asyncio模式下每个连接的写缓冲区高水位，超过后等待设备接收
+
+# 设备数据分帧配置
+FRAME_MODE = 'newline'        # 'newline' 按分隔符分帧, 'length' 按长度前缀分帧
+FRAME_DELIMITER = '\n'        # newline 模式的分隔符
+FRAME_LENGTH_BYTES = 4        # length 模式的长度前缀字节数（大端）
+FRAME_MAX_SIZE = 65536        # 单帧最大长度，超长的未结束行直接输出
+FRAME_FLUSH_TIMEOUT = 0.5     # 不完整的行等待多少秒后直接输出
 
 # 日志配置
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_DIR = os.path.join(BASE_DIR, 'python', 'logs')
-LOG_BACKUP_COUNT = 30
+LOG_BACKUP_COUNT = 30         # 历史日志保留天数，由后台清理服务删除更早的日志（0表示不按天数删除）
 LOG_ENCODING = 'utf-8'
+LOG_CONSOLE_ECHO = True       # 设备日志是否逐条回显到控制台（设备很多时建议关闭）
+LOG_COMMIT_INTERVAL = 0.5     # 日志写入后最多延迟多少秒提交到文件
+LOG_COMMIT_MAX_RECORDS = 2000 # 未提交的日志达到多少条时立即提交
+LOG_WRITE_BUFFER_SIZE = 65536 # 每个日志文件的写缓冲区大小
+LOG_MAX_OPEN_FILES = 1024     # 同时打开的SN日志文件数上限，超过时关闭最久没有写入的文件，再次写入时重新打开
+LOG_MAX_BYTES = 512 * 1024 * 1024  # 当日日志超过该大小时提前轮转为 server.log.日期.N，0表示只按天轮转
+LOG_COMPRESS_ROTATED = True   # 是否在后台压缩已轮转的日志
+LOG_COMPRESS_BLOCK_SIZE = 262144  # 压缩块大小（解压前），读取任意位置最多解压一块
+LOG_COMPRESS_LEVEL = 6
+LOG_INDEX_STRIDE = 256        # 行索引每隔多少行记录一个偏移
+LOG_INDEX_CACHE_SIZE = 256    # 内存中缓存的行索引文件数量
+
+# 日志保留配置（后台按日期从旧到新删除已轮转的日志，当日日志不删除但计入大小）
+LOG_RETENTION_TOTAL_BYTES = 50 * 1024 ** 3  # 所有SN日志的总大小上限，0表示不限制
+LOG_RETENTION_SN_BYTES = 5 * 1024 ** 3      # 单个SN日志的大小上限，0表示不限制
+LOG_RETENTION_INTERVAL = 60                 # 检查间隔（秒）
+
+# 日志目录缓存配置
+CATALOG_REVALIDATE_INTERVAL = 2  # 列表接口重新检查目录修改时间的最短间隔（秒）
+LOG_LIST_DEFAULT_LIMIT = 1000    # 列表接口默认每页返回的条数
+LOG_LIST_MAX_LIMIT = 10000       # 列表接口每页最多返回的条数
+
+# 日志搜索配置
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, 'python', 'search_index')  # 历史日志的搜索索引目录
+SEARCH_INDEX_CACHE_SIZE = 64  # 内存中缓存的搜索索引文件数量
+SEARCH_DEFAULT_LIMIT = 500    # 默认最多返回的匹配行数
+SEARCH_MAX_LIMIT = 5000       # 单次搜索最多返回的匹配行数
+
+# 多设备时间线配置
+TIMELINE_MAX_SNS = 100          # 单次合并的最大SN数量
+TIMELINE_DEFAULT_LIMIT = 1000   # 每页默认返回的行数
+TIMELINE_MAX_LIMIT = 10000      # 每页最多返回的行数
+TIME_RANGE_MAX_BYTES = 1048576  # 按时间范围查看日志内容时每次最多返回的字节数
+
+# 批量导出配置
+EXPORT_MAX_CONCURRENT = 2       # 同时进行的批量导出数量，每个导出占用一个读取线程
+EXPORT_COMPRESS_LEVEL = 1       # 未压缩日志写入zip时的压缩级别（.gz日志原样存储）
+
+# 日志跟踪配置
+TAIL_MAX_BYTES = 262144       # 每次最多返回的新增字节数
+TAIL_INITIAL_BYTES = 65536    # 不带游标开始跟踪时返回末尾多少字节
+TAIL_POLL_INTERVAL = 0.5      # 跟踪时检查文件大小的间隔（秒）
+TAIL_KEEPALIVE_INTERVAL = 15  # 没有新日志时发送心跳的间隔（秒）
+
+# 多进程接入配置
+INGEST_WORKERS = 0            # 接入进程数，>0时由多个进程通过SO_REUSEPORT共同监听TCP端口并各自写设备日志，0表示在主进程中接入
+INGEST_BUS_PATH = os.path.join(BASE_DIR, 'python', 'ingest.sock')  # 接入进程与主进程通信的Unix socket
+INGEST_STATS_INTERVAL = 1     # 接入进程上报各设备接收统计的间隔（秒）
+INGEST_RESTART_DELAY = 1      # 接入进程意外退出后等待多少秒重新启动
 
 # 静态文件配置
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
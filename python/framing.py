@@ -0,0 +1,96 @@
+import codecs
+from config import (
+    LOG_ENCODING,
+    TCP_RECV_BUFFER_SIZE,
+    FRAME_MODE,
+    FRAME_DELIMITER,
+    FRAME_LENGTH_BYTES,
+    FRAME_MAX_SIZE,
+)
+
+
+class StreamFramer:
+    """单个TCP连接的数据分帧器
+
+    - newline 模式：增量解码UTF-8（跨 recv 的多字节字符不会出错），按分隔符切出完整行
+    - length 模式：每帧前有 length_bytes 字节的大端长度前缀，长度为0的帧视为心跳
+    每次 feed 返回本次数据中所有完整的帧，不完整的部分留待下次。
+    """
+
+    def __init__(self, mode=FRAME_MODE, delimiter=FRAME_DELIMITER, length_bytes=FRAME_LENGTH_BYTES,
+                 max_frame=FRAME_MAX_SIZE, buffer_size=TCP_RECV_BUFFER_SIZE, encoding=LOG_ENCODING):
+        if mode not in ('newline', 'length'):
+            raise ValueError(f"不支持的分帧模式: {mode}")
+        self.mode = mode
+        self.delimiter = delimiter
+        self.length_bytes = length_bytes
+        self.max_frame = max_frame
+        self.encoding = encoding
+        # 预分配的接收缓冲区，recv_into / BufferedProtocol 直接写入
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._pending = ''         # newline 模式下未结束的行
+        self._raw = bytearray()    # length 模式下未凑齐的字节
+
+    @property
+    def has_pending(self):
+        """是否有尚未组成完整帧的数据"""
+        return bool(self._pending or self._raw or self._decoder.getstate()[0])
+
+    def feed(self, data):
+        """输入一段原始数据，返回其中的完整帧列表"""
+        if self.mode == 'length':
+            return self._feed_length(data)
+        return self._feed_newline(data)
+
+    def feed_buffer(self, nbytes):
+        """处理已经写入预分配缓冲区的 nbytes 字节"""
+        return self.feed(self.view[:nbytes])
+
+    def flush(self):
+        """取出剩余的不完整数据（连接关闭或等待超时时调用）"""
+        frames = []
+        if self.mode == 'length':
+            if self._raw:
+                frames.append(bytes(self._raw).decode(self.encoding, errors='replace'))
+                self._raw.clear()
+            return frames
+        text = self._pending + self._decoder.decode(b'', final=True)
+        self._pending = ''
+        text = text.rstrip('\r')
+        if text.strip():
+            frames.append(text)
+        return frames
+
+    def _feed_newline(self, data):
+        text = self._pending + self._decoder.decode(data)
+        parts = text.split(self.delimiter)
+        self._pending = parts.pop()
+        frames = [part.rstrip('\r') for part in parts if part.strip()]
+        # 超长的未结束行直接作为一帧输出，避免缓冲无限增长
+        if len(self._pending) >= self.max_frame:
+            frames.append(self._pending)
+            self._pending = ''
+        return frames
+
+    def _feed_length(self, data):
+        raw = self._raw
+        raw += data
+        frames = []
+        header = self.length_bytes
+        pos = 0
+        while len(raw) - pos >= header:
+            length = int.from_bytes(raw[pos:pos + header], 'big')
+            if length > self.max_frame:
+                raise ValueError(f"帧长度 {length} 超过上限 {self.max_frame}")
+            if len(raw) - pos - header < length:
+                break
+            start = pos + header
+            # 长度为0（心跳）或只有空白的帧不输出，与 newline 模式跳过空行一致
+            text = raw[start:start + length].decode(self.encoding, errors='replace')
+            if text.strip():
+                frames.append(text)
+            pos = start + length
+        del raw[:pos]
+        return frames
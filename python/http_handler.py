@@ -1,446 +1,728 @@
 import os
+import re
 import json
+import time
+import zlib
 import socket
+import asyncio
+import itertools
 import urllib.parse
-from http.server import HTTPServer as BaseHTTPServer, SimpleHTTPRequestHandler
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+import websockets
+from aiohttp import web, WSMsgType
 from logger_config import logger, LOG_DIR
-from datetime import datetime
-
-class LogHandler(SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        # 获取项目根目录
-        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        super().__init__(*args, directory=self.current_dir, **kwargs)
-
-    def translate_path(self, path):
-        """重写路径转换方法，处理静态文件和日志文件"""
-        # 首先尝试查找静态文件
-        static_path = super().translate_path(path)
-        if os.path.exists(static_path):
-            return static_path
-            
-        # 如果是日志相关的API请求，不需要进行路径转换
-        if path.startswith('/api/logs'):
-            return path
-            
-        return static_path
-
-    def do_GET(self):
-        # 解析URL
-        parsed_path = urllib.parse.urlparse(self.path)
-        path = parsed_path.path
-
-        # 处理API请求
-        if path == "/api/logs/sn-list":
-            # 获取SN列表
-            self.send_json_response(self.get_sn_list())
-            return
-        elif path.startswith("/api/logs/date-list/"):
-            # 获取日期列表
-            sn = path.replace("/api/logs/date-list/", "")
-            self.send_json_response(self.get_date_list(sn))
-            return
-        elif path.startswith("/api/logs/content/"):
-            # 获取日志内容
-            log_path = path.replace("/api/logs/content/", "")
-            self.view_log_content(log_path)
-            return
-        elif path == "/api/logs":
-            # 获取日志列表
-            self.send_json_response(self.get_log_list())
-            return
-        elif path.startswith("/api/logs/view/"):
-            # 查看日志内容
-            log_name = os.path.basename(path.replace("/api/logs/view/", ""))
-            self.view_log_file(log_name)
-            return
-        elif path.startswith("/api/logs/download/"):
-            # 下载日志文件
-            log_path = path.replace("/api/logs/download/", "")
-            self.download_log_file(log_path)
-            return
-
-        # 处理静态文件请求
-        if path == "/" or path == "":
-            self.path = "/index.html"
-        elif path in ["/index.html", "/logs.html"]:
-            self.path = path
-        
+from log_index import line_index_cache
+from log_store import DayLogSource, PlainLogSource, day_log_files, open_day_source
+from log_search import search_logs, match_sn
+from log_timeline import Timeline, parse_time, read_time_range, END_OF_TIME
+from log_export import export_files, write_zip
+from log_catalog import log_catalog
+from log_tail import read_tail, live_signature
+from metrics import metrics
+from config import (
+    STATIC_DIR, HTML_DIR, HTTP_IO_WORKERS, HTTP_STREAM_CHUNK_SIZE, HTTP_GZIP_MIN_SIZE, HTTP_GZIP_LEVEL,
+    SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, TIMELINE_MAX_SNS, TIMELINE_DEFAULT_LIMIT, TIMELINE_MAX_LIMIT,
+    LOG_LIST_DEFAULT_LIMIT, LOG_LIST_MAX_LIMIT, TAIL_MAX_BYTES, TAIL_POLL_INTERVAL, TAIL_KEEPALIVE_INTERVAL,
+    EXPORT_MAX_CONCURRENT,
+)
+
+SEARCH_BATCH_SIZE = 20  # 搜索结果每凑够多少条发送一次
+TIMELINE_BATCH_SIZE = 500  # 时间线每次从线程池取出并发送的行数
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class AiohttpWebSocket:
+    """将aiohttp的WebSocket连接包装成websockets连接的接口，使WebSocketServer.handle_websocket可以直接复用"""
+
+    def __init__(self, ws, request):
+        self.ws = ws
+        self.remote_address = request.remote
+
+    async def send(self, message):
+        if self.ws.closed:
+            raise websockets.ConnectionClosedOK(None, None)
+        await self.ws.send_str(message)
+
+    async def recv(self):
+        msg = await self.ws.receive()
+        if msg.type == WSMsgType.TEXT:
+            return msg.data
+        if msg.type == WSMsgType.BINARY:
+            return msg.data.decode()
+        raise websockets.ConnectionClosedOK(None, None)
+
+    async def close(self, code=1000, reason=''):
+        await self.ws.close(code=code, message=reason.encode())
+
+
+class LogHandler:
+    """日志相关的HTTP接口，文件读取都在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.active_exports = 0
+
+    async def run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def next_batch(self, iterator, size):
+        """在线程池中从生成器取出最多size项
+
+        请求被取消（客户端断开或服务器退出）时先等这一批取完再抛出，之后才能关闭生成器。
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, lambda: list(itertools.islice(iterator, size)))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            if not future.cancelled():
+                future.exception()
+            raise
+
+    async def close_in_io(self, generator):
+        """在线程池中关闭生成器，释放其中打开的文件"""
         try:
-            super().do_GET()
+            await self.run_io(generator.close)
+        except RuntimeError:
+            generator.close()  # 线程池已关闭（服务器正在退出），没有其他线程在迭代
+
+    def add_routes(self, router):
+        router.add_get('/api/logs/sn-list', self.handle_sn_list)
+        router.add_get('/api/logs/date-list/{sn}', self.handle_date_list)
+        router.add_get('/api/logs/search', self.handle_search)
+        router.add_get('/api/logs/timeline', self.handle_timeline)
+        router.add_get('/api/logs/export', self.handle_export)
+        router.add_get('/api/logs/tail/{sn}', self.handle_tail)
+        router.add_get('/api/logs/follow/{sn}', self.handle_follow)
+        router.add_get('/api/logs/content/{log_path:.*}', self.handle_content)
+        router.add_get('/api/logs', self.handle_log_list)
+        router.add_get('/api/logs/view/{log_name:.*}', self.handle_view)
+        router.add_get('/api/logs/download/{log_path:.*}', self.handle_download)
+
+    async def handle_sn_list(self, request):
+        """SN列表，支持 prefix 前缀过滤和 offset/limit 分页，总数放在 X-Total-Count 头中"""
+        prefix = request.query.get('prefix')
+        sn_list = await self.run_io(log_catalog.sn_list, prefix)
+        return paginated_response(request, sn_list)
+
+    async def handle_date_list(self, request):
+        date_list = await self.run_io(log_catalog.date_list, request.match_info['sn'])
+        return paginated_response(request, date_list)
+
+    async def handle_log_list(self, request):
+        """所有日志文件信息，可按 sn 或 prefix 过滤，按修改时间倒序分页返回"""
+        logs = await self.run_io(log_catalog.files, request.query.get('sn'), request.query.get('prefix'))
+        return paginated_response(request, logs, LOG_LIST_DEFAULT_LIMIT)
+
+    def resolve_request_log(self, log_path):
+        """将 "SN/日期.log" 解析为 (SN, 日期)，校验失败或当天没有日志时抛出对应的HTTP错误
+
+        一天的日志可能按大小轮转为多个部分，接口把它们按顺序拼接为一个完整的日志（见 DayLogSource）。
+        """
+        # 规范化路径分隔符
+        log_path = log_path.replace('\\', '/').strip('/')
+
+        # 获取请求的日期和SN
+        path_parts = log_path.split('/')
+        if len(path_parts) != 2:
+            logger.error(f"无效的日志路径格式: {log_path}")
+            raise web.HTTPBadRequest(text="Invalid log path format")
+
+        sn_dir, log_file = path_parts
+        requested_date = log_file.replace('.log', '')
+        if not DATE_PATTERN.match(requested_date):
+            logger.error(f"无效的日志日期: {requested_date}")
+            raise web.HTTPBadRequest(text="Invalid log date")
+
+        # 安全检查：SN必须是LOG_DIR下的目录
+        self.check_sn_dir(sn_dir)
+        # server.log.日期[.N][.gz]，内容日期为当天的server.log在最后
+        paths = day_log_files(sn_dir, requested_date)
+        logger.info(f"日志 {sn_dir}/{requested_date} 对应文件: {[os.path.basename(path) for path in paths]}")
+        if not paths:
+            logger.error(f"日志文件不存在: {sn_dir}/{requested_date}")
+            raise web.HTTPNotFound(text="Log file not found")
+        return sn_dir, requested_date
+
+    def open_request_log(self, log_path):
+        """打开请求的一天的日志，返回 (SN, 日期, DayLogSource)"""
+        sn_dir, requested_date = self.resolve_request_log(log_path)
+        source = open_day_source(sn_dir, requested_date)
+        if source is None:
+            raise web.HTTPNotFound(text="Log file not found")
+        return sn_dir, requested_date, source
+
+    def check_readable(self, full_path):
+        if not os.path.exists(full_path):
+            logger.error(f"日志文件不存在: {full_path}")
+            raise web.HTTPNotFound(text="Log file not found")
+        if not os.access(full_path, os.R_OK):
+            logger.error(f"无权限访问日志文件: {full_path}")
+            raise web.HTTPForbidden(text="Permission denied")
+
+    def check_sn_dir(self, sn):
+        """检查SN目录是否合法且存在"""
+        sn_path = os.path.abspath(os.path.join(LOG_DIR, sn))
+        if not sn or os.path.dirname(sn_path) != os.path.abspath(LOG_DIR):
+            logger.warning(f"无效的SN: {sn}")
+            raise web.HTTPBadRequest(text="Invalid SN")
+        if not os.path.isdir(sn_path):
+            raise web.HTTPNotFound(text="SN not found")
+
+    async def handle_content(self, request):
+        """查看日志内容（按行分片），指定 from/to 时按时间范围读取"""
+        if 'from' in request.query or 'to' in request.query:
+            return await self.handle_content_by_time(request)
+        try:
+            # 获取分片参数
+            chunk_size = int(request.query.get('chunk_size', 1000))  # 默认每片1000行
+            chunk_index = int(request.query.get('chunk_index', 0))  # 默认从第0片开始
+            response_data = await self.run_io(self.read_log_chunk, request.match_info['log_path'], chunk_size, chunk_index)
+        except web.HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"处理HTTP请求出错: {str(e)}")
-            self.send_error(404, str(e))
-
-    def send_json_response(self, data):
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')  # 允许跨域访问
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
-
-    def get_sn_list(self):
-        """获取所有SN列表"""
-        sn_list = []
+            logger.error(f"读取日志内容失败: {str(e)}")
+            raise web.HTTPInternalServerError(text=str(e))
+        logger.info(f"成功发送日志分片 {chunk_index + 1}/{response_data['total_chunks']}")
+        return web.json_response(response_data, headers={'Cache-Control': 'no-cache'})
+
+    async def handle_content_by_time(self, request):
+        """按时间范围查看日志内容：二分查找定位字节偏移，不需要建立行索引，
+        内容超过一次返回的大小时用 offset=next_offset 继续读取"""
         try:
-            # 遍历日志目录
-            for item in os.listdir(LOG_DIR):
-                item_path = os.path.join(LOG_DIR, item)
-                # 如果是目录，且不是default目录，则认为是SN目录
-                if os.path.isdir(item_path) and item != 'default':
-                    sn_list.append(item)
-            sn_list.sort()  # 按字母顺序排序
-            logger.info(f"找到 {len(sn_list)} 个SN目录")
+            start = parse_time(request.query['from']) if request.query.get('from') else None
+            end = parse_time(request.query['to']) if request.query.get('to') else None
+            offset = int(request.query['offset']) if request.query.get('offset') else None
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid from, to or offset")
+        try:
+            response_data = await self.run_io(self.read_log_time_range, request.match_info['log_path'], start, end, offset)
+        except web.HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"获取SN列表失败: {str(e)}")
-        return sn_list
+            logger.error(f"按时间读取日志内容失败: {str(e)}")
+            raise web.HTTPInternalServerError(text=str(e))
+        return web.json_response(response_data, headers={'Cache-Control': 'no-cache'})
+
+    def read_log_time_range(self, log_path, start, end, offset):
+        _, _, source = self.open_request_log(log_path)
+        with source:
+            response_data = read_time_range(source, start, end, offset)
+        response_data.update({'from': start, 'to': end})
+        return response_data
+
+    def read_log_chunk(self, log_path, chunk_size, chunk_index):
+        sn_dir, requested_date = self.resolve_request_log(log_path)
+
+        # 通过稀疏行索引只读取当前分片所需的字节范围，行号为当天各部分拼接后的行号
+        index = line_index_cache.get_day(sn_dir, requested_date)
+        total_lines = index.total_lines
+
+        # 计算当前分片的起始和结束行
+        start_line = chunk_index * chunk_size
+        end_line = min(start_line + chunk_size, total_lines)
+
+        return {
+            'content': index.read_lines(start_line, end_line),
+            'total_lines': total_lines,
+            'current_chunk': chunk_index,
+            'total_chunks': (total_lines + chunk_size - 1) // chunk_size,
+            'start_line': start_line,
+            'end_line': end_line
+        }
 
-    def get_date_list(self, sn):
-        """获取指定SN的日期列表"""
-        date_list = []
+    async def send_log(self, request, response, opener, log_path, description):
+        """发送日志（DayLogSource）：支持Range断点续传，未压缩的部分通过sendfile零拷贝发送，
+        客户端接受gzip时对完整响应进行压缩；已压缩的部分按解压后的内容处理"""
         try:
-            # 确定目标目录
-            target_dir = os.path.join(LOG_DIR, 'default' if sn == 'default' else sn)
-            logger.info(f"正在搜索日志目录: {target_dir}")
-            
-            if not os.path.exists(target_dir):
-                logger.warning(f"目录不存在: {target_dir}")
-                return date_list
-
-            # 遍历目录中的日志文件
-            for filename in os.listdir(target_dir):
-                if filename.startswith('server.log'):
-                    if filename == 'server.log':
-                        # 当前日志文件
-                        date_list.append(datetime.now().strftime('%Y-%m-%d'))
-                    else:
-                        # 历史日志文件，格式为 server.log.YYYY-MM-DD
-                        date = filename.split('.')[-1]
-                        date_list.append(date)
-                    logger.info(f"找到日志文件: {filename}")
-            
-            # 按日期倒序排序，最新的在前
-            date_list.sort(reverse=True)
-            logger.info(f"在 {target_dir} 中找到 {len(date_list)} 个日志文件: {date_list}")
+            source = await self.run_io(opener)
+        except web.HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"获取日期列表失败: {str(e)}")
-        return date_list
+            logger.error(f"处理日志{description}请求时出错 {log_path}: {str(e)}")
+            raise web.HTTPInternalServerError(text="Internal Server Error")
+        size = source.size
+        logger.info(f"日志文件大小: {size} bytes")
 
-    def view_log_content(self, log_path):
-        """查看日志内容"""
         try:
-            # 规范化路径分隔符
-            log_path = log_path.replace('\\', '/').strip('/')
-            
-            # 获取请求的日期和SN
-            path_parts = log_path.split('/')
-            if len(path_parts) != 2:
-                logger.error(f"无效的日志路径格式: {log_path}")
-                self.send_error(400, "Invalid log path format")
-                return
-                
-            sn_dir, log_file = path_parts
-            requested_date = log_file.replace('.log', '')
-            current_date = datetime.now().strftime('%Y-%m-%d')
-            
-            # 构建正确的日志文件路径
-            sn_dir_path = os.path.join(LOG_DIR, sn_dir)
-            
-            # 如果是当日日志，使用server.log
-            if requested_date == current_date:
-                full_path = os.path.join(sn_dir_path, 'server.log')
-                logger.info(f"当日日志，使用server.log: {full_path}")
+            stat = source.stat()
+            etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            response.headers['ETag'] = etag
+            response.headers['Accept-Ranges'] = 'bytes'
+            # 是否压缩取决于Accept-Encoding，缓存需要分别保存两种内容
+            response.headers['Vary'] = 'Accept-Encoding'
+            response.last_modified = int(stat.st_mtime)
+
+            start, end = 0, size
+            byte_range = None
+            if 'Range' in request.headers and if_range_matches(request.headers.get('If-Range'), etag, stat.st_mtime):
+                byte_range = parse_range(request.headers['Range'], size)
+                if byte_range is False:
+                    raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{size}'})
+
+            gzip_encoding = False
+            if byte_range:
+                start, end = byte_range
+                response.set_status(206)
+                response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+                response.content_length = end - start
+                logger.info(f"断点续传 {log_path}: bytes {start}-{end - 1}/{size}")
+            elif size >= HTTP_GZIP_MIN_SIZE and accepts_gzip(request):
+                gzip_encoding = True
+                response.headers['Content-Encoding'] = 'gzip'
+                # 压缩结果与原内容的字节不同，使用单独的弱校验值，不能用于If-Range续传
+                response.headers['ETag'] = f'W/"{etag[1:-1]}-gzip"'
             else:
-                # 历史日志，使用server.log.YYYY-MM-DD格式
-                full_path = os.path.join(sn_dir_path, f'server.log.{requested_date}')
-                logger.info(f"历史日志，使用server.log.{requested_date}: {full_path}")
-            
-            # 规范化路径
-            full_path = os.path.normpath(full_path)
-            
-            # 安全检查：确保路径在LOG_DIR内
-            if not os.path.abspath(full_path).startswith(os.path.abspath(LOG_DIR)):
-                logger.warning(f"尝试访问日志目录外的文件: {full_path}")
-                self.send_error(403, "Access denied")
-                return
-            
-            if not os.path.exists(full_path):
-                logger.error(f"日志文件不存在: {full_path}")
-                self.send_error(404, "Log file not found")
-                return
-                
-            if not os.access(full_path, os.R_OK):
-                logger.error(f"无权限访问日志文件: {full_path}")
-                self.send_error(403, "Permission denied")
-                return
+                response.content_length = size
 
-            # 获取分片参数
-            query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
-            chunk_size = int(query_params.get('chunk_size', [1000])[0])  # 默认每片1000行
-            chunk_index = int(query_params.get('chunk_index', [0])[0])  # 默认从第0片开始
-            
-            # 读取文件内容
-            with open(full_path, 'rb') as f:
-                content = f.read().decode('utf-8')
-                lines = content.split('\n')
-                total_lines = len(lines)
-                
-                # 计算当前分片的起始和结束行
-                start_line = chunk_index * chunk_size
-                end_line = min(start_line + chunk_size, total_lines)
-                
-                # 获取当前分片的内容
-                chunk_content = '\n'.join(lines[start_line:end_line])
-                
-                # 发送响应头
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Cache-Control', 'no-cache')
-                self.end_headers()
-                
-                # 发送JSON响应
-                response_data = {
-                    'content': chunk_content,
-                    'total_lines': total_lines,
-                    'current_chunk': chunk_index,
-                    'total_chunks': (total_lines + chunk_size - 1) // chunk_size,
-                    'start_line': start_line,
-                    'end_line': end_line
-                }
-                
-                self.wfile.write(json.dumps(response_data).encode())
-                logger.info(f"成功发送日志分片 {chunk_index + 1}/{response_data['total_chunks']}")
-                    
-        except Exception as e:
-            logger.error(f"读取日志内容失败: {str(e)}")
-            self.send_error(500, str(e))
+            await response.prepare(request)
+            if request.method == 'HEAD':
+                pass
+            elif gzip_encoding:
+                await self.send_gzip(response, source, start, end)
+            else:
+                for part, pos, length in source.spans(start, end):
+                    if isinstance(part, PlainLogSource) and request.transport is not None:
+                        # 未压缩的部分直接由内核从文件发送到socket
+                        await asyncio.get_running_loop().sendfile(request.transport, part.file, pos, length)
+                        continue
+                    part_end = pos + length
+                    while pos < part_end:
+                        chunk = await self.run_io(part.read, pos, min(HTTP_STREAM_CHUNK_SIZE, part_end - pos))
+                        if not chunk:
+                            break
+                        await response.write(chunk)
+                        pos += len(chunk)
+            await response.write_eof()
+        except (ConnectionResetError, ConnectionAbortedError) as e:
+            logger.warning(f"客户端中断了{description}: {str(e)}")
+        finally:
+            source.close()
+        return response
 
-    def get_log_list(self):
-        logs = []
-        try:
-            # 确保使用绝对路径
-            log_dir = os.path.abspath(LOG_DIR)
-            logger.info(f"正在搜索日志目录: {log_dir}")
-            
-            if not os.path.exists(log_dir):
-                logger.warning(f"日志目录不存在: {log_dir}")
-                return logs
-                
-            # 遍历所有SN目录
-            for sn_dir in os.listdir(log_dir):
-                sn_path = os.path.join(log_dir, sn_dir)
-                if not os.path.isdir(sn_path):
-                    continue
-                    
-                # 遍历SN目录下的日志文件
-                for filename in os.listdir(sn_path):
-                    if filename.startswith('server.log'):
-                        file_path = os.path.join(sn_path, filename)
-                        try:
-                            stat = os.stat(file_path)
-                            date = filename.split('.')[-1] if filename != 'server.log' else datetime.now().strftime('%Y-%m-%d')
-                            logs.append({
-                                'name': f"{sn_dir}/{filename}",
-                                'sn': sn_dir,
-                                'date': date,
-                                'size': stat.st_size,
-                                'modified_time': int(stat.st_mtime)
-                            })
-                            logger.debug(f"找到日志文件: {filename} in {sn_dir}")
-                        except OSError as e:
-                            logger.error(f"获取日志文件信息失败 {filename}: {str(e)}")
-                            
-            # 按修改时间排序，最新的在前
-            logs.sort(key=lambda x: x['modified_time'], reverse=True)
-            logger.info(f"共找到 {len(logs)} 个日志文件")
-        except Exception as e:
-            logger.error(f"获取日志列表失败: {str(e)}")
-        return logs
+    async def send_gzip(self, response, source, start, end):
+        """边读取边压缩发送，压缩在线程池中进行"""
+        compressor = zlib.compressobj(HTTP_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        def compress_chunk(pos):
+            data = source.read(pos, min(HTTP_STREAM_CHUNK_SIZE, end - pos))
+            return len(data), compressor.compress(data)
 
-    def view_log_file(self, log_name):
+        pos = start
+        while pos < end:
+            length, compressed = await self.run_io(compress_chunk, pos)
+            if not length:
+                break
+            if compressed:
+                await response.write(compressed)
+            pos += length
+        await response.write(compressor.flush())
+
+    async def handle_view(self, request):
         """处理日志查看请求"""
+        log_name = os.path.basename(request.match_info['log_name'])
         log_path = os.path.abspath(os.path.join(LOG_DIR, log_name))
         logger.info(f"尝试访问日志文件: {log_path}")
-        
+
         # 验证路径，确保不会访问到日志目录之外的文件
         if not log_path.startswith(os.path.abspath(LOG_DIR)):
             logger.warning(f"尝试访问日志目录外的文件: {log_path}")
-            self.send_error(403, "Access denied")
-            return
-            
+            raise web.HTTPForbidden(text="Access denied")
+
+        # 历史日志可能已被后台压缩
+        if not os.path.exists(log_path) and os.path.exists(log_path + '.gz'):
+            log_path += '.gz'
+        self.check_readable(log_path)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Pragma': 'no-cache',
+            'Expires': '0',
+        })
+        return await self.send_log(request, response, lambda: DayLogSource([log_path]), log_path, "查看")
+
+    async def handle_download(self, request):
+        """处理日志下载请求"""
+        log_path = request.match_info['log_path']
+        sn_dir, requested_date = await self.run_io(self.resolve_request_log, log_path)
+
+        # 构建下载文件名
+        download_filename = f"{sn_dir}_{requested_date}.log"
+        encoded_filename = urllib.parse.quote(download_filename)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename="{encoded_filename}"',
+            'Content-Description': 'File Transfer',
+            'Expires': '0',
+            'Cache-Control': 'must-revalidate',
+            'Pragma': 'public',
+        })
+        await self.send_log(request, response, lambda: self.open_request_log(log_path)[2], log_path, "下载")
+        logger.info(f"成功发送日志文件: {download_filename}")
+        return response
+
+    async def handle_export(self, request):
+        """批量导出日志：把多个SN在日期范围内的日志打包成zip，边打包边发送，不生成临时文件
+
+        参数: sn=SN1,SN2,前缀* 或 prefix=前缀，[from=YYYY-MM-DD] [to=YYYY-MM-DD]
+        """
+        sn_patterns = [sn.strip() for sn in request.query.get('sn', '').split(',') if sn.strip()]
+        if request.query.get('prefix'):
+            sn_patterns.append(request.query['prefix'] + '*')
+        if not sn_patterns:
+            raise web.HTTPBadRequest(text="Missing sn or prefix")
+        date_from = request.query.get('from')
+        date_to = request.query.get('to')
+        files = await self.run_io(export_files, sn_patterns, date_from, date_to)
+        if not files:
+            raise web.HTTPNotFound(text="No matching logs")
+        if self.active_exports >= EXPORT_MAX_CONCURRENT:
+            raise web.HTTPServiceUnavailable(text="Too many exports in progress", headers={'Retry-After': '60'})
+
+        download_filename = f"logs_{date_from or 'all'}_{date_to or 'all'}.zip"
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/zip',
+            'Content-Disposition': f'attachment; filename="{urllib.parse.quote(download_filename)}"',
+            'Cache-Control': 'no-cache',
+        })
+        self.active_exports += 1
         try:
-            # 检查文件是否存在和可访问
-            if not os.path.exists(log_path):
-                logger.error(f"日志文件不存在: {log_path}")
-                self.send_error(404, "Log file not found")
-                return
-            if not os.access(log_path, os.R_OK):
-                logger.error(f"无权限访问日志文件: {log_path}")
-                self.send_error(403, "Permission denied")
-                return
-
-            # 获取文件大小
-            file_size = os.path.getsize(log_path)
-            logger.info(f"日志文件大小: {file_size} bytes")
-            
-            # 准备响应头
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
-            self.send_header('Content-Length', str(file_size))
-            self.end_headers()
-
-            # 分块读取并发送文件内容
-            with open(log_path, 'rb') as f:
-                try:
-                    chunk_size = 8192  # 8KB chunks
-                    while True:
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        self.wfile.write(chunk)
-                        self.wfile.flush()
-                except (ConnectionAbortedError, BrokenPipeError) as e:
-                    logger.warning(f"客户端中断了查看: {str(e)}")
-                    return
-                except Exception as e:
-                    logger.error(f"发送日志内容失败 {log_path}: {str(e)}")
-                    if not self.wfile.closed:
-                        self.send_error(500, "Internal Server Error")
-                    return
+            await response.prepare(request)
+            writer = ResponseWriter(response, asyncio.get_running_loop())
+            count, total = await self.run_io(write_zip, files, writer)
+        except (ConnectionResetError, ConnectionAbortedError) as e:
+            logger.warning(f"客户端中断了批量导出: {str(e)}")
+            return response
+        finally:
+            self.active_exports -= 1
+        await response.write_eof()
+        logger.info(f"批量导出完成: {count} 个文件, {total / 1024 / 1024:.1f} MB")
+        return response
+
+    async def handle_search(self, request):
+        """搜索日志，以NDJSON逐行返回匹配结果，最后一行为汇总信息"""
+        query = request.query.get('q', '')
+        if not query.strip():
+            raise web.HTTPBadRequest(text="Missing query")
+        sn_patterns = [sn.strip() for sn in request.query.get('sn', '').split(',') if sn.strip()]
+        date_from = request.query.get('from')
+        date_to = request.query.get('to')
+        try:
+            limit = min(int(request.query.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid limit")
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-ndjson; charset=utf-8',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
 
+        results = search_logs(query, sn_patterns, date_from, date_to, limit)
+        count = 0
+        try:
+            while True:
+                # 搜索在线程池中进行，每次取一批结果
+                batch = await self.next_batch(results, SEARCH_BATCH_SIZE)
+                if not batch:
+                    break
+                count += len(batch)
+                await response.write(b''.join(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n' for item in batch))
+            summary = {'done': True, 'count': count, 'truncated': count >= limit}
+            logger.info(f"日志搜索 \"{query}\" 返回 {count} 条结果")
+        except (ConnectionResetError, ConnectionAbortedError) as e:
+            logger.warning(f"客户端中断了搜索: {str(e)}")
+            return response
         except Exception as e:
-            logger.error(f"处理日志查看请求时出错 {log_path}: {str(e)}")
-            try:
-                error_msg = str(e).encode('ascii', 'replace').decode('ascii')
-                self.send_error(500, error_msg)
-            except Exception as e2:
-                logger.error(f"发送错误响应时出错: {str(e2)}")
-                self.send_error(500, "Internal Server Error")
-
-    def download_log_file(self, log_path):
-        """处理日志下载请求"""
+            logger.error(f"搜索日志失败: {str(e)}")
+            summary = {'done': True, 'count': count, 'error': str(e)}
+        finally:
+            await self.close_in_io(results)
+        await response.write(json.dumps(summary, ensure_ascii=False).encode('utf-8') + b'\n')
+        await response.write_eof()
+        return response
+
+    async def handle_timeline(self, request):
+        """多个SN的日志按时间合并，以NDJSON逐行返回 {sn, time, text}，最后一行为汇总信息（含下一页的游标）
+
+        参数: sn=SN1,SN2,前缀* from=2026-10-03T14:00 [to=...] [limit=N] [cursor=...]
+        """
+        patterns = [sn.strip() for sn in request.query.get('sn', '').split(',') if sn.strip()]
+        if not patterns:
+            raise web.HTTPBadRequest(text="Missing sn")
         try:
-            # 规范化路径分隔符
-            log_path = log_path.replace('\\', '/').strip('/')
-            
-            # 获取请求的日期和SN
-            path_parts = log_path.split('/')
-            if len(path_parts) != 2:
-                logger.error(f"无效的日志路径格式: {log_path}")
-                self.send_error(400, "Invalid log path format")
-                return
-                
-            sn_dir, log_file = path_parts
-            requested_date = log_file.replace('.log', '')
-            current_date = datetime.now().strftime('%Y-%m-%d')
-            
-            # 构建正确的日志文件路径
-            sn_dir_path = os.path.join(LOG_DIR, sn_dir)
-            
-            # 如果是当日日志，使用server.log
-            if requested_date == current_date:
-                full_path = os.path.join(sn_dir_path, 'server.log')
-                logger.info(f"当日日志，使用server.log: {full_path}")
-            else:
-                # 历史日志，使用server.log.YYYY-MM-DD格式
-                full_path = os.path.join(sn_dir_path, f'server.log.{requested_date}')
-                logger.info(f"历史日志，使用server.log.{requested_date}: {full_path}")
-            
-            # 规范化路径
-            full_path = os.path.normpath(full_path)
-            
-            # 安全检查：确保路径在LOG_DIR内
-            if not os.path.abspath(full_path).startswith(os.path.abspath(LOG_DIR)):
-                logger.warning(f"尝试访问日志目录外的文件: {full_path}")
-                self.send_error(403, "Access denied")
-                return
-            
-            if not os.path.exists(full_path):
-                logger.error(f"日志文件不存在: {full_path}")
-                self.send_error(404, "Log file not found")
-                return
-                
-            if not os.access(full_path, os.R_OK):
-                logger.error(f"无权限访问日志文件: {full_path}")
-                self.send_error(403, "Permission denied")
-                return
-
-            # 获取文件大小
-            file_size = os.path.getsize(full_path)
-            logger.info(f"日志文件大小: {file_size} bytes")
-            
-            # 准备响应头
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/octet-stream')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            
-            # 构建下载文件名
-            download_filename = f"{sn_dir}_{requested_date}.log"
-            encoded_filename = urllib.parse.quote(download_filename)
-            self.send_header('Content-Disposition', f'attachment; filename="{encoded_filename}"')
-            
-            # 添加下载相关头
-            self.send_header('Content-Description', 'File Transfer')
-            self.send_header('Content-Transfer-Encoding', 'binary')
-            self.send_header('Expires', '0')
-            self.send_header('Cache-Control', 'must-revalidate')
-            self.send_header('Pragma', 'public')
-            self.send_header('Content-Length', str(file_size))
-            self.end_headers()
-
-            # 分块读取并发送文件内容
-            with open(full_path, 'rb') as f:
-                try:
-                    chunk_size = 8192  # 8KB chunks
+            start = parse_time(request.query['from'])
+            end = parse_time(request.query['to']) if request.query.get('to') else None
+            limit = min(max(int(request.query.get('limit', TIMELINE_DEFAULT_LIMIT)), 1), TIMELINE_MAX_LIMIT)
+        except KeyError:
+            raise web.HTTPBadRequest(text="Missing from")
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid from, to or limit")
+        sns = [sn for sn in await self.run_io(log_catalog.sn_list, None, True) if match_sn(sn, patterns)]
+        if not sns:
+            raise web.HTTPNotFound(text="No matching SN")
+        if len(sns) > TIMELINE_MAX_SNS:
+            raise web.HTTPBadRequest(text=f"Too many SNs ({len(sns)} > {TIMELINE_MAX_SNS})")
+        try:
+            timeline = Timeline(sns, start, end or END_OF_TIME, request.query.get('cursor'))
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid cursor")
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-ndjson; charset=utf-8',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+        lines = iter(timeline)
+        count = 0
+        try:
+            while count < limit:
+                # 归并在线程池中进行，每次取一批
+                batch = await self.next_batch(lines, min(TIMELINE_BATCH_SIZE, limit - count))
+                if not batch:
+                    break
+                count += len(batch)
+                await response.write(b''.join(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n' for item in batch))
+            summary = {'done': True, 'count': count, 'sns': sns,
+                       'next_cursor': timeline.cursor() if count >= limit else None}
+        except (ConnectionResetError, ConnectionAbortedError) as e:
+            logger.warning(f"客户端中断了时间线读取: {str(e)}")
+            return response
+        except Exception as e:
+            logger.error(f"读取时间线失败: {str(e)}")
+            summary = {'done': True, 'count': count, 'error': str(e)}
+        finally:
+            await self.close_in_io(lines)
+        await response.write(json.dumps(summary, ensure_ascii=False).encode('utf-8') + b'\n')
+        await response.write_eof()
+        return response
+
+    async def handle_tail(self, request):
+        """返回游标之后追加的完整日志行及新的游标"""
+        sn = request.match_info['sn']
+        self.check_sn_dir(sn)
+        try:
+            max_bytes = min(int(request.query.get('max_bytes', TAIL_MAX_BYTES)), TAIL_MAX_BYTES)
+            result = await self.run_io(read_tail, sn, request.query.get('cursor'), max_bytes)
+        except ValueError as e:
+            logger.warning(f"日志增量请求参数错误 {sn}: {str(e)}")
+            raise web.HTTPBadRequest(text="Invalid cursor or max_bytes")
+        except Exception as e:
+            logger.error(f"读取日志增量失败 {sn}: {str(e)}")
+            raise web.HTTPInternalServerError(text=str(e))
+        return web.json_response(result, headers={'Cache-Control': 'no-cache'})
+
+    async def handle_follow(self, request):
+        """SSE跟踪当前日志：轮询文件大小，只在变化时读取新增内容"""
+        sn = request.match_info['sn']
+        self.check_sn_dir(sn)
+        # 浏览器断线重连时会带上最后收到的事件id（即游标）
+        cursor = request.query.get('cursor') or request.headers.get('Last-Event-ID')
+        try:
+            result = await self.run_io(read_tail, sn, cursor)
+        except ValueError as e:
+            logger.warning(f"日志跟踪请求参数错误 {sn}: {str(e)}")
+            raise web.HTTPBadRequest(text="Invalid cursor")
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+        logger.info(f"开始跟踪日志: {sn}")
+
+        try:
+            last_signature = live_signature(sn)
+            last_write = 0
+            while True:
+                cursor = result['cursor']
+                if result['content'] or result['reset'] or not last_write:
+                    await response.write(f"id: {cursor}\nevent: lines\ndata: {json.dumps(result)}\n\n".encode())
+                    last_write = time.monotonic()
+                if not result['more']:
+                    # 等待文件变化，期间定时发送注释行保持连接并检测客户端断开
                     while True:
-                        chunk = f.read(chunk_size)
-                        if not chunk:
+                        await asyncio.sleep(TAIL_POLL_INTERVAL)
+                        signature = live_signature(sn)
+                        if signature != last_signature:
+                            last_signature = signature
                             break
-                        self.wfile.write(chunk)
-                        self.wfile.flush()
-                    logger.info(f"成功发送日志文件: {download_filename}")
-                except (ConnectionAbortedError, BrokenPipeError) as e:
-                    logger.warning(f"客户端中断了下载: {str(e)}")
-                    return
-                except Exception as e:
-                    logger.error(f"发送日志文件失败 {full_path}: {str(e)}")
-                    if not self.wfile.closed:
-                        self.send_error(500, "Internal Server Error")
-                    return
-
+                        if time.monotonic() - last_write > TAIL_KEEPALIVE_INTERVAL:
+                            await response.write(b": ping\n\n")
+                            last_write = time.monotonic()
+                result = await self.run_io(read_tail, sn, cursor)
+        except (ConnectionResetError, ConnectionAbortedError):
+            logger.info(f"停止跟踪日志: {sn}")
         except Exception as e:
-            logger.error(f"处理日志下载请求时出错: {str(e)}")
-            try:
-                error_msg = str(e).encode('ascii', 'replace').decode('ascii')
-                self.send_error(500, error_msg)
-            except Exception as e2:
-                logger.error(f"发送错误响应时出错: {str(e2)}")
-                self.send_error(500, "Internal Server Error")
+            logger.error(f"跟踪日志失败 {sn}: {str(e)}")
+        return response
+
+
+class ResponseWriter:
+    """供线程池中的同步代码（如zipfile）写入流式响应的文件对象
+
+    攒够一块后交给事件循环发送，并等待发送完成再返回；客户端接收慢时写入线程随之阻塞，
+    内存中最多只有一块数据。
+    """
+
+    def __init__(self, response, loop, chunk_size=HTTP_STREAM_CHUNK_SIZE):
+        self.response = response
+        self.loop = loop
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            asyncio.run_coroutine_threadsafe(self.response.write(data), self.loop).result()
+
+
+def paginated_response(request, items, default_limit=None):
+    """按 offset/limit 参数截取列表，未指定limit时使用default_limit（None表示返回全部）"""
+    try:
+        offset = max(int(request.query.get('offset', 0)), 0)
+        limit = request.query.get('limit', default_limit)
+        limit = None if limit is None else min(max(int(limit), 0), LOG_LIST_MAX_LIMIT)
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid offset or limit")
+    page = items[offset:] if limit is None else items[offset:offset + limit]
+    return web.json_response(page, headers={'X-Total-Count': str(len(items))})
+
+
+def parse_range(header, size):
+    """解析单个字节范围，返回 (start, end)；无法处理的格式返回None（发送完整内容），范围无效返回False"""
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N 表示最后N个字节
+        if not last or int(last) == 0:
+            return False
+        return max(0, size - int(last)), size
+    start = int(first)
+    end = size if not last else min(int(last) + 1, size)
+    if start >= size or start >= end:
+        return False
+    return start, end
+
+
+def if_range_matches(if_range, etag, mtime):
+    """If-Range与当前文件一致时才按Range发送，否则发送完整的新内容
+
+    只与未压缩内容的强校验值比较，弱校验值（gzip响应）总是不匹配。
+    """
+    if not if_range:
+        return True
+    if if_range.startswith('W/'):
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def accepts_gzip(request):
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """未处理的异常记录日志并返回500"""
+    try:
+        return await handler(request)
+    except (web.HTTPException, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        logger.error(f"处理HTTP请求出错 {request.path}: {str(e)}")
+        raise web.HTTPInternalServerError(text="Internal Server Error")
+
+
+async def add_cors_headers(request, response):
+    # 允许跨域访问
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Total-Count'
+
 
 class CustomHTTPServer:
-    def __init__(self, host="0.0.0.0", port=8080):
+    def __init__(self, host="0.0.0.0", port=8080, ws_server=None):
         self.host = host
         self.port = port
+        self.ws_server = ws_server  # 设置后在 /ws 上提供WebSocket，与HTTP共用端口
+        self.executor = ThreadPoolExecutor(max_workers=HTTP_IO_WORKERS, thread_name_prefix="HTTPIO")
+        self.runner = None
 
     def check_port_available(self):
         """检查端口是否可用"""
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # 与实际监听一致使用SO_REUSEADDR，避免TIME_WAIT连接被误判为端口占用
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.bind((self.host, self.port))
             sock.close()
             return True
         except OSError:
             return False
 
-    def start(self):
-        """启动HTTP服务器"""
+    def create_app(self):
+        app = web.Application(middlewares=[error_middleware])
+        app.on_response_prepare.append(add_cors_headers)
+        LogHandler(self.executor).add_routes(app.router)
+        if self.ws_server is not None:
+            app.router.add_get('/ws', self.handle_websocket)
+        app.router.add_get('/api/metrics', self.handle_metrics)
+
+        # 静态文件
+        async def index(request):
+            return web.FileResponse(os.path.join(HTML_DIR, 'index.html'))
+
+        async def logs_page(request):
+            return web.FileResponse(os.path.join(HTML_DIR, 'logs.html'))
+
+        app.router.add_get('/', index)
+        app.router.add_get('/index.html', index)
+        app.router.add_get('/logs.html', logs_page)
+        app.router.add_static('/static', STATIC_DIR)
+        return app
+
+    async def handle_metrics(self, request):
+        """运行指标，默认JSON；format=prometheus 或 Accept 为文本格式时返回Prometheus文本格式"""
+        accept = request.headers.get('Accept', '')
+        if request.query.get('format') == 'prometheus' or 'text/plain' in accept or 'openmetrics' in accept:
+            text = metrics.to_prometheus(metrics.collect())
+            return web.Response(text=text, headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+        try:
+            limit = max(int(request.query.get('limit', 100)), 0)
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid limit")
+        return web.json_response(metrics.collect(device_limit=limit))
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await self.ws_server.handle_websocket(AiohttpWebSocket(ws, request), request.path)
+        return ws
+
+    async def start(self):
+        """在当前事件循环中启动HTTP服务器"""
         retries = 3
-        
+
         # 检查端口是否被占用
         if not self.check_port_available():
             logger.error(f"HTTP服务器端口 {self.port} 已被占用")
@@ -452,12 +734,20 @@ class CustomHTTPServer:
                     break
             else:
                 logger.critical(f"无法启动HTTP服务器：所有端口({self.port}-{self.port+retries})都被占用")
-                return
-        
+                raise RuntimeError("HTTP服务器端口被占用")
+
         try:
-            http_server = BaseHTTPServer((self.host, self.port), LogHandler)
+            self.runner = web.AppRunner(self.create_app(), access_log=None)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, self.host, self.port, backlog=1024)
+            await site.start()
             logger.info(f"HTTP服务器启动在 http://{self.host}:{self.port}")
-            http_server.serve_forever()
         except Exception as e:
             logger.critical(f"HTTP服务器启动失败: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def stop(self):
+        """关闭HTTP服务器及其中的长连接"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+        self.executor.shutdown(wait=False, cancel_futures=True)
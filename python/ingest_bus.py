@@ -0,0 +1,417 @@
+import os
+import json
+import socket
+import signal
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from logger_config import (logger, log_writer, add_rotation_listener, add_logger_listener,
+                           rotation_listeners, logger_listeners)
+from client_registry import ClientRegistry
+from tcp_handler import TCPServer, format_message, get_current_time
+from config import INGEST_BUS_PATH, INGEST_STATS_INTERVAL, INGEST_RESTART_DELAY, SEND_TIMEOUT
+
+BUS_LINE_LIMIT = 16 * 1024 * 1024  # 总线上单条消息的最大长度（一次recv的批量消息序列化后可能较大）
+
+
+class BusConnection:
+    """总线连接的发送端：每条消息为一行JSON，同一轮事件循环中的多条合并为一次写入"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.pending = []
+
+    def send(self, op):
+        """发送一条消息（在事件循环线程中调用）"""
+        if not self.pending:
+            self.loop.call_soon(self._flush)
+        self.pending.append(json.dumps(op))
+
+    def send_threadsafe(self, op):
+        self.loop.call_soon_threadsafe(self.send, op)
+
+    def _flush(self):
+        pending, self.pending = self.pending, []
+        if not self.writer.is_closing():
+            self.writer.write(("\n".join(pending) + "\n").encode())
+
+    def close(self):
+        self.writer.close()
+
+
+async def read_ops(reader):
+    """逐条读取总线消息，连接关闭时结束"""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        yield json.loads(line)
+
+
+# ---------------------------------------------------------------- 接入进程
+
+class WorkerRegistry(ClientRegistry):
+    """接入进程的登记表：本进程内客户端的变化同步给主进程，客户端列表增量由主进程的登记表产生"""
+
+    def __init__(self, bus):
+        super().__init__()
+        self.bus = bus
+
+    def add(self, client):
+        super().add(client)
+        self.bus.send({"op": "connect", "addr": client.addr_str})
+
+    def identify(self, client):
+        replaced = super().identify(client)
+        self.bus.send({"op": "identify", "addr": client.addr_str, "sn": client.sn, "wifi": client.wifi_name})
+        return replaced
+
+    def remove(self, client):
+        removed = super().remove(client)
+        if removed:
+            self.bus.send({"op": "disconnect", "addr": client.addr_str,
+                           "rx": [client.rx_messages, client.rx_bytes]})
+        return removed
+
+
+class BusLogHandler(logging.Handler):
+    """把接入进程默认logger的记录转发给主进程，由主进程写入 default 日志（避免多个进程写同一个文件）"""
+
+    def __init__(self, bus):
+        super().__init__()
+        self.bus = bus
+
+    def emit(self, record):
+        self.bus.send_threadsafe({"op": "log", "level": record.levelno, "message": record.getMessage()})
+
+
+class IngestWorker:
+    """接入进程：通过SO_REUSEPORT与其他接入进程共同监听TCP端口，接收设备数据、写设备日志，
+    推送给前端的消息和客户端变化经总线发给主进程，并执行主进程转来的关闭连接和下发指令请求。
+    """
+
+    def __init__(self, worker_id, bus_path=INGEST_BUS_PATH):
+        self.worker_id = worker_id
+        self.bus_path = bus_path
+        self.bus = None
+        self.tcp_server = None
+        self.tasks = set()
+
+    def put(self, message):
+        """代替消息队列：TCPServer放入的消息直接发往主进程"""
+        self.bus.send({"op": "queue", "message": message})
+
+    async def run(self):
+        reader, writer = await asyncio.open_unix_connection(self.bus_path, limit=BUS_LINE_LIMIT)
+        self.bus = BusConnection(writer)
+        self.bus.send({"op": "hello", "worker": self.worker_id, "pid": os.getpid()})
+        log_writer.reroute(logger, [BusLogHandler(self.bus)])
+        # 设备日志在本进程中创建和轮转，通知主进程更新目录缓存、压缩和建索引
+        add_rotation_listener(lambda path: self.bus.send_threadsafe({"op": "rotated", "path": path}))
+        add_logger_listener(lambda sn, path: self.bus.send_threadsafe({"op": "new_log", "sn": sn, "path": path}))
+
+        self.tcp_server = TCPServer(message_queue=self)
+        self.tcp_server.registry = WorkerRegistry(self.bus)
+        # 同一SN的日志只由设备当前所在的接入进程打开，避免多个进程各自轮转、交错写入同一文件
+        self.tcp_server.release_logs_on_disconnect = True
+        server = await self.tcp_server.start_async(reuse_port=True)
+        stats_task = asyncio.create_task(self.report_stats())
+        try:
+            async for op in read_ops(reader):
+                self.handle_op(op)
+        finally:
+            stats_task.cancel()
+            server.close()
+            for client in self.tcp_server.registry.clients():
+                client.close()
+            self.bus.close()
+
+    def handle_op(self, op):
+        kind = op["op"]
+        if kind == "close":
+            client = self.tcp_server.registry.get_by_addr(op["addr"])
+            if client is not None:
+                client.log('warning', f"检测到重复SN连接，断开旧连接: {client.addr_str}")
+                client.close()
+        elif kind == "send":
+            task = asyncio.create_task(self.send(op))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, op):
+        """执行主进程转来的下发指令，回复错误信息（成功时为None）"""
+        client = self.tcp_server.registry.get_by_addr(op["addr"])
+        error = None
+        if client is None or not client.is_alive:
+            error = "客户端已断开"
+        else:
+            try:
+                async with client.send_lock:
+                    await asyncio.wait_for(client.write(op["data"].encode(), None), SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                error = "发送超时"
+            except Exception as e:
+                error = str(e)
+        self.bus.send({"op": "sent", "id": op["id"], "error": error})
+
+    async def report_stats(self):
+        """定期上报有变化的设备接收统计"""
+        reported = {}
+        while True:
+            await asyncio.sleep(INGEST_STATS_INTERVAL)
+            changed = []
+            current = {}
+            for client in self.tcp_server.registry.clients():
+                counts = (client.rx_messages, client.rx_bytes)
+                current[client.addr_str] = counts
+                if reported.get(client.addr_str) != counts:
+                    changed.append([client.addr_str, *counts])
+            reported = current
+            if changed:
+                self.bus.send({"op": "stats", "clients": changed})
+
+
+def run_worker(worker_id, bus_path=INGEST_BUS_PATH):
+    """接入进程入口：收到SIGTERM或与主进程的连接断开时退出"""
+    # Ctrl+C 由主进程处理，主进程退出前会结束接入进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(IngestWorker(worker_id, bus_path).run())
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.critical(f"接入进程 {worker_id} 异常退出: {str(e)}")
+        raise
+    finally:
+        log_writer.stop()
+
+
+# ---------------------------------------------------------------- 主进程
+
+class RemoteClient:
+    """主进程中代表接入进程上的一个TCP连接，提供登记表和 CommandSender 使用的 TCPClient 接口"""
+
+    def __init__(self, link, addr_str):
+        self.link = link
+        self.addr_str = addr_str
+        self.wifi_name = None
+        self.sn = None
+        self.display_name = addr_str
+        self.is_alive = True
+        self.send_lock = asyncio.Lock()
+        self.pending_sends = 0
+        self.rx_messages = 0
+        self.rx_bytes = 0
+
+    async def write(self, data, executor, timeout=None):
+        """由所在的接入进程写入（超时由接入进程控制），失败时抛出异常"""
+        error = await self.link.request({"op": "send", "addr": self.addr_str, "data": data.decode()})
+        if error:
+            raise ConnectionError(error)
+
+    def close(self):
+        self.is_alive = False
+        self.link.bus.send({"op": "close", "addr": self.addr_str})
+
+    def log(self, level, message):
+        if level == 'info':
+            logger.info(message)
+        elif level == 'error':
+            logger.error(message)
+        elif level == 'warning':
+            logger.warning(message)
+
+
+class WorkerLink:
+    """主进程与单个接入进程之间的总线连接"""
+
+    def __init__(self, writer):
+        self.bus = BusConnection(writer)
+        self.worker_id = None
+        self.clients = {}   # {addr_str: RemoteClient}
+        self.requests = {}  # {请求id: Future}
+        self.request_ids = itertools.count()
+
+    async def request(self, op):
+        """发送请求并等待接入进程回复"""
+        future = asyncio.get_running_loop().create_future()
+        op["id"] = next(self.request_ids)
+        self.requests[op["id"]] = future
+        self.bus.send(op)
+        try:
+            return await future
+        finally:
+            self.requests.pop(op["id"], None)
+
+    def fail_requests(self, error):
+        for future in self.requests.values():
+            if not future.done():
+                future.set_result(error)
+
+
+class IngestHub:
+    """多进程接入时主进程中的TCP服务器替代：启动接入进程，汇总它们经总线发来的消息和客户端变化
+
+    提供与 TCPServer 相同的 registry / client_list / get_client_by_display_name 接口。
+    所有接入进程的客户端登记在同一个登记表中，因此SN唯一性和重复SN顶替跨进程生效；
+    下发指令经总线转给设备所在的接入进程执行。
+    """
+
+    def __init__(self, message_queue, workers, bus_path=INGEST_BUS_PATH):
+        self.message_queue = message_queue
+        self.workers = workers
+        self.bus_path = bus_path
+        self.registry = ClientRegistry(on_event=message_queue.put)
+        self.processes = {}  # {接入进程编号: Process}
+        self.links = set()
+        self.server = None
+        self.watch_task = None
+        self.context = multiprocessing.get_context('spawn')
+
+    def client_list(self):
+        """当前所有客户端的显示名称"""
+        return self.registry.names_snapshot()
+
+    def get_client_by_display_name(self, display_name):
+        return self.registry.get_by_name(display_name)
+
+    async def start_async(self):
+        """监听总线并启动接入进程"""
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("当前系统不支持SO_REUSEPORT，无法使用多进程接入")
+        if os.path.exists(self.bus_path):
+            os.unlink(self.bus_path)
+        self.server = await asyncio.start_unix_server(self.handle_worker, self.bus_path, limit=BUS_LINE_LIMIT)
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+        self.watch_task = asyncio.create_task(self.watch())
+        logger.info(f"多进程接入已启动: {self.workers} 个接入进程, 总线 {self.bus_path}")
+        return self.server
+
+    def spawn(self, worker_id):
+        process = self.context.Process(target=run_worker, args=(worker_id, self.bus_path),
+                                       name=f"IngestWorker-{worker_id}", daemon=True)
+        process.start()
+        self.processes[worker_id] = process
+
+    async def watch(self):
+        """接入进程意外退出时重新启动"""
+        while True:
+            await asyncio.sleep(INGEST_RESTART_DELAY)
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logger.error(f"接入进程 {worker_id} 已退出(exitcode={process.exitcode})，重新启动")
+                    self.spawn(worker_id)
+
+    def stop(self):
+        """结束接入进程（SIGTERM，接入进程写完日志后退出）"""
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+        if self.server is not None:
+            self.server.close()
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for worker_id, process in self.processes.items():
+            process.join(5)
+            if process.is_alive():
+                logger.warning(f"接入进程 {worker_id} 未能正常退出，强制结束")
+                process.kill()
+        if os.path.exists(self.bus_path):
+            os.unlink(self.bus_path)
+
+    async def handle_worker(self, reader, writer):
+        link = WorkerLink(writer)
+        self.links.add(link)
+        try:
+            async for op in read_ops(reader):
+                self.handle_op(link, op)
+        except Exception as e:
+            logger.error(f"处理接入进程 {link.worker_id} 的消息出错: {str(e)}")
+        finally:
+            self.links.discard(link)
+            link.fail_requests("接入进程已断开")
+            self.drop_link_clients(link)
+            link.bus.close()
+
+    def handle_op(self, link, op):
+        kind = op["op"]
+        if kind == "queue":
+            self.message_queue.put(op["message"])
+        elif kind == "connect":
+            client = RemoteClient(link, op["addr"])
+            link.clients[client.addr_str] = client
+            self.registry.add(client)
+        elif kind == "identify":
+            self.identify(link, op)
+        elif kind == "disconnect":
+            client = link.clients.pop(op["addr"], None)
+            if client is not None:
+                client.rx_messages, client.rx_bytes = op["rx"]
+                client.is_alive = False
+                self.registry.remove(client)
+        elif kind == "stats":
+            for addr_str, messages, size in op["clients"]:
+                client = link.clients.get(addr_str)
+                if client is not None:
+                    client.rx_messages, client.rx_bytes = messages, size
+        elif kind == "sent":
+            future = link.requests.get(op["id"])
+            if future is not None and not future.done():
+                future.set_result(op["error"])
+        elif kind == "log":
+            logger.log(op["level"], f"[接入进程{link.worker_id}] {op['message']}")
+        elif kind == "new_log":
+            for listener in logger_listeners:
+                listener(op["sn"], op["path"])
+        elif kind == "rotated":
+            for listener in rotation_listeners:
+                listener(op["path"])
+        elif kind == "hello":
+            link.worker_id = op["worker"]
+            logger.info(f"接入进程 {link.worker_id} 已连接 (pid {op['pid']})")
+
+    def identify(self, link, op):
+        """设备识别出SN：在全局登记表中更新，同SN的旧连接在其他接入进程上时通知该进程断开"""
+        client = link.clients.get(op["addr"])
+        if client is None:
+            return
+        client.wifi_name = op["wifi"]
+        client.sn = op["sn"]
+        client.display_name = client.sn or client.addr_str
+        replaced = self.registry.identify(client)
+        if replaced is None:
+            return
+        replaced.link.clients.pop(replaced.addr_str, None)
+        # 同一接入进程内的重复SN已由该进程断开并通知
+        if replaced.link is not link:
+            logger.warning(f"检测到重复SN({client.sn})连接，断开接入进程{replaced.link.worker_id}上的旧连接: {replaced.addr_str}")
+            self.message_queue.put({
+                "type": "message",
+                "addr": "系统",
+                "data": format_message("系统", f"检测到重复SN({client.sn})连接，断开旧连接: {replaced.addr_str}",
+                                       get_current_time())
+            })
+            replaced.close()
+
+    def drop_link_clients(self, link):
+        """接入进程断开后，其上的客户端全部视为断开"""
+        if not link.clients:
+            return
+        count = len(link.clients)
+        for client in link.clients.values():
+            client.is_alive = False
+            self.registry.remove(client)
+        link.clients.clear()
+        logger.error(f"与接入进程 {link.worker_id} 的连接已断开，移除其上的 {count} 个设备")
+        self.message_queue.put({
+            "type": "message",
+            "addr": "系统",
+            "data": format_message("系统", f"接入进程 {link.worker_id} 已断开，{count} 个设备连接丢失", get_current_time())
+        })
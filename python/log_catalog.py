@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+from logger_config import logger, LOG_DIR, add_rotation_listener, add_logger_listener
+from log_store import LOG_FILE_PATTERN, live_log_date, add_compress_listener
+from config import CATALOG_REVALIDATE_INTERVAL
+
+
+class SNEntry:
+    """单个SN目录下的日志文件信息"""
+
+    def __init__(self, sn):
+        self.sn = sn
+        self.dir_mtime_ns = None  # 上次扫描时的目录修改时间，文件增删改名时会变化
+        self.files = {}           # {文件名: (日期, 大小, 修改时间)}
+
+
+class LogCatalog:
+    """内存中的日志目录：SN -> 日期 -> 大小/修改时间
+
+    启动时扫描一次，之后通过目录的修改时间判断是否需要重新扫描某个SN，
+    目录修改时间不会因追加写入而变化，因此当日日志每次校验时单独stat一次。
+    新建SN日志和日志轮转时由logger_config通知立即更新。
+    """
+
+    def __init__(self, log_dir=LOG_DIR, interval=CATALOG_REVALIDATE_INTERVAL):
+        self.log_dir = log_dir
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.entries = {}          # {SN: SNEntry}
+        self.sorted_sns = []
+        self.root_mtime_ns = None
+        self.last_check = 0
+        self.started = False
+
+    def start(self):
+        """注册更新回调并建立目录"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        add_rotation_listener(self._on_rotation)
+        # 压缩后原文件被替换为.gz，立即更新，不等下次增量检查
+        add_compress_listener(self._on_rotation)
+        add_logger_listener(self._on_logger_created)
+        begin = time.monotonic()
+        self.revalidate(force=True)
+        logger.info(f"日志目录已加载: {len(self.entries)} 个目录, "
+                    f"{sum(len(e.files) for e in self.entries.values())} 个日志文件, "
+                    f"耗时 {time.monotonic() - begin:.2f}s")
+
+    def _on_rotation(self, path):
+        self.refresh_sn(os.path.basename(os.path.dirname(path)))
+
+    def _on_logger_created(self, sn, log_file):
+        self.refresh_sn(os.path.basename(os.path.dirname(log_file)))
+
+    def refresh_sn(self, sn):
+        """立即重新扫描指定SN"""
+        with self.lock:
+            entry = self.entries.get(sn)
+            if entry is None:
+                entry = SNEntry(sn)
+                self.entries[sn] = entry
+                self.sorted_sns = sorted(self.entries)
+            entry.dir_mtime_ns = None
+            self._check_sn(entry)
+
+    def revalidate(self, force=False):
+        """按目录修改时间增量更新，最多每 interval 秒执行一次"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_check < self.interval:
+                return
+            self.last_check = now
+            try:
+                root_mtime_ns = os.stat(self.log_dir).st_mtime_ns
+            except FileNotFoundError:
+                self.entries.clear()
+                self.sorted_sns = []
+                return
+            if root_mtime_ns != self.root_mtime_ns:
+                self._scan_root()
+                self.root_mtime_ns = root_mtime_ns
+            for entry in list(self.entries.values()):
+                self._check_sn(entry)
+
+    def _scan_root(self):
+        names = set()
+        with os.scandir(self.log_dir) as it:
+            for item in it:
+                if item.is_dir():
+                    names.add(item.name)
+        for sn in list(self.entries):
+            if sn not in names:
+                del self.entries[sn]
+        for sn in names:
+            if sn not in self.entries:
+                self.entries[sn] = SNEntry(sn)
+        self.sorted_sns = sorted(self.entries)
+
+    def _check_sn(self, entry):
+        sn_path = os.path.join(self.log_dir, entry.sn)
+        try:
+            dir_mtime_ns = os.stat(sn_path).st_mtime_ns
+        except FileNotFoundError:
+            self.entries.pop(entry.sn, None)
+            self.sorted_sns = sorted(self.entries)
+            return
+        if dir_mtime_ns != entry.dir_mtime_ns:
+            files = {}
+            with os.scandir(sn_path) as it:
+                for item in it:
+                    match = LOG_FILE_PATTERN.match(item.name)
+                    if not match:
+                        continue
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[item.name] = (match.group(1), stat.st_size, stat.st_mtime)
+            entry.files = files
+            entry.dir_mtime_ns = dir_mtime_ns
+        elif 'server.log' in entry.files:
+            # 当日日志追加写入不会改变目录修改时间
+            try:
+                stat = os.stat(os.path.join(sn_path, 'server.log'))
+                entry.files['server.log'] = (None, stat.st_size, stat.st_mtime)
+            except FileNotFoundError:
+                entry.dir_mtime_ns = None
+
+    def sn_list(self, prefix=None, include_default=False):
+        """按字母顺序返回SN列表"""
+        self.revalidate()
+        with self.lock:
+            return [sn for sn in self.sorted_sns
+                    if (include_default or sn != 'default') and (not prefix or sn.startswith(prefix))]
+
+    def date_list(self, sn):
+        """返回SN的日期列表，最新的在前"""
+        self.revalidate()
+        with self.lock:
+            entry = self.entries.get(sn)
+            if entry is None:
+                return []
+            # 当日日志按内容日期（修改时间）归入对应的日期
+            return sorted({date or live_log_date(mtime) for date, _, mtime in entry.files.values()}, reverse=True)
+
+    def sn_files(self, sn):
+        """SN的日志文件 [(文件名, 日期, 大小, 修改时间)]，当日日志的日期为None"""
+        self.revalidate()
+        with self.lock:
+            entry = self.entries.get(sn)
+            return [] if entry is None else [(filename, *info) for filename, info in entry.files.items()]
+
+    def usage(self):
+        """所有SN的日志文件 {SN: [(文件名, 日期, 大小, 修改时间)]}，供日志清理使用"""
+        self.revalidate()
+        with self.lock:
+            return {sn: [(filename, *info) for filename, info in entry.files.items()]
+                    for sn, entry in self.entries.items()}
+
+    def files(self, sn=None, prefix=None):
+        """返回日志文件信息列表，按修改时间排序，最新的在前"""
+        self.revalidate()
+        logs = []
+        with self.lock:
+            for name in self.sorted_sns:
+                if (sn and name != sn) or (prefix and not name.startswith(prefix)):
+                    continue
+                for filename, (date, size, mtime) in self.entries[name].files.items():
+                    logs.append({
+                        'name': f"{name}/{filename}",
+                        'sn': name,
+                        'date': date or live_log_date(mtime),
+                        'size': size,
+                        'compressed': filename.endswith('.gz'),
+                        'modified_time': int(mtime)
+                    })
+        logs.sort(key=lambda x: x['modified_time'], reverse=True)
+        return logs
+
+
+log_catalog = LogCatalog()
@@ -0,0 +1,74 @@
+import os
+import time
+import zipfile
+from logger_config import logger
+from log_search import list_search_files
+from config import EXPORT_COMPRESS_LEVEL, HTTP_STREAM_CHUNK_SIZE
+
+
+class LeveledZipInfo(zipfile.ZipInfo):
+    """可以指定压缩级别的zip条目
+
+    Python 3.13 起 ZipInfo 有公开的 compress_level；之前的版本 zipfile 从 _compresslevel 读取条目的级别
+    （ZipFile.write/writestr 的 compresslevel 参数也是设置它），在这里统一处理两者的差别。
+    """
+
+    __slots__ = ()
+
+    def set_compress_level(self, level):
+        if hasattr(zipfile.ZipInfo, 'compress_level'):
+            self.compress_level = level
+        else:
+            self._compresslevel = level
+
+
+def export_files(sn_patterns, date_from=None, date_to=None):
+    """需要导出的 [(SN, 路径)]，按SN、日期排列，同一天的多个文件保持轮转顺序"""
+    files = list_search_files(sn_patterns, date_from, date_to)
+    # 稳定排序：list_search_files 中同一天的文件已按轮转顺序排列
+    files.sort(key=lambda item: (item[0], item[1]))
+    return [(sn, path) for sn, _, path in files]
+
+
+def write_zip(files, out, chunk_size=HTTP_STREAM_CHUNK_SIZE):
+    """把日志文件逐个写成zip流，返回 (文件数, 原始字节数)
+
+    out 只需要支持 write/flush：不可seek时zipfile使用数据描述符，边读边写，
+    内存中只有一个读取块和各文件的目录项；条目总是使用zip64大小字段，不需要预先知道文件大小。
+    已压缩的.gz日志原样存储（不再压缩），未压缩的日志用 EXPORT_COMPRESS_LEVEL 压缩。
+    当日日志只导出开始时已写入的部分。
+    """
+    count = total = 0
+    # 每个条目单独指定压缩方式和级别
+    with zipfile.ZipFile(out, 'w') as archive:
+        for sn, path in files:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                # 导出过程中被压缩（原文件已替换为.gz）或被清理
+                try:
+                    path += '.gz'
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    logger.warning(f"导出时日志文件已不存在: {path[:-3]}")
+                    continue
+            with f:
+                stat = os.fstat(f.fileno())
+                info = LeveledZipInfo(f"{sn}/{os.path.basename(path)}",
+                                      date_time=time.localtime(stat.st_mtime)[:6])
+                if path.endswith('.gz'):
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.set_compress_level(EXPORT_COMPRESS_LEVEL)
+                remaining = stat.st_size
+                with archive.open(info, 'w', force_zip64=True) as entry:
+                    while remaining > 0:
+                        data = f.read(min(chunk_size, remaining))
+                        if not data:
+                            break
+                        entry.write(data)
+                        remaining -= len(data)
+                count += 1
+                total += stat.st_size - remaining
+    return count, total
@@ -0,0 +1,216 @@
+import os
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+from config import LOG_INDEX_STRIDE, LOG_INDEX_CACHE_SIZE, LOG_ENCODING
+from log_store import open_log_source, open_day_source
+
+SCAN_BLOCK_SIZE = 1024 * 1024  # 建索引时每次读取1MB
+SEEK_WINDOW_SIZE = 65536       # 从检查点向后查找行首时每次读取的字节数
+
+
+class LineIndex:
+    """单个日志文件的稀疏行偏移索引
+
+    每隔 stride 行记录一次该行起始的字节偏移，文件追加写入时增量扩展，
+    文件被轮转或截断（inode变化/变小）时重建。支持未压缩和分块压缩的日志文件。
+    """
+
+    def __init__(self, path, stride=LOG_INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self.lock = threading.Lock()
+        self._reset()
+
+    @classmethod
+    def restore(cls, path, stride, offsets, newline_count, size):
+        """由保存的检查点恢复内容不再变化的历史日志的行索引，不需要重新扫描文件"""
+        index = cls(path, stride)
+        index.offsets = array('Q', offsets)
+        index.newline_count = newline_count
+        index.indexed_size = size
+        return index
+
+    def open(self):
+        return open_log_source(self.path)
+
+    def _reset(self, inode=None):
+        self.inode = inode
+        self.file_size = -1             # 上次更新时的磁盘文件大小
+        self.offsets = array('Q', [0])  # offsets[k] 为第 k*stride 行的起始偏移
+        self.newline_count = 0          # 已扫描区域内的换行符数量
+        self.indexed_size = 0           # 已扫描的字节数
+
+    @property
+    def total_lines(self):
+        """与 content.split('\\n') 的行数保持一致"""
+        return self.newline_count + 1
+
+    def update(self):
+        """根据文件当前状态增量更新索引，返回已索引的内容大小"""
+        with self.lock:
+            stat = os.stat(self.path)
+            if stat.st_ino != self.inode or stat.st_size < self.file_size:
+                self._reset(stat.st_ino)
+            if stat.st_size != self.file_size:
+                with self.open() as source:
+                    if source.size > self.indexed_size:
+                        self._scan(source, source.size)
+                self.file_size = stat.st_size
+            return self.indexed_size
+
+    def _scan(self, source, size):
+        """扫描 [indexed_size, size) 区间，记录新的检查点"""
+        stride = self.stride
+        offsets = self.offsets
+        count = self.newline_count
+        next_checkpoint = len(offsets) * stride
+        pos = self.indexed_size
+        while pos < size:
+            block = source.read(pos, min(SCAN_BLOCK_SIZE, size - pos))
+            if not block:
+                break
+            block_newlines = block.count(b'\n')
+            if count + block_newlines < next_checkpoint:
+                # 本块内没有检查点，直接累加计数
+                count += block_newlines
+            else:
+                i = block.find(b'\n')
+                while i != -1:
+                    count += 1
+                    if count == next_checkpoint:
+                        offsets.append(pos + i + 1)
+                        next_checkpoint += stride
+                    i = block.find(b'\n', i + 1)
+            pos += len(block)
+        self.newline_count = count
+        self.indexed_size = pos
+
+    def _line_offset(self, source, line, limit):
+        """定位第 line 行的起始偏移：从最近的检查点向后跳过剩余的换行"""
+        checkpoint = min(line // self.stride, len(self.offsets) - 1)
+        offset = self.offsets[checkpoint]
+        remaining = line - checkpoint * self.stride
+        while remaining and offset < limit:
+            window = source.read(offset, min(SEEK_WINDOW_SIZE, limit - offset))
+            start = 0
+            while remaining:
+                i = window.find(b'\n', start)
+                if i == -1:
+                    break
+                remaining -= 1
+                start = i + 1
+            offset += start if not remaining else len(window)
+        return min(offset, limit)
+
+    def line_at(self, offset):
+        """字节偏移所在的行号（从0开始）：从最近的检查点开始统计换行"""
+        with self.lock:
+            offset = min(offset, self.indexed_size)
+            checkpoint = bisect.bisect_right(self.offsets, offset) - 1
+            pos = self.offsets[checkpoint]
+            count = 0
+            if pos < offset:
+                with self.open() as source:
+                    while pos < offset:
+                        block = source.read(pos, min(SCAN_BLOCK_SIZE, offset - pos))
+                        if not block:
+                            break
+                        count += block.count(b'\n')
+                        pos += len(block)
+            return checkpoint * self.stride + count
+
+    def read_lines(self, start_line, end_line):
+        """读取 [start_line, end_line) 行的内容，不包含最后一行的换行符"""
+        with self.lock:
+            size = self.indexed_size
+            total_lines = self.total_lines
+            if start_line >= end_line or start_line >= total_lines or size == 0:
+                return ''
+            with self.open() as source:
+                limit = min(size, source.size)
+                start = self._line_offset(source, start_line, limit)
+                if end_line >= total_lines:
+                    end = limit
+                else:
+                    end = self._line_offset(source, end_line, limit) - 1
+                return source.read(start, max(0, end - start)).decode(LOG_ENCODING, errors='replace')
+
+
+class DayLineIndex(LineIndex):
+    """SN某一天的行索引，行号为当天各部分拼接后的行号（见 DayLogSource）
+
+    拼接后的内容只会追加，第一部分不变时增量扩展；第一部分被清理或内容变少时重建。
+    """
+
+    def __init__(self, sn, date, stride=LOG_INDEX_STRIDE):
+        self.sn = sn
+        self.date = date
+        super().__init__(f"{sn}/{date}", stride)
+
+    def open(self):
+        source = open_day_source(self.sn, self.date)
+        if source is None:
+            raise FileNotFoundError(f"日志不存在: {self.sn}/{self.date}")
+        return source
+
+    def update(self):
+        with self.lock:
+            try:
+                source = self.open()
+            except FileNotFoundError:
+                self._reset()
+                return 0
+            with source:
+                # 以第一部分的文件名（不含.gz）标识这一天的内容，压缩不会改变它
+                first = os.path.basename(source.paths[0])
+                first = first[:-3] if first.endswith('.gz') else first
+                if first != self.inode or source.size < self.indexed_size:
+                    self._reset(first)
+                if source.size > self.indexed_size:
+                    self._scan(source, source.size)
+            return self.indexed_size
+
+
+class LineIndexCache:
+    """按文件路径或 (SN, 日期) 缓存行索引（LRU）"""
+
+    def __init__(self, max_entries=LOG_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """获取并增量更新指定文件的行索引"""
+        path = os.path.abspath(path)
+        with self.lock:
+            index = self.indexes.get(path)
+            if index is None:
+                index = LineIndex(path)
+                self.indexes[path] = index
+                while len(self.indexes) > self.max_entries:
+                    self.indexes.popitem(last=False)
+            else:
+                self.indexes.move_to_end(path)
+        index.update()
+        return index
+
+    def get_day(self, sn, date):
+        """获取并增量更新SN某一天的行索引"""
+        key = (sn, date)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is None:
+                index = DayLineIndex(sn, date)
+                self.indexes[key] = index
+                while len(self.indexes) > self.max_entries:
+                    self.indexes.popitem(last=False)
+            else:
+                self.indexes.move_to_end(key)
+        index.update()
+        return index
+
+
+# 全局索引缓存
+line_index_cache = LineIndexCache()
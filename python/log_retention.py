@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from logger_config import logger, LOG_DIR
+from log_store import log_file_part
+from log_catalog import log_catalog
+from log_search import search_index_manager
+from config import LOG_BACKUP_COUNT, LOG_RETENTION_TOTAL_BYTES, LOG_RETENTION_SN_BYTES, LOG_RETENTION_INTERVAL
+
+
+class LogRetention:
+    """后台日志清理线程：按保留天数、单个SN大小上限和总大小上限删除已轮转的日志
+
+    文件大小取自 log_catalog 的目录缓存（只重新扫描有变化的目录），不需要每次遍历整个日志目录。
+    总是先删除最旧的文件：超过天数的先删，单个SN超限时删除该SN最旧的文件，
+    总大小超限时在所有SN中删除最旧的文件。当日日志（server.log）不会被删除，但计入大小。
+    """
+
+    def __init__(self, total_bytes=LOG_RETENTION_TOTAL_BYTES, sn_bytes=LOG_RETENTION_SN_BYTES,
+                 max_days=LOG_BACKUP_COUNT, interval=LOG_RETENTION_INTERVAL):
+        self.total_bytes = total_bytes
+        self.sn_bytes = sn_bytes
+        self.max_days = max_days
+        self.interval = interval
+        self.thread = None
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+
+    def start(self):
+        if self.thread is not None or not (self.total_bytes or self.sn_bytes or self.max_days):
+            return
+        self.thread = threading.Thread(target=self._run, name="LogRetention", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"日志清理失败: {str(e)}")
+            time.sleep(self.interval)
+
+    def select(self, usage, today=None):
+        """根据 {SN: [(文件名, 日期, 大小, 修改时间)]} 选出需要删除的文件 [(SN, 文件名, 大小)]"""
+        today = today or datetime.now()
+        cutoff = (today - timedelta(days=self.max_days)).strftime('%Y-%m-%d') if self.max_days else None
+        victims = []
+        kept = []  # 各SN保留下来的历史日志，用于总大小检查
+        total = 0
+        for sn, files in usage.items():
+            sn_total = sum(size for _, _, size, _ in files)
+            rotated = sorted((date, log_file_part(filename), mtime, sn, filename, size)
+                             for filename, date, size, mtime in files if date)
+            for item in rotated:
+                date, size = item[0], item[5]
+                if (cutoff and date < cutoff) or (self.sn_bytes and sn_total > self.sn_bytes):
+                    victims.append(item)
+                    sn_total -= size
+                else:
+                    kept.append(item)
+            total += sn_total
+        if self.total_bytes and total > self.total_bytes:
+            kept.sort()
+            for item in kept:
+                if total <= self.total_bytes:
+                    break
+                victims.append(item)
+                total -= item[5]
+        return [(sn, filename, size) for _, _, _, sn, filename, size in victims]
+
+    def enforce(self):
+        """执行一次清理，返回 (删除的文件数, 释放的字节数)"""
+        victims = self.select(log_catalog.usage())
+        if not victims:
+            return 0, 0
+        count = freed = 0
+        changed = set()
+        for sn, filename, size in victims:
+            path = os.path.join(LOG_DIR, sn, filename)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"删除日志失败 {path}: {str(e)}")
+                continue
+            search_index_manager.discard(path)
+            changed.add(sn)
+            count += 1
+            freed += size
+        for sn in changed:
+            log_catalog.refresh_sn(sn)
+        self.deleted_files += count
+        self.deleted_bytes += freed
+        logger.info(f"日志清理: 删除 {count} 个历史日志文件, 释放 {freed / 1024 / 1024:.1f} MB")
+        return count, freed
+
+
+log_retention = LogRetention()
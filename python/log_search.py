@@ -0,0 +1,581 @@
+import os
+import re
+import mmap
+import zlib
+import bisect
+import struct
+import itertools
+import threading
+from array import array
+from queue import Queue
+from collections import OrderedDict
+from logger_config import logger, LOG_DIR, add_rotation_listener
+from log_index import LineIndex, line_index_cache
+from log_store import LOG_FILE_PATTERN, open_log_source, log_file_part, live_log_date
+from log_catalog import log_catalog
+from config import SEARCH_INDEX_DIR, SEARCH_INDEX_CACHE_SIZE, SEARCH_DEFAULT_LIMIT, LOG_ENCODING, LOG_INDEX_STRIDE
+
+INDEX_VERSION = 3
+INDEX_MAGIC = b'LSIX'
+# 文件头：标识、版本、行组行数、行组数、已索引字节数、换行数，以及之后各部分的字节数
+INDEX_HEADER = struct.Struct('<4sIIIQQQQQQ')
+TERM_TABLE_HEADER = struct.Struct('<IIII')  # 键数、块数、块目录字节数、键块总字节数
+TERM_BLOCK_SIZE = 128       # 词典每块的词数，查找时只解压一块
+ANSI_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+# 英文/数字按词切分，中文按单字切分
+TOKEN_PATTERN = re.compile(r'[a-z0-9_]+|[一-鿿]')
+MAX_TOKEN_LENGTH = 32   # 更长的词只索引前32个字符
+MAX_DIGIT_TOKEN = 6     # 超过6位的纯数字（序号、随机值等）不进索引，避免词表膨胀
+
+
+def index_tokens(text):
+    """提取一段日志文本中需要索引的词"""
+    tokens = set(TOKEN_PATTERN.findall(ANSI_PATTERN.sub('', text).lower()))
+    # 先去重再过滤，只需检查较长的词
+    long_tokens = [token for token in tokens if len(token) > MAX_DIGIT_TOKEN]
+    for token in long_tokens:
+        tokens.discard(token)
+        if not token.isdigit():
+            tokens.add(token[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def query_tokens(query):
+    """查询中可用于索引过滤的词 [(词, 是否可能从词中间开始)]，纯数字不参与过滤
+
+    查询按子串匹配：第一个词可能是日志中某个词的后半部分（只有一个词时可以是任意一段），
+    需要在词表中按子串查找；之后的词都从词首开始，按前缀查找即可。
+    """
+    tokens = []
+    for position, token in enumerate(TOKEN_PATTERN.findall(query.lower())):
+        token = token[:MAX_TOKEN_LENGTH]
+        if not token.isdigit() and (token, position == 0) not in tokens:
+            tokens.append((token, position == 0))
+    return tokens
+
+
+def word_trigrams(word):
+    """词中所有连续3个字符的片段，用于按子串查找词"""
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def write_term_table(terms, block_size=TERM_BLOCK_SIZE):
+    """把按键排序的 [(键, 升序编号列表)] 写成词典
+
+    每 block_size 个键为一块，块内的键和编号列表（差分编码）分别压缩；块目录记录每块的第一个键，
+    查找一个键只需解压一块。
+    """
+    key_blocks, id_blocks, first_keys = [], [], []
+    key_ends, id_ends = array('I'), array('I')
+    key_size = id_size = 0
+    for i in range(0, len(terms), block_size):
+        chunk = terms[i:i + block_size]
+        first_keys.append(chunk[0][0])
+        block = zlib.compress('\n'.join(key for key, _ in chunk).encode('utf-8'))
+        key_blocks.append(block)
+        key_size += len(block)
+        key_ends.append(key_size)
+        # 先是各键的编号数量，之后依次为各列表差分后的编号
+        ids = array('I', [len(values) for _, values in chunk])
+        for _, values in chunk:
+            ids.append(values[0])
+            ids.extend(values[j] - values[j - 1] for j in range(1, len(values)))
+        block = zlib.compress(ids.tobytes())
+        id_blocks.append(block)
+        id_size += len(block)
+        id_ends.append(id_size)
+    directory = zlib.compress('\n'.join(first_keys).encode('utf-8'))
+    header = TERM_TABLE_HEADER.pack(len(terms), len(first_keys), len(directory), key_size)
+    return b''.join([header, directory, key_ends.tobytes(), id_ends.tobytes(), *key_blocks, *id_blocks])
+
+
+class TermTable:
+    """读取 write_term_table 写出的词典，buffer 可以是 bytes 或 mmap，只解压查找用到的块
+
+    键的编号为其在全部键中的序号，第 k 块为编号 k*TERM_BLOCK_SIZE 起的键。
+    """
+
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.count, block_count, directory_size, keys_size = TERM_TABLE_HEADER.unpack_from(buffer, offset)
+        offset += TERM_TABLE_HEADER.size
+        directory = zlib.decompress(buffer[offset:offset + directory_size]).decode('utf-8')
+        self.first_keys = directory.split('\n') if block_count else []
+        offset += directory_size
+        self.key_ends = array('I', buffer[offset:offset + block_count * 4])
+        offset += block_count * 4
+        self.id_ends = array('I', buffer[offset:offset + block_count * 4])
+        offset += block_count * 4
+        self.keys_offset = offset
+        self.ids_offset = offset + keys_size
+        self.key_blocks = {}  # {块编号: [键]}，已解压的块
+        self.id_blocks = {}   # {块编号: [array(编号)]}
+
+    def _read(self, base, ends, block_id):
+        start = ends[block_id - 1] if block_id else 0
+        return zlib.decompress(self.buffer[base + start:base + ends[block_id]])
+
+    def block(self, block_id):
+        """第block_id块中的键"""
+        keys = self.key_blocks.get(block_id)
+        if keys is None:
+            keys = self.key_blocks[block_id] = self._read(self.keys_offset, self.key_ends, block_id).decode('utf-8').split('\n')
+        return keys
+
+    def key(self, term_id):
+        return self.block(term_id // TERM_BLOCK_SIZE)[term_id % TERM_BLOCK_SIZE]
+
+    def find(self, key):
+        """键的编号，不存在时返回None"""
+        block_id = bisect.bisect_right(self.first_keys, key) - 1
+        if block_id < 0:
+            return None
+        keys = self.block(block_id)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return block_id * TERM_BLOCK_SIZE + i
+        return None
+
+    def prefix(self, prefix):
+        """以prefix开头的所有键的编号"""
+        block_id = max(bisect.bisect_left(self.first_keys, prefix) - 1, 0)
+        ids = []
+        while block_id < len(self.first_keys):
+            keys = self.block(block_id)
+            i = bisect.bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                ids.append(block_id * TERM_BLOCK_SIZE + i)
+                i += 1
+            if i < len(keys):
+                break
+            block_id += 1
+        return ids
+
+    def postings(self, term_id):
+        block_id, i = divmod(term_id, TERM_BLOCK_SIZE)
+        lists = self.id_blocks.get(block_id)
+        if lists is None:
+            raw = array('I', self._read(self.ids_offset, self.id_ends, block_id))
+            count = len(self.block(block_id))
+            lists, pos = [], count
+            for size in raw[:count]:
+                lists.append(array('I', itertools.accumulate(raw[pos:pos + size])))
+                pos += size
+            self.id_blocks[block_id] = lists
+        return lists[i]
+
+
+class BaseSearchIndex:
+    """按查询词过滤行组，词的存储方式由子类实现：
+
+    _prefix(词) 返回以该词开头的词，_containing(词) 返回包含该词的词（新的集合），
+    _truncated_words() 返回被截断的超长词，_ids(词) 返回包含该词的行组编号。
+    """
+
+    groups = 0
+
+    def _words(self, token, inside):
+        """词表中可能包含查询词的词，无法用索引过滤时返回None"""
+        if not inside or not token.isascii():
+            # 中文按单字索引，单字只能是完整的词
+            return self._prefix(token)
+        if len(token) < 3:
+            return None  # 过短的片段几乎出现在每个行组中，不用于过滤
+        words = self._containing(token)
+        # 超长的词只索引了前 MAX_TOKEN_LENGTH 个字符，查询词可能在被截掉的部分中
+        words.update(self._truncated_words())
+        if len(words) > self.groups:
+            return None  # 匹配的词比行组还多时，合并编号不如直接扫描
+        return words
+
+    def candidates(self, tokens):
+        """返回可能包含所有查询词的行组编号（升序），无法过滤时返回None"""
+        result = None
+        for token, inside in tokens:
+            words = self._words(token, inside)
+            if words is None:
+                continue
+            ids = set()
+            for word in words:
+                ids.update(self._ids(word))
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        return None if result is None else sorted(result)
+
+
+class SearchIndex(BaseSearchIndex):
+    """单个日志文件的倒排索引：词 -> 包含该词的行组编号
+
+    行组与行索引(LineIndex)的检查点对齐，第 k 组为第 k*stride 行起的 stride 行。
+    当日日志的索引只在内存中，子串查找用的3字符片段表在第一次需要时建立；
+    历史日志建立后用 to_bytes 保存，查询时由 StoredSearchIndex 按需读取。
+    """
+
+    def __init__(self, stride):
+        self.stride = stride
+        self.groups = 0          # 已索引的行组数量
+        self.content_size = 0    # 已索引内容的字节数
+        self.postings = {}       # {词: array('I', [组编号...])}
+        self.truncated = set()   # 被截断的超长词
+        self.inode = None        # 当日日志对应文件的inode，轮转后索引失效
+        self.line_index = None   # 历史日志：建立索引时使用的行索引
+        self._vocab = None       # 排序后的词表，用于前缀查找
+        self._trigrams = None    # {3字符片段: {词}}，用于子串查找
+        self._new_words = []     # 尚未加入片段表的词
+
+    def add_group(self, group_id, text):
+        for token in index_tokens(text):
+            ids = self.postings.get(token)
+            if ids is None:
+                self.postings[token] = array('I', [group_id])
+                self._new_words.append(token)
+                self._vocab = None
+                if len(token) == MAX_TOKEN_LENGTH:
+                    self.truncated.add(token)
+            else:
+                ids.append(group_id)
+        self.groups = group_id + 1
+
+    def extend(self, source, line_index, complete):
+        """索引新出现的完整行组，complete为True时最后不足一组的部分也一并索引"""
+        offsets = line_index.offsets
+        end_group = len(offsets) if complete else len(offsets) - 1
+        for group_id in range(self.groups, end_group):
+            start = offsets[group_id]
+            end = offsets[group_id + 1] if group_id + 1 < len(offsets) else line_index.indexed_size
+            self.add_group(group_id, source.read(start, end - start).decode(LOG_ENCODING, errors='replace'))
+            self.content_size = end
+
+    def _prefix(self, token):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        words = []
+        i = bisect.bisect_left(self._vocab, token)
+        while i < len(self._vocab) and self._vocab[i].startswith(token):
+            words.append(self._vocab[i])
+            i += 1
+        return words
+
+    def _add_trigrams(self):
+        """把新出现的词加入片段表"""
+        if self._trigrams is None:
+            self._trigrams = {}
+        for word in self._new_words:
+            for trigram in word_trigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(word)
+        self._new_words = []
+
+    def _containing(self, token):
+        self._add_trigrams()
+        words = None
+        for trigram in word_trigrams(token):
+            found = self._trigrams.get(trigram, set())
+            words = found if words is None else words & found
+            if not words:
+                return set()
+        return {word for word in words if token in word}
+
+    def _truncated_words(self):
+        return self.truncated
+
+    def _ids(self, word):
+        return self.postings[word]
+
+    def to_bytes(self):
+        """保存为 StoredSearchIndex 可直接读取的格式：文件头、行组偏移、词典、片段表、超长词
+
+        片段表记录每个3字符片段出现在词典的哪些块中，子串查找只需解压这些块的词。
+        """
+        words = sorted(self.postings)
+        word_table = write_term_table([(word, self.postings[word]) for word in words])
+        block_trigrams = {}
+        for block_id, i in enumerate(range(0, len(words), TERM_BLOCK_SIZE)):
+            trigrams = set()
+            for word in words[i:i + TERM_BLOCK_SIZE]:
+                trigrams.update(word_trigrams(word))
+            for trigram in trigrams:
+                block_trigrams.setdefault(trigram, []).append(block_id)
+        trigram_table = write_term_table(sorted(block_trigrams.items()))
+        truncated = array('I', [i for i, word in enumerate(words) if len(word) == MAX_TOKEN_LENGTH]).tobytes()
+        offsets = self.line_index.offsets
+        deltas = array('Q', [offsets[0]])
+        deltas.extend(offsets[i] - offsets[i - 1] for i in range(1, len(offsets)))
+        offsets_data = zlib.compress(deltas.tobytes())
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.stride, self.groups, self.content_size,
+                                   self.line_index.newline_count, len(offsets_data), len(word_table),
+                                   len(trigram_table), len(truncated))
+        return b''.join([header, offsets_data, word_table, trigram_table, truncated])
+
+
+class StoredSearchIndex(BaseSearchIndex):
+    """从索引文件读取的历史日志索引：加载时只读取文件头、行组偏移和两个词典的块目录，
+    查询时再解压用到的词典块"""
+
+    def __init__(self, buffer, path):
+        if len(buffer) < INDEX_HEADER.size:
+            raise ValueError("索引文件不完整")
+        (magic, version, self.stride, self.groups, self.content_size, newline_count, offsets_size,
+         words_size, trigrams_size, truncated_size) = INDEX_HEADER.unpack_from(buffer, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("索引版本不匹配")
+        offset = INDEX_HEADER.size
+        offsets = array('Q', itertools.accumulate(array('Q', zlib.decompress(buffer[offset:offset + offsets_size]))))
+        offset += offsets_size
+        self.line_index = LineIndex.restore(path, self.stride, offsets, newline_count, self.content_size)
+        self.words = TermTable(buffer, offset)
+        offset += words_size
+        self.trigrams = TermTable(buffer, offset)
+        offset += trigrams_size
+        self.truncated_offset, self.truncated_size = offset, truncated_size
+        self.buffer = buffer
+        self.lock = threading.Lock()  # 多个查询线程共用同一个索引时保护已解压块的缓存
+
+    @classmethod
+    def load(cls, index_path, path):
+        """映射索引文件（不读入内存），path 为对应的日志文件"""
+        with open(index_path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+    def candidates(self, tokens):
+        with self.lock:
+            return super().candidates(tokens)
+
+    def _prefix(self, token):
+        return self.words.prefix(token)
+
+    def _containing(self, token):
+        blocks = None
+        for trigram in word_trigrams(token):
+            term_id = self.trigrams.find(trigram)
+            found = set() if term_id is None else set(self.trigrams.postings(term_id))
+            blocks = found if blocks is None else blocks & found
+            if not blocks:
+                return set()
+        words = set()
+        for block_id in blocks:
+            for i, word in enumerate(self.words.block(block_id)):
+                if token in word:
+                    words.add(block_id * TERM_BLOCK_SIZE + i)
+        return words
+
+    def _truncated_words(self):
+        start = self.truncated_offset
+        return array('I', self.buffer[start:start + self.truncated_size])
+
+    def _ids(self, word_id):
+        return self.words.postings(word_id)
+
+
+def index_file_path(path):
+    """历史日志的索引文件位置，压缩前后共用同一个索引（内容偏移相同）"""
+    sn = os.path.basename(os.path.dirname(path))
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.join(SEARCH_INDEX_DIR, sn, name + '.idx')
+
+
+class SearchIndexManager:
+    """管理所有日志文件的搜索索引
+
+    - 历史日志：轮转后在后台建立索引并保存到 SEARCH_INDEX_DIR，查询时按需加载
+    - 当日日志：只保存在内存中，每次查询前增量索引新写入的完整行组
+    """
+
+    def __init__(self, max_entries=SEARCH_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()   # {路径: SearchIndex}
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()  # 避免并发查询重复扩展同一个当日索引
+        self.queue = Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        add_rotation_listener(self.submit)
+        self.thread = threading.Thread(target=self._run, name="SearchIndexer", daemon=True)
+        self.thread.start()
+
+    def submit(self, path):
+        """日志轮转后提交建索引任务"""
+        self.queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            try:
+                try:
+                    self.get(path, live=False)
+                except FileNotFoundError:
+                    # 轮转后的文件可能已被压缩
+                    self.get(path + '.gz', live=False)
+            except Exception as e:
+                logger.error(f"建立搜索索引失败 {path}: {str(e)}")
+
+    def _cached(self, path):
+        with self.lock:
+            index = self.cache.get(path)
+            if index is not None:
+                self.cache.move_to_end(path)
+            return index
+
+    def _store(self, path, index):
+        with self.lock:
+            self.cache[path] = index
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def discard(self, path):
+        """日志文件被删除后移除对应的搜索索引"""
+        with self.lock:
+            self.cache.pop(path, None)
+        try:
+            os.remove(index_file_path(path))
+        except FileNotFoundError:
+            pass
+
+    def get(self, path, live):
+        """获取日志文件的搜索索引，返回 (行索引, 搜索索引)
+
+        历史日志的行索引从保存的索引文件中恢复，只有没有索引或索引失效时才需要读取整个文件。
+        """
+        if not live:
+            return self._get_rotated(path)
+        line_index = line_index_cache.get(path)
+        stride = line_index.stride
+        index = self._cached(path)
+        if index is not None and (index.stride != stride or index.content_size > line_index.indexed_size):
+            index = None  # 文件已轮转或索引参数变化，重新建立
+        with self.build_lock:
+            if index is None or index.inode != line_index.inode:
+                index = SearchIndex(stride)
+                index.inode = line_index.inode
+            if index.groups < len(line_index.offsets) - 1:
+                with open_log_source(path) as source:
+                    index.extend(source, line_index, complete=False)
+        self._store(path, index)
+        return line_index, index
+
+    def _get_rotated(self, path):
+        # 历史日志内容不再变化，解压后的大小（压缩文件只读取块头）一致即可使用已有的索引
+        with open_log_source(path) as source:
+            size = source.size
+        index = self._cached(path)
+        if index is not None and (index.stride != LOG_INDEX_STRIDE or index.content_size != size):
+            index = None
+        if index is None:
+            index_path = index_file_path(path)
+            try:
+                index = StoredSearchIndex.load(index_path, path)
+                if index.stride != LOG_INDEX_STRIDE or index.content_size != size:
+                    index = None
+            except FileNotFoundError:
+                index = None
+            except Exception as e:
+                logger.warning(f"搜索索引无效，重新建立 {index_path}: {str(e)}")
+                index = None
+            if index is None:
+                line_index = line_index_cache.get(path)
+                index = SearchIndex(line_index.stride)
+                index.line_index = line_index
+                with open_log_source(path) as source:
+                    index.extend(source, line_index, complete=True)
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                tmp = index_path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(index.to_bytes())
+                os.replace(tmp, index_path)
+                logger.info(f"已建立搜索索引 {index_path}: {index.groups} 个行组, {len(index.postings)} 个词")
+            self._store(path, index)
+        return index.line_index, index
+
+
+search_index_manager = SearchIndexManager()
+
+
+def match_sn(sn, patterns):
+    """SN过滤：精确匹配，或以*结尾的前缀匹配，未指定时搜索除default外的所有SN"""
+    if not patterns:
+        return sn != 'default'
+    for pattern in patterns:
+        if pattern.endswith('*'):
+            if sn.startswith(pattern[:-1]):
+                return True
+        elif sn == pattern:
+            return True
+    return False
+
+
+def list_search_files(sn_patterns=None, date_from=None, date_to=None):
+    """按日期倒序、SN升序列出需要搜索的 (SN, 日期, 路径)，同一天按大小轮转的多个文件按顺序排列"""
+    files = []
+    for sn in log_catalog.sn_list(include_default=True):
+        if not match_sn(sn, sn_patterns):
+            continue
+        sn_files = []
+        names = set()
+        for filename, date, _, mtime in log_catalog.sn_files(sn):
+            names.add(filename)
+            date = date or live_log_date(mtime)
+            if (date_from and date < date_from) or (date_to and date > date_to):
+                continue
+            # 同一天的文件顺序：server.log.日期, .1, .2 ...，当日日志最后
+            sn_files.append(((date, filename == 'server.log', log_file_part(filename)), filename))
+        sn_files.sort()
+        for (date, _, _), filename in sn_files:
+            # 正在压缩时原文件和.gz可能同时存在，只搜索原文件
+            if filename.endswith('.gz') and filename[:-3] in names:
+                continue
+            files.append((sn, date, os.path.join(LOG_DIR, sn, filename)))
+    # 稳定排序：同一天内保持SN升序和文件顺序
+    files.sort(key=lambda item: item[1], reverse=True)
+    return files
+
+
+def search_logs(query, sn_patterns=None, date_from=None, date_to=None, limit=SEARCH_DEFAULT_LIMIT):
+    """在日志中搜索包含query的行（不区分大小写），逐条产出匹配结果"""
+    needle = query.lower()
+    tokens = query_tokens(query)
+    count = 0
+    line_bases = {}  # {(SN, 日期): 当天之前各部分的行数}，结果的行号是当天各部分拼接后的行号
+    for sn, date, path in list_search_files(sn_patterns, date_from, date_to):
+        if not os.path.exists(path):
+            # 目录信息更新前原文件已被压缩为.gz
+            path += '.gz'
+            if not os.path.exists(path):
+                continue
+        live = LOG_FILE_PATTERN.match(os.path.basename(path)).group(1) is None
+        line_index, index = search_index_manager.get(path, live)
+        line_base = line_bases.get((sn, date), 0)
+        line_bases[(sn, date)] = line_base + line_index.newline_count
+        candidates = index.candidates(tokens)
+        groups = list(range(index.groups)) if candidates is None else candidates
+        # 当日日志最后不足一组的部分尚未索引，直接扫描
+        groups += range(index.groups, len(line_index.offsets))
+        offsets = line_index.offsets
+        with open_log_source(path) as source:
+            limit_size = min(line_index.indexed_size, source.size)
+            for group_id in groups:
+                if group_id >= len(offsets):
+                    break
+                start = offsets[group_id]
+                end = offsets[group_id + 1] if group_id + 1 < len(offsets) else limit_size
+                text = source.read(start, end - start).decode(LOG_ENCODING, errors='replace')
+                for i, line in enumerate(text.split('\n')):
+                    if needle in ANSI_PATTERN.sub('', line).lower():
+                        line_number = line_base + group_id * index.stride + i + 1
+                        yield {
+                            "sn": sn,
+                            "date": date,
+                            "line": line_number,
+                            "text": line,
+                            "link": f"/logs.html?sn={sn}&date={date}&line={line_number}",
+                        }
+                        count += 1
+                        if count >= limit:
+                            return
@@ -0,0 +1,379 @@
+import os
+import re
+import mmap
+import zlib
+import time
+import struct
+import shutil
+import bisect
+import threading
+from queue import Queue
+from collections import OrderedDict
+from datetime import datetime
+from logger_config import logger, LOG_DIR, add_rotation_listener
+from config import LOG_COMPRESS_ROTATED, LOG_COMPRESS_BLOCK_SIZE, LOG_COMPRESS_LEVEL
+
+# server.log / server.log.YYYY-MM-DD[.N][.gz]，N为当天按大小轮转的编号
+LOG_FILE_PATTERN = re.compile(r'^server\.log(?:\.(\d{4}-\d{2}-\d{2})(?:\.(\d+))?(\.gz)?)?$')
+
+# 分块gzip格式：每块是一个独立的gzip member，头部FEXTRA中的"LB"子字段
+# 记录本member的总字节数和解压后的字节数，读取时只需跳读各块头部即可建立块索引
+GZIP_MAGIC = b'\x1f\x8b\x08'
+BLOCK_HEADER = struct.Struct('<3sBIBBH2sHII')  # magic, flags, mtime, xfl, os, xlen, 'LB', len, csize, usize
+BLOCK_HEADER_SIZE = BLOCK_HEADER.size
+BLOCK_TRAILER_SIZE = 8
+FEXTRA = 0x04
+
+
+def today_str():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def log_file_date(filename):
+    """日志文件对应的日期，当前日志为今天，不是日志文件时返回None"""
+    match = LOG_FILE_PATTERN.match(filename)
+    if not match:
+        return None
+    return match.group(1) or today_str()
+
+
+def log_file_part(filename):
+    """同一天按大小轮转的编号，当天第一个文件为0"""
+    match = LOG_FILE_PATTERN.match(filename)
+    return int(match.group(2)) if match and match.group(2) else 0
+
+
+def is_compressed(path):
+    return path.endswith('.gz')
+
+
+def live_log_date(mtime):
+    """当日日志（server.log）的内容日期：跨天后第一次写入时才会轮转，因此以最后修改时间为准"""
+    return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d')
+
+
+def day_log_files(sn, date):
+    """SN某一天的所有日志文件：按大小轮转的各部分按编号排列，内容日期为当天的 server.log 在最后，
+    依次拼接即为当天的完整日志"""
+    parts = {}
+    live = None
+    try:
+        with os.scandir(os.path.join(LOG_DIR, sn)) as it:
+            for item in it:
+                match = LOG_FILE_PATTERN.match(item.name)
+                if not match:
+                    continue
+                if match.group(1) is None:
+                    try:
+                        if live_log_date(item.stat().st_mtime) == date:
+                            live = item.path
+                    except FileNotFoundError:
+                        pass
+                elif match.group(1) == date:
+                    part = int(match.group(2) or 0)
+                    # 正在压缩时原文件和.gz可能同时存在，使用原文件
+                    if part not in parts or not match.group(3):
+                        parts[part] = item.path
+    except FileNotFoundError:
+        return []
+    paths = [parts[part] for part in sorted(parts)]
+    if live is not None:
+        paths.append(live)
+    return paths
+
+
+class PlainLogSource:
+    """未压缩的日志文件，通过mmap按偏移读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def read(self, offset, length):
+        if self.mm is None or offset >= self.size:
+            return b''
+        return self.mm[offset:min(offset + length, self.size)]
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BlockGzipSource:
+    """分块gzip压缩的日志文件，按偏移读取时只解压涉及的块"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.compressed_size = stat.st_size
+        self.coffsets, self.uoffsets = load_block_table(path, self.file, stat)
+        self.size = self.uoffsets[-1]
+        self.cache = OrderedDict()  # 最近解压的块
+
+    def _block(self, i):
+        data = self.cache.get(i)
+        if data is None:
+            start, end = self.coffsets[i], self.coffsets[i + 1]
+            self.file.seek(start)
+            member = self.file.read(end - start)
+            data = zlib.decompress(member[BLOCK_HEADER_SIZE:-BLOCK_TRAILER_SIZE], -zlib.MAX_WBITS)
+            self.cache[i] = data
+            if len(self.cache) > 4:
+                self.cache.popitem(last=False)
+        return data
+
+    def read(self, offset, length):
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b''
+        i = bisect.bisect_right(self.uoffsets, offset) - 1
+        parts = []
+        pos = offset
+        while pos < end:
+            block_start = self.uoffsets[i]
+            data = self._block(i)
+            parts.append(data[pos - block_start:end - block_start])
+            pos = self.uoffsets[i + 1]
+            i += 1
+        return b''.join(parts)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DayLogSource:
+    """一天的日志：依次拼接各部分（可以混合未压缩和已压缩的文件），偏移为拼接后的偏移
+
+    各部分只会在末尾追加或被原样压缩，因此同一位置的内容不受按大小轮转和压缩的影响。
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.sources = []
+        self.offsets = [0]  # offsets[i] 为第i部分在拼接后内容中的起始偏移
+        try:
+            for path in paths:
+                source = open_log_source(path)
+                self.sources.append(source)
+                self.offsets.append(self.offsets[-1] + source.size)
+        except BaseException:
+            self.close()
+            raise
+        self.size = self.offsets[-1]
+
+    def spans(self, start, end):
+        """[start, end) 区间涉及的各部分 (读取对象, 部分内的起始偏移, 长度)"""
+        end = min(end, self.size)
+        if start >= end:
+            return
+        i = bisect.bisect_right(self.offsets, start) - 1
+        while start < end:
+            base, stop = self.offsets[i], min(end, self.offsets[i + 1])
+            if stop > start:
+                yield self.sources[i], start - base, stop - start
+            start = stop
+            i += 1
+
+    def read(self, offset, length):
+        return b''.join(source.read(start, length) for source, start, length in self.spans(offset, offset + length))
+
+    def stat(self):
+        """最后一部分的文件状态，用于生成ETag（之前的部分不会再变化）"""
+        return os.fstat(self.sources[-1].file.fileno())
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_day_source(sn, date):
+    """打开SN某一天的日志，没有日志时返回None；打开时正好有文件被轮转或压缩则重新列出"""
+    for attempt in range(3):
+        paths = day_log_files(sn, date)
+        if not paths:
+            return None
+        try:
+            return DayLogSource(paths)
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+
+def open_log_source(path):
+    """打开日志文件，返回支持 size / read(offset, length) 的读取对象"""
+    if is_compressed(path):
+        return BlockGzipSource(path)
+    return PlainLogSource(path)
+
+
+def iter_source(source, start=0, end=None, chunk_size=65536):
+    """按块迭代读取 [start, end) 区间的内容"""
+    end = source.size if end is None else min(end, source.size)
+    pos = start
+    while pos < end:
+        data = source.read(pos, min(chunk_size, end - pos))
+        if not data:
+            break
+        yield data
+        pos += len(data)
+
+
+_block_tables = OrderedDict()
+_block_tables_lock = threading.Lock()
+
+
+def load_block_table(path, f, stat):
+    """读取各块头部建立块索引，压缩文件不再变化，按 (路径, inode, 大小) 缓存"""
+    key = (path, stat.st_ino, stat.st_size)
+    with _block_tables_lock:
+        table = _block_tables.get(key)
+        if table is not None:
+            _block_tables.move_to_end(key)
+            return table
+
+    coffsets, uoffsets = [0], [0]
+    pos = 0
+    while pos < stat.st_size:
+        f.seek(pos)
+        header = f.read(BLOCK_HEADER_SIZE)
+        if len(header) < BLOCK_HEADER_SIZE:
+            raise ValueError(f"压缩日志块头不完整: {path}@{pos}")
+        magic, flags, _, _, _, _, subfield, _, csize, usize = BLOCK_HEADER.unpack(header)
+        if magic != GZIP_MAGIC or not flags & FEXTRA or subfield != b'LB':
+            raise ValueError(f"不是分块压缩的日志文件: {path}")
+        pos += csize
+        coffsets.append(pos)
+        uoffsets.append(uoffsets[-1] + usize)
+
+    table = (coffsets, uoffsets)
+    with _block_tables_lock:
+        _block_tables[key] = table
+        while len(_block_tables) > 1024:
+            _block_tables.popitem(last=False)
+    return table
+
+
+def write_block(out, data, level=LOG_COMPRESS_LEVEL):
+    """写入一个独立的gzip member，返回写入的字节数"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    csize = BLOCK_HEADER_SIZE + len(deflated) + BLOCK_TRAILER_SIZE
+    out.write(BLOCK_HEADER.pack(GZIP_MAGIC, FEXTRA, int(time.time()), 0, 255, 12, b'LB', 8, csize, len(data)))
+    out.write(deflated)
+    out.write(struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff))
+    return csize
+
+
+def compress_log(path, block_size=LOG_COMPRESS_BLOCK_SIZE):
+    """将已轮转的日志压缩为分块gzip（标准gzip工具也可直接解压），完成后删除原文件"""
+    target = path + '.gz'
+    dirname, basename = os.path.split(path)
+    # 临时文件以.开头，不会被当作日志或被轮转清理误删
+    tmp = os.path.join(dirname, f'.{basename}.gz.tmp')
+    stat = os.stat(path)
+    if os.path.exists(target):
+        # 同一日期再次轮转时追加到已有压缩文件之后
+        shutil.copyfile(target, tmp)
+    with open(path, 'rb') as src, open(tmp, 'ab') as out:
+        while True:
+            data = src.read(block_size)
+            if not data:
+                break
+            write_block(out, data)
+        out.flush()
+        os.fsync(out.fileno())
+    os.utime(tmp, (stat.st_atime, stat.st_mtime))
+    os.replace(tmp, target)
+    os.remove(path)
+    return stat.st_size, os.path.getsize(target)
+
+
+def find_uncompressed_logs():
+    """查找所有尚未压缩的历史日志"""
+    paths = []
+    if not os.path.isdir(LOG_DIR):
+        return paths
+    for sn in os.listdir(LOG_DIR):
+        sn_path = os.path.join(LOG_DIR, sn)
+        if not os.path.isdir(sn_path):
+            continue
+        for filename in os.listdir(sn_path):
+            match = LOG_FILE_PATTERN.match(filename)
+            if match and match.group(1) and not match.group(3):
+                paths.append(os.path.join(sn_path, filename))
+    return paths
+
+
+# 日志压缩完成后的回调，参数为压缩前的文件路径（原文件已删除，替换为 路径.gz）
+compress_listeners = []
+
+
+def add_compress_listener(listener):
+    compress_listeners.append(listener)
+
+
+class LogCompressor:
+    """后台压缩线程：启动时处理积压的历史日志，之后压缩每次轮转产生的文件"""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+
+    def start(self):
+        if not LOG_COMPRESS_ROTATED or self.thread is not None:
+            return
+        add_rotation_listener(self.submit)
+        self.thread = threading.Thread(target=self._run, name="LogCompressor", daemon=True)
+        self.thread.start()
+        for path in find_uncompressed_logs():
+            self.submit(path)
+
+    def submit(self, path):
+        self.queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            if not os.path.exists(path):
+                continue
+            try:
+                begin = time.monotonic()
+                original, compressed = compress_log(path)
+                ratio = original / compressed if compressed else 0
+                logger.info(f"已压缩日志 {path}: {original} -> {compressed} bytes "
+                            f"(压缩比 {ratio:.1f}, 耗时 {time.monotonic() - begin:.2f}s)")
+            except Exception as e:
+                logger.error(f"压缩日志失败 {path}: {str(e)}")
+                continue
+            for listener in compress_listeners:
+                try:
+                    listener(path)
+                except Exception as e:
+                    logger.error(f"压缩回调失败 {path}: {str(e)}")
+
+
+log_compressor = LogCompressor()
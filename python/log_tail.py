@@ -0,0 +1,116 @@
+import os
+import re
+from logger_config import LOG_DIR
+from log_index import line_index_cache
+from log_store import today_str, live_log_date, open_day_source
+from config import TAIL_MAX_BYTES, TAIL_INITIAL_BYTES, LOG_ENCODING
+
+CURSOR_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}):(\d+)$')
+
+
+def live_log_path(sn):
+    return os.path.join(LOG_DIR, sn, 'server.log')
+
+
+def format_cursor(date, offset):
+    return f"{date}:{offset}"
+
+
+def parse_cursor(cursor):
+    """解析 "YYYY-MM-DD:偏移" 格式的游标"""
+    match = CURSOR_PATTERN.match(cursor)
+    if not match:
+        raise ValueError(f"无效的游标: {cursor}")
+    return match.group(1), int(match.group(2))
+
+
+def live_signature(sn):
+    """当前日志的 (inode, 大小)，跟踪时据此判断是否需要读取"""
+    try:
+        stat = os.stat(live_log_path(sn))
+        return stat.st_ino, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _read_from(source, sn, date, offset, max_bytes, complete):
+    """从当天日志（各部分拼接后）的offset读取最多max_bytes字节，complete为False时只返回完整的行"""
+    reset = False
+    with source:
+        size = source.size
+        if offset is None:
+            # 首次跟踪时返回最后一段内容，从完整的行开始
+            offset = max(0, size - TAIL_INITIAL_BYTES)
+            if offset:
+                newline = source.read(offset, size - offset).find(b'\n')
+                offset = size if newline == -1 else offset + newline + 1
+        elif offset > size:
+            # 文件被截断或替换，从头开始
+            offset = 0
+            reset = True
+        data = source.read(offset, max_bytes)
+    if not complete:
+        end = data.rfind(b'\n')
+        if end != -1:
+            data = data[:end + 1]
+        elif len(data) < max_bytes:
+            # 最后一行还没写完，等待下次读取
+            data = b''
+    end_offset = offset + len(data)
+    return {
+        'content': data.decode(LOG_ENCODING, errors='replace'),
+        'start_line': line_index_cache.get_day(sn, date).line_at(offset),
+        'date': date,
+        'cursor': format_cursor(date, end_offset),
+        'reset': reset,
+        'more': bool(data) and end_offset < size,
+    }
+
+
+def read_tail(sn, cursor=None, max_bytes=TAIL_MAX_BYTES):
+    """读取游标之后追加的内容
+
+    游标为 "日期:偏移"，偏移是当天各部分日志拼接后的偏移，因此按大小轮转和压缩后仍然有效；
+    午夜轮转后先读完前一天的剩余部分，再从新一天的开头继续。不传游标时从当前日志末尾开始。
+    """
+    live = live_log_path(sn)
+    try:
+        stat = os.stat(live)
+        live_date = live_log_date(stat.st_mtime)
+    except FileNotFoundError:
+        stat = None
+        live_date = today_str()
+
+    reset = False
+    if cursor is None:
+        date, offset = live_date, None
+    else:
+        date, offset = parse_cursor(cursor)
+
+    if date < live_date:
+        # 游标所在的日志已轮转，先读完那一天剩余的内容（可能已被压缩）
+        source = open_day_source(sn, date)
+        if source is not None:
+            result = _read_from(source, sn, date, offset, max_bytes, complete=True)
+            if result['content']:
+                result['more'] = True
+                return result
+        else:
+            # 已轮转的文件已被清理，部分内容无法再读取
+            reset = True
+        date, offset = live_date, 0
+    elif date > live_date:
+        date, offset = live_date, 0
+        reset = True
+
+    if stat is None:
+        return {'content': '', 'start_line': 0, 'date': date, 'cursor': format_cursor(date, 0),
+                'reset': reset, 'more': False}
+    source = open_day_source(sn, date)
+    if source is None:
+        # 刚好在轮转，下次再读
+        return {'content': '', 'start_line': 0, 'date': date, 'cursor': format_cursor(date, offset or 0),
+                'reset': reset, 'more': False}
+    result = _read_from(source, sn, date, offset, max_bytes, complete=False)
+    result['reset'] = result['reset'] or reset
+    return result
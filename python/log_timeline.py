@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import heapq
+import base64
+from datetime import datetime
+from logger_config import LOG_DIR
+from log_catalog import log_catalog
+from log_store import open_log_source, iter_source, log_file_part, live_log_date
+from config import LOG_ENCODING, TIME_RANGE_MAX_BYTES
+
+# 日志行开头的时间戳（ColoredFormatter 的 asctime），按字符串比较即按时间比较
+TIMESTAMP_PATTERN = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}')
+TIMESTAMP_LENGTH = 23
+READ_BLOCK_SIZE = 65536
+PROBE_SIZE = 4096             # 二分查找时每次探测读取的字节数
+LINEAR_SEEK_BYTES = 65536     # 查找范围缩小到这个大小后改为顺序扫描
+END_OF_TIME = '9999-12-31 23:59:59,999'
+
+
+def parse_time(value):
+    """把 2026-10-03T14:32[:05[.123]] / 2026-10-03 14:32 / 2026-10-03 转换为日志时间戳格式，无效时抛出ValueError"""
+    moment = datetime.fromisoformat(value.strip())
+    return moment.strftime('%Y-%m-%d %H:%M:%S') + f',{moment.microsecond // 1000:03d}'
+
+
+def timeline_files(sn, start, end):
+    """SN在时间窗口内可能有日志的文件 [(路径, 是否为当日日志)]，按时间顺序排列
+
+    当日日志（server.log）按修改时间判断：跨天后第一次写入前，其中仍是前一天的内容。
+    """
+    first_date, last_date = start[:10], end[:10]
+    files = []
+    names = set()
+    for filename, date, _, mtime in log_catalog.sn_files(sn):
+        names.add(filename)
+        if date is None:
+            if live_log_date(mtime) >= first_date:
+                files.append(((END_OF_TIME, 0), filename))
+        elif first_date <= date <= last_date:
+            files.append(((date, log_file_part(filename)), filename))
+    files.sort()
+    # 正在压缩时原文件和.gz可能同时存在，只读原文件
+    return [(os.path.join(LOG_DIR, sn, filename), filename == 'server.log') for _, filename in files
+            if not (filename.endswith('.gz') and filename[:-3] in names)]
+
+
+def _next_timestamp(source, pos, limit):
+    """pos 之后（不含pos所在行）第一个带时间戳的行 (行首偏移, 时间戳)，在 limit 之前找不到时返回None"""
+    while pos < limit:
+        window = source.read(pos, min(PROBE_SIZE, limit - pos) + TIMESTAMP_LENGTH)
+        if not window:
+            return None
+        i = window.find(b'\n')
+        while i != -1:
+            if pos + i + 1 >= limit:
+                return None
+            if len(window) - i - 1 < TIMESTAMP_LENGTH and pos + len(window) < source.size:
+                break  # 时间戳被窗口截断，从该行重新读取
+            if TIMESTAMP_PATTERN.match(window, i + 1):
+                return pos + i + 1, window[i + 1:i + 1 + TIMESTAMP_LENGTH].decode('ascii')
+            i = window.find(b'\n', i + 1)
+        pos += len(window) if i == -1 else i
+    return None
+
+
+def seek_time(source, timestamp):
+    """第一个时间戳不早于 timestamp 的行的起始偏移（没有时为文件大小）
+
+    日志按时间顺序追加，先对字节偏移二分查找：从中点向后对齐到下一个带时间戳的行首，
+    比较时间戳缩小范围；范围小于 LINEAR_SEEK_BYTES 后从下界顺序扫描。
+    只读取 O(log n) 个探测窗口，1GB 的文件也只需要几十次小读取。
+    """
+    lo, hi = 0, source.size  # lo 始终是行首，且之前的行都早于 timestamp
+    while hi - lo > LINEAR_SEEK_BYTES:
+        mid = (lo + hi) // 2
+        found = _next_timestamp(source, mid - 1, hi)
+        if found is not None and found[1] < timestamp:
+            lo = found[0]
+        else:
+            hi = mid
+    for offset, line in iter_lines(source, lo):
+        if TIMESTAMP_PATTERN.match(line) and line[:TIMESTAMP_LENGTH].decode('ascii') >= timestamp:
+            return offset
+    return source.size
+
+
+def read_time_range(source, start=None, end=None, offset=None, max_bytes=TIME_RANGE_MAX_BYTES):
+    """读取时间戳在 [start, end) 内的日志内容，超过 max_bytes 时在行边界截断，
+    下一次从返回的 next_offset 继续（offset 必须是此前返回的偏移）"""
+    begin = seek_time(source, start) if start else 0
+    stop = seek_time(source, end) if end else source.size
+    if offset is not None:
+        begin = max(begin, min(offset, stop))
+    data = source.read(begin, min(max_bytes, stop - begin))
+    if begin + len(data) < stop:
+        newline = data.rfind(b'\n')
+        if newline != -1:
+            data = data[:newline + 1]
+    end_offset = begin + len(data)
+    return {
+        'content': data.decode(LOG_ENCODING, errors='replace'),
+        'start_offset': begin,
+        'end_offset': end_offset,
+        'next_offset': end_offset if end_offset < stop else None,
+    }
+
+
+def iter_lines(source, start=0, complete_only=False):
+    """从行首偏移 start 开始逐行读取 (行首偏移, 行内容)，内存占用只有一个读取块；
+    complete_only 时不返回末尾未写完的行"""
+    pending = b''
+    offset = start
+    for block in iter_source(source, start, chunk_size=READ_BLOCK_SIZE):
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield offset, line
+            offset += len(line) + 1
+    if pending and not complete_only:
+        yield offset, pending
+
+
+def sn_lines(sn, start, end, skip=0):
+    """按时间顺序产出SN在 [start, end) 内的日志行 (时间戳, SN, 文本)
+
+    没有时间戳的行（多行日志的后续行）沿用上一行的时间戳；skip 为续读时跳过的时间戳等于start的行数。
+    每个文件先用 seek_time 定位到窗口起点。
+    """
+    timestamp = ''
+    for path, live in timeline_files(sn, start, end):
+        try:
+            source = open_log_source(path)
+        except FileNotFoundError:
+            # 目录信息更新前原文件已被压缩为.gz；两者都不存在时是刚被轮转或删除
+            try:
+                source = open_log_source(path + '.gz')
+            except FileNotFoundError:
+                continue
+        with source:
+            # 二分查找到窗口起点，不需要从文件开头扫描
+            for _, line in iter_lines(source, seek_time(source, start), complete_only=live):
+                if TIMESTAMP_PATTERN.match(line):
+                    timestamp = line[:TIMESTAMP_LENGTH].decode('ascii')
+                if timestamp < start:
+                    continue
+                if timestamp >= end:
+                    return  # 日志按时间顺序追加，之后的行都在窗口之外
+                if skip and timestamp == start:
+                    skip -= 1
+                    continue
+                yield timestamp, sn, line.decode(LOG_ENCODING, errors='replace')
+
+
+class Timeline:
+    """多个SN日志按时间戳的k路归并，逐行产出，内存占用只与SN数量有关
+
+    游标记录最后返回的时间戳，以及每个SN已返回的该时间戳的行数；
+    续读时从该时间戳开始并跳过这些行，与文件是否已轮转或压缩无关。
+    """
+
+    def __init__(self, sns, start, end=END_OF_TIME, cursor=None):
+        self.sns = sns
+        self.start = start
+        self.end = end
+        self.skip = {}
+        if cursor:
+            position = decode_cursor(cursor)
+            self.start = max(start, position["t"])
+            if self.start == position["t"]:
+                self.skip = position["s"]
+        self.last_time = None
+        self.last_counts = {}  # {SN: 已返回的时间戳等于last_time的行数}
+
+    def __iter__(self):
+        streams = [sn_lines(sn, self.start, self.end, self.skip.get(sn, 0)) for sn in self.sns]
+        try:
+            for timestamp, sn, text in heapq.merge(*streams, key=lambda item: item[0]):
+                if timestamp != self.last_time:
+                    # 续读时第一个时间戳与游标相同，已跳过的行也要计入
+                    self.last_counts = dict(self.skip) if timestamp == self.start else {}
+                    self.last_time = timestamp
+                self.last_counts[sn] = self.last_counts.get(sn, 0) + 1
+                yield {"sn": sn, "time": timestamp, "text": text}
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def cursor(self):
+        """当前位置的游标（还没有返回任何行时为None）"""
+        if self.last_time is None:
+            return None
+        return encode_cursor({"t": self.last_time, "s": self.last_counts})
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """解析游标，无效时抛出ValueError"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(position["t"], str) or not all(isinstance(n, int) for n in position["s"].values()):
+            raise ValueError
+        return position
+    except (KeyError, TypeError, AttributeError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
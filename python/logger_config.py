@@ -1,7 +1,16 @@
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import sys
+import time
+import atexit
+import threading
+from queue import Queue, Empty
+from collections import OrderedDict
+from logging.handlers import TimedRotatingFileHandler, QueueHandler
 from datetime import datetime
+from metrics import metrics
+from config import (LOG_CONSOLE_ECHO, LOG_COMMIT_INTERVAL, LOG_COMMIT_MAX_RECORDS, LOG_WRITE_BUFFER_SIZE, LOG_MAX_BYTES,
+                    LOG_MAX_OPEN_FILES)
 
 # 创建日志目录
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
@@ -27,46 +36,290 @@ class ColoredFormatter(logging.Formatter):
         record.msg = original_msg
         return formatted_msg
 
+def report_error(message):
+    """日志写入线程中的错误直接写到stderr（带时间戳）：不能再经过日志队列，也不依赖stdout是否被重定向"""
+    try:
+        sys.stderr.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]} - ERROR - {message}\n")
+        sys.stderr.flush()
+    except Exception:
+        pass
+
+# 日志文件轮转后的回调，参数为轮转后的文件路径
+rotation_listeners = []
+
+def add_rotation_listener(listener):
+    rotation_listeners.append(listener)
+
+# 新建SN日志文件后的回调，参数为SN和日志文件路径
+logger_listeners = []
+
+def add_logger_listener(listener):
+    logger_listeners.append(listener)
+
+class GroupCommitFileHandler(TimedRotatingFileHandler):
+    """按天轮转的文件处理器，写入后不立即flush，由LogWriter批量提交
+
+    提交时文件超过 max_bytes 则在下一条记录写入前提前轮转，同一天的后续文件依次加 .1 .2 ... 后缀。
+    历史日志的删除由后台清理服务统一负责（按天数和大小），这里不删除。
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+        self.oversized = False
+
+    def shouldRollover(self, record):
+        return self.oversized or super().shouldRollover(record)
+
+    def rotation_filename(self, default_name):
+        """已有同名的历史日志（当天按大小轮转过）时使用下一个编号，不覆盖"""
+        name, part = default_name, 0
+        while os.path.exists(name) or os.path.exists(name + '.gz'):
+            part += 1
+            name = f"{default_name}.{part}"
+        return name
+
+    def rotate(self, source, dest):
+        self.oversized = False
+        super().rotate(source, dest)
+        for listener in rotation_listeners:
+            try:
+                listener(dest)
+            except Exception as e:
+                report_error(f"日志轮转回调失败 {dest}: {e}")
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_WRITE_BUFFER_SIZE,
+                    encoding=self.encoding, errors=self.errors)
+
+    def flush(self):
+        # 每条记录写入后StreamHandler会调用flush，这里推迟到commit统一执行
+        pass
+
+    def commit(self):
+        """将缓冲区中的日志真正写入文件"""
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+                if self.max_bytes:
+                    self.oversized = os.fstat(self.stream.fileno()).st_size >= self.max_bytes
+        finally:
+            self.release()
+
+
+class FileHandlerPool:
+    """按日志文件路径打开的文件处理器，最多同时打开 capacity 个（LRU，只在LogWriter线程中使用）
+
+    淘汰最久没有写入的文件时关闭处理器（关闭前写出缓冲区），该文件再次写入时以追加模式重新打开。
+    重新打开时 TimedRotatingFileHandler 按文件修改时间计算下次轮转时间，
+    因此跨天后第一次写入会先把旧内容轮转为对应日期的文件。
+    """
+
+    def __init__(self, capacity=LOG_MAX_OPEN_FILES):
+        self.capacity = capacity
+        self.handlers = OrderedDict()  # {日志文件路径: GroupCommitFileHandler}
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, log_file, on_evict):
+        handler = self.handlers.get(log_file)
+        if handler is not None:
+            self.handlers.move_to_end(log_file)
+            return handler
+        while self.handlers and len(self.handlers) >= self.capacity:
+            _, old_handler = self.handlers.popitem(last=False)
+            on_evict(old_handler)
+            old_handler.close()
+            self.evicted += 1
+        created = not os.path.exists(log_file)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        handler = create_file_handler(log_file)
+        self.handlers[log_file] = handler
+        self.opened += 1
+        if created:
+            sn = os.path.basename(os.path.dirname(log_file))
+            for listener in logger_listeners:
+                try:
+                    listener(sn, log_file)
+                except Exception as e:
+                    report_error(f"新建日志回调失败 {log_file}: {e}")
+        return handler
+
+    def release(self, log_file, on_evict):
+        """关闭并移出指定文件的处理器（关闭时写出缓冲区），没有打开时不做任何事"""
+        handler = self.handlers.pop(log_file, None)
+        if handler is not None:
+            on_evict(handler)
+            handler.close()
+
+    def close_all(self):
+        for handler in self.handlers.values():
+            handler.close()
+        self.handlers.clear()
+
+
+class LogWriter:
+    """异步日志写入线程
+
+    各logger只把记录放入队列，由本线程按logger名称分发给对应的处理器写入；
+    SN日志的记录带有 log_file 属性，写入 FileHandlerPool 中按需打开的文件。
+    文件处理器在攒够 max_pending 条或距第一条未提交记录超过 interval 秒时统一flush。
+    """
+
+    def __init__(self, interval=LOG_COMMIT_INTERVAL, max_pending=LOG_COMMIT_MAX_RECORDS):
+        self.queue = Queue()
+        self.interval = interval
+        self.max_pending = max_pending
+        self.routes = {}    # {logger名称: [handler]}
+        self.file_pool = FileHandlerPool()
+        self.console = None  # SN日志回显到控制台时共用的处理器
+        self.dirty = set()  # 有未提交数据的文件处理器
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def attach(self, logger, handlers):
+        """让logger通过队列异步写入handlers"""
+        self.routes[logger.name] = handlers
+        logger.addHandler(QueueHandler(self.queue))
+
+    def reroute(self, logger, handlers):
+        """更换logger的处理器，原有的处理器关闭（需在该logger产生记录之前调用）"""
+        old_handlers = self.routes.get(logger.name, ())
+        self.routes[logger.name] = handlers
+        for handler in old_handlers:
+            handler.close()
+
+    def release(self, log_file):
+        """在队列中已有的记录写完后关闭该日志文件（不再写入的文件不必等LRU淘汰）"""
+        self.queue.put(log_file)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """写完队列中剩余的记录并提交到文件"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+
+    def _run(self):
+        pending = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except Empty:
+                record = False
+            if record is None:
+                self._commit()
+                self.file_pool.close_all()
+                break
+            if isinstance(record, str):
+                # release() 放入的日志文件路径
+                self.file_pool.release(record, self.dirty.discard)
+            elif record:
+                self._dispatch(record)
+                pending += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+            if pending >= self.max_pending or (deadline is not None and time.monotonic() >= deadline):
+                self._commit()
+                pending = 0
+                deadline = None
+
+    def _dispatch(self, record):
+        metrics.log_write_latency.observe(time.time() - record.created)
+        log_file = getattr(record, 'log_file', None)
+        if log_file is None:
+            handlers = self.routes.get(record.name, ())
+        else:
+            try:
+                handlers = [self.file_pool.get(log_file, self.dirty.discard)]
+            except OSError as e:
+                report_error(f"打开日志文件失败 {log_file}: {e}")
+                handlers = []
+            if LOG_CONSOLE_ECHO:
+                if self.console is None:
+                    self.console = setup_console_handler()
+                handlers.append(self.console)
+        for handler in handlers:
+            if record.levelno < handler.level:
+                continue
+            try:
+                handler.handle(record)
+            except Exception:
+                handler.handleError(record)
+            if isinstance(handler, GroupCommitFileHandler):
+                self.dirty.add(handler)
+
+    def _commit(self):
+        begin = time.perf_counter()
+        for handler in self.dirty:
+            try:
+                handler.commit()
+            except Exception as e:
+                report_error(f"提交日志文件失败 {handler.baseFilename}: {e}")
+        if self.dirty:
+            metrics.log_commit_time.observe(time.perf_counter() - begin)
+        self.dirty.clear()
+
+
+def create_file_handler(log_file):
+    """创建按天（及按大小）轮转、批量提交的文件处理器"""
+    file_handler = GroupCommitFileHandler(
+        log_file,
+        when="midnight",
+        interval=1,
+        encoding="utf-8"
+    )
+    file_formatter = ColoredFormatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s')
+    file_handler.setFormatter(file_formatter)
+    return file_handler
+
+
+class SNLogger:
+    """单个SN的logger：记录直接放入LogWriter队列，写入 logs/<SN>/server.log
+
+    不在logging模块中注册，也不持有文件，设备断开后随客户端对象一起释放；
+    文件由LogWriter按需打开，打开的文件数有上限（LOG_MAX_OPEN_FILES）。
+    """
+
+    def __init__(self, sn):
+        self.name = f'tcp_server_{sn}'
+        self.log_file = os.path.join(LOG_DIR, sn, "server.log")
+
+    def log(self, level, message):
+        record = logging.LogRecord(self.name, level, __file__, 0, message, None, None)
+        record.log_file = self.log_file
+        log_writer.queue.put(record)
+
+    def info(self, message):
+        self.log(logging.INFO, message)
+
+    def warning(self, message):
+        self.log(logging.WARNING, message)
+
+    def error(self, message):
+        self.log(logging.ERROR, message)
+
+    def release(self):
+        """关闭该SN已打开的日志文件"""
+        log_writer.release(self.log_file)
+
+
 class SNBasedLogger:
-    def __init__(self):
-        self.loggers = {}  # 存储每个SN对应的logger
-        
     def get_logger(self, sn=None):
         if not sn:
             return setup_default_logger()
-            
-        if sn not in self.loggers:
-            # 为这个SN创建新的logger
-            logger = logging.getLogger(f'tcp_server_{sn}')
-            logger.setLevel(logging.INFO)
-            
-            # 创建该SN的日志目录
-            sn_log_dir = os.path.join(LOG_DIR, sn)
-            if not os.path.exists(sn_log_dir):
-                os.makedirs(sn_log_dir)
-            
-            # 使用固定的日志文件名
-            log_file = os.path.join(sn_log_dir, "server.log")
-            
-            # 文件处理器
-            file_handler = TimedRotatingFileHandler(
-                log_file,
-                when="midnight",
-                interval=1,
-                backupCount=30,
-                encoding="utf-8"
-            )
-            file_formatter = ColoredFormatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s')
-            file_handler.setFormatter(file_formatter)
-            logger.addHandler(file_handler)
-            
-            # 添加控制台处理器
-            console_handler = setup_console_handler()
-            logger.addHandler(console_handler)
-            
-            self.loggers[sn] = logger
-            
-        return self.loggers[sn]
+        # 逐条回显到控制台在设备很多时开销很大，可在配置中关闭（LOG_CONSOLE_ECHO）
+        return SNLogger(sn)
 
 def setup_console_handler():
     console_handler = logging.StreamHandler()
@@ -80,29 +333,21 @@ def setup_default_logger():
     if not logger.handlers:
         logger.setLevel(logging.INFO)
         
-        # 添加控制台处理器
-        console_handler = setup_console_handler()
-        logger.addHandler(console_handler)
-        
         # 默认文件处理器
         default_log_dir = os.path.join(LOG_DIR, "default")
         if not os.path.exists(default_log_dir):
             os.makedirs(default_log_dir)
             
         log_file = os.path.join(default_log_dir, "server.log")
-        file_handler = TimedRotatingFileHandler(
-            log_file,
-            when="midnight",
-            interval=1,
-            backupCount=30,
-            encoding="utf-8"
-        )
-        file_formatter = ColoredFormatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s')
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        log_writer.attach(logger, [setup_console_handler(), create_file_handler(log_file)])
     
     return logger
 
+# 启动异步日志写入线程，进程退出时写完剩余日志
+log_writer = LogWriter()
+log_writer.start()
+atexit.register(log_writer.stop)
+
 # 初始化日志管理器
 sn_logger = SNBasedLogger()
 # 获取默认logger用于向后兼容
@@ -1,18 +1,19 @@
 import asyncio
+import signal
 import threading
 from queue import Queue
-from logger_config import logger
+from config import TCP_MODE, INGEST_WORKERS
+from logger_config import logger, log_writer
 from tcp_handler import TCPServer
+from ingest_bus import IngestHub
 from websocket_handler import WebSocketServer
 from http_handler import CustomHTTPServer
-
-def process_message_queue(message_queue):
-    """处理消息队列的后台任务"""
-    while True:
-        message = message_queue.get()
-        if message is None:
-            break
-        asyncio.run_coroutine_threadsafe(ws_server.notify_web_clients(message), loop)
+from message_bridge import MessageBridge
+from log_store import log_compressor
+from log_search import search_index_manager
+from log_catalog import log_catalog
+from log_retention import log_retention
+from metrics import metrics
 
 if __name__ == "__main__":
     try:
@@ -25,53 +26,83 @@ if __name__ == "__main__":
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        # 创建TCP服务器
-        tcp_server = TCPServer(message_queue=message_queue)
+        # 创建TCP服务器（多进程接入时由接入进程监听TCP端口，主进程汇总）
+        if INGEST_WORKERS > 0:
+            tcp_server = IngestHub(message_queue=message_queue, workers=INGEST_WORKERS)
+        else:
+            tcp_server = TCPServer(message_queue=message_queue)
         
         # 创建WebSocket服务器
         ws_server = WebSocketServer(tcp_server=tcp_server)
         
-        # 创建HTTP服务器
-        http_server = CustomHTTPServer()
+        # 创建HTTP服务器（与WebSocket服务器共享事件循环，并在 /ws 上提供WebSocket）
+        http_server = CustomHTTPServer(ws_server=ws_server)
+
+        # 启动后台日志压缩（含启动前积压的历史日志）
+        log_compressor.start()
+
+        # 启动后台搜索索引（日志轮转后建立历史日志的索引）
+        search_index_manager.start()
 
-        # 启动消息处理线程
+        # 加载日志目录缓存（列表接口不再每次遍历目录）
+        log_catalog.start()
+
+        # 启动后台日志清理（按天数和大小上限删除最旧的历史日志）
+        log_retention.start()
+
+        # 启动消息处理线程（批量桥接到事件循环）
+        bridge = MessageBridge(message_queue, ws_server, loop)
         message_processor = threading.Thread(
-            target=process_message_queue,
-            args=(message_queue,),
+            target=bridge.run,
             daemon=True
         )
         message_processor.start()
 
-        # 启动TCP服务器线程
-        tcp_thread = threading.Thread(
-            target=tcp_server.start,
-            daemon=True
-        )
-        tcp_thread.start()
+        # 登记运行指标的采集对象（/api/metrics）
+        metrics.bind(tcp_server=tcp_server, ws_server=ws_server, message_queue=message_queue,
+                     bridge=bridge, log_writer=log_writer)
 
-        # 启动HTTP服务器线程
-        http_thread = threading.Thread(
-            target=http_server.start,
-            daemon=True
-        )
-        http_thread.start()
+        # 启动TCP服务器（线程模式下在独立线程中accept）
+        tcp_thread = None
+        if TCP_MODE == 'thread' and INGEST_WORKERS == 0:
+            tcp_thread = threading.Thread(
+                target=tcp_server.start,
+                daemon=True
+            )
+            tcp_thread.start()
 
         # 启动WebSocket服务器
         loop.run_until_complete(ws_server.start())
+
+        # 启动HTTP服务器
+        loop.run_until_complete(http_server.start())
+
+        # asyncio模式下TCP服务器与WebSocket服务器共享同一个事件循环（多进程接入时启动总线和接入进程）
+        if INGEST_WORKERS > 0 or TCP_MODE == 'asyncio':
+            loop.run_until_complete(tcp_server.start_async())
         
         # 等待所有线程启动
         import time
         time.sleep(1)
         
         # 检查线程状态
-        if not http_thread.is_alive():
-            raise Exception("HTTP服务器启动失败")
-        if not tcp_thread.is_alive():
+        if tcp_thread is not None and not tcp_thread.is_alive():
             raise Exception("TCP服务器启动失败")
         if not message_processor.is_alive():
             raise Exception("消息处理线程启动失败")
+
+        # 收到退出信号时停止事件循环，以便写完缓冲中的日志
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, loop.stop)
             
         loop.run_forever()
+        logger.info("服务器正在关闭...")
+        loop.run_until_complete(http_server.stop())
+        ws_server.command_sender.shutdown()
+        if INGEST_WORKERS > 0:
+            tcp_server.stop()
     except Exception as e:
         logger.critical(f"服务器启动失败: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+    finally:
+        log_writer.stop() 
\ No newline at end of file
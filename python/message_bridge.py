@@ -0,0 +1,249 @@
+import json
+import time
+from queue import Empty
+from collections import deque
+from logger_config import logger
+from tcp_handler import format_message, get_current_time
+from config import BRIDGE_BATCH_MAX, BRIDGE_BATCH_WINDOW, BRIDGE_COALESCE_WINDOW, BRIDGE_COALESCE_THRESHOLD
+
+NOTICE_LABELS = {"connect": "新客户端连接", "disconnect": "客户端断开连接", "identify": "识别到设备信息"}
+
+
+class ClientEventCoalescer:
+    """连接风暴时在一个时间窗口内合并连接类消息，减少推送给前端的消息数量
+
+    最近 window 秒内的连接/断开/识别设备通知不超过 threshold 条时不合并，消息直接发送；
+    超过时开始一个合并窗口，窗口内：
+    - 系统通知超过 threshold 条时合并为一条汇总（详细内容仍在日志文件中）
+    - 客户端增量事件按客户端折叠为净变化，例如窗口内连接后又断开的客户端不再推送
+    - 多条 client_update 只保留最新的一条
+    窗口内某个客户端的设备消息发送前，调用方先用 take_client 取出该客户端待发送的列表变化。
+    """
+
+    def __init__(self, window=BRIDGE_COALESCE_WINDOW, threshold=BRIDGE_COALESCE_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self.deadline = None
+        self.notices = []      # 窗口内的连接类系统通知
+        self.snapshot = None   # 窗口内最新的 client_update
+        self.joined = {}       # 窗口内新加入的客户端（按顺序）
+        self.left = {}         # 窗口开始前已存在、窗口内离开的客户端
+        self.renamed = {}      # 窗口开始前已存在的客户端: 原名称 -> 当前名称
+        self.current = {}      # renamed 的反向映射: 当前名称 -> 原名称
+        self.recent = deque()  # 最近 window 秒内连接类通知的时间
+        self.folded = 0        # 累计被合并掉的消息数
+
+    def add(self, item):
+        """放入一条消息，不属于合并范围或没有连接风暴时返回False，由调用方直接发送"""
+        if self.window <= 0:
+            return False
+        kind = item["type"]
+        notice = kind == "message" and item.get("event") in NOTICE_LABELS
+        if not notice and kind not in ("client_update", "client_joined", "client_left", "client_renamed"):
+            return False
+        now = time.monotonic()
+        if notice:
+            self.recent.append(now)
+            while self.recent[0] <= now - self.window:
+                self.recent.popleft()
+        if self.deadline is None:
+            if len(self.recent) <= self.threshold:
+                return False
+            self.deadline = now + self.window  # 连接风暴开始
+        if notice:
+            self.notices.append(item)
+        elif kind == "client_update":
+            # 完整列表覆盖之前的所有变化
+            self.folded += (self.snapshot is not None) + len(self.joined) + len(self.left) + len(self.renamed)
+            self._reset_deltas()
+            self.snapshot = item
+        elif kind == "client_joined":
+            self._joined(item["client"])
+        elif kind == "client_left":
+            self._left(item["client"])
+        elif kind == "client_renamed":
+            self._renamed(item["old"], item["new"])
+        return True
+
+    def take_client(self, name):
+        """取出与该客户端有关、尚未发送的列表变化，保证前端先知道客户端再收到它的消息"""
+        items = []
+        if self.deadline is None:
+            return items
+        if self.snapshot is not None and name in self.snapshot["clients"]:
+            # 之后的增量变化都相对于这个完整列表，仍然可以继续合并
+            items.append(self.snapshot)
+            self.snapshot = None
+        if name in self.joined:
+            del self.joined[name]
+            items.append({"type": "client_joined", "client": name})
+        elif name in self.current:
+            original = self.current.pop(name)
+            del self.renamed[original]
+            # 同SN新连接顶替旧连接：先发送旧连接离开，再改名
+            if name in self.left:
+                del self.left[name]
+                items.append({"type": "client_left", "client": name})
+            items.append({"type": "client_renamed", "old": original, "new": name})
+        return items
+
+    def _joined(self, name):
+        if name in self.left:
+            # 离开后又以相同名称加入，前端无需变化
+            del self.left[name]
+            self.folded += 2
+        else:
+            self.joined[name] = None
+
+    def _left(self, name):
+        if name in self.joined:
+            del self.joined[name]
+            self.folded += 2
+        elif name in self.current:
+            original = self.current.pop(name)
+            del self.renamed[original]
+            self.left[original] = None
+            self.folded += 1
+        else:
+            self.left[name] = None
+
+    def _renamed(self, old, new):
+        if old in self.joined:
+            del self.joined[old]
+            self._joined(new)
+            self.folded += 1
+        elif old in self.current:
+            original = self.current.pop(old)
+            if original == new:
+                del self.renamed[original]
+            else:
+                self.renamed[original] = new
+                self.current[new] = original
+            self.folded += 1
+        else:
+            self.renamed[old] = new
+            self.current[new] = old
+
+    def _reset_deltas(self):
+        self.joined = {}
+        self.left = {}
+        self.renamed = {}
+        self.current = {}
+
+    def time_left(self):
+        """距离窗口结束的秒数，没有待合并的消息时返回None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def flush_due(self):
+        """窗口结束时返回合并后的消息，否则返回空列表"""
+        if self.deadline is None or time.monotonic() < self.deadline:
+            return []
+        return self.flush()
+
+    def flush(self):
+        """返回合并后的消息并开始新的窗口"""
+        items = []
+        if len(self.notices) > self.threshold:
+            counts = {}
+            for notice in self.notices:
+                counts[notice["event"]] = counts.get(notice["event"], 0) + 1
+            summary = "，".join(f"{NOTICE_LABELS[event]} {count} 个" for event, count in counts.items())
+            items.append({
+                "type": "message",
+                "addr": "系统",
+                "data": format_message("系统", f"{self.window * 1000:.0f}ms 内{summary}（详细信息见日志）", get_current_time())
+            })
+            self.folded += len(self.notices) - 1
+        else:
+            items.extend(self.notices)
+        if self.snapshot is not None:
+            items.append(self.snapshot)
+        # 先离开再改名：同SN新连接顶替旧连接时，改名后的名称与离开的相同
+        items.extend({"type": "client_left", "client": name} for name in self.left)
+        items.extend({"type": "client_renamed", "old": old, "new": new} for old, new in self.renamed.items())
+        items.extend({"type": "client_joined", "client": name} for name in self.joined)
+        self.notices = []
+        self.snapshot = None
+        self._reset_deltas()
+        self.deadline = None
+        return items
+
+
+class MessageBridge:
+    """TCP线程与事件循环之间的批量桥接
+
+    从消息队列中一次取出所有可用消息（最多 max_items 条，最多等待 max_delay 秒），
+    每批只唤醒一次事件循环，由 WebSocketServer 作为一个 batch 帧推送给前端。
+    连接类消息先经过 ClientEventCoalescer 按 coalesce_window 合并后再发送。
+    """
+
+    def __init__(self, message_queue, ws_server, loop, max_items=BRIDGE_BATCH_MAX, max_delay=BRIDGE_BATCH_WINDOW,
+                 coalesce_window=BRIDGE_COALESCE_WINDOW):
+        self.message_queue = message_queue
+        self.ws_server = ws_server
+        self.loop = loop
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.coalescer = ClientEventCoalescer(coalesce_window)
+        self.batches = 0
+        self.items = 0
+
+    def run(self):
+        """后台线程入口，收到None时退出"""
+        running = True
+        while running:
+            batch = []
+            recv_time = None  # 本批中最早的TCP接收时间
+            try:
+                # 有待合并的消息时最多等到合并窗口结束
+                message = self.message_queue.get(timeout=self.coalescer.time_left())
+            except Empty:
+                pass
+            else:
+                if message is None:
+                    break
+                recv_time = self._append(batch, message, recv_time)
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_items:
+                    try:
+                        message = self.message_queue.get_nowait()
+                    except Empty:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        try:
+                            message = self.message_queue.get(timeout=remaining)
+                        except Empty:
+                            break
+                    if message is None:
+                        running = False
+                        break
+                    recv_time = self._append(batch, message, recv_time)
+            batch.extend(self.coalescer.flush_due())
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            # 在桥接线程中序列化一次，回放缓冲区和推送共用
+            parts = [json.dumps(item) for item in batch]
+            # 保存到回放缓冲区，新打开的页面可以看到之前的消息
+            self.ws_server.replay_store.record(batch, parts)
+            self.loop.call_soon_threadsafe(self.ws_server.notify_batch, batch, recv_time, parts)
+        logger.info("消息桥接线程退出")
+
+    def _append(self, batch, message, recv_time):
+        """展开并加入一条队列消息，返回本批中最早的接收时间"""
+        # TCP端一次recv的多行消息本身就是batch，展开后合并
+        items = message["items"] if message["type"] == "batch" else [message]
+        for item in items:
+            if self.coalescer.add(item):
+                continue
+            if item["type"] == "message":
+                batch.extend(self.coalescer.take_client(item.get("addr")))
+            batch.append(item)
+        message_time = message.get("recv_time")
+        if message_time is not None and (recv_time is None or message_time < recv_time):
+            return message_time
+        return recv_time
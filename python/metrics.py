@@ -0,0 +1,209 @@
+import time
+import bisect
+import threading
+from collections import deque
+from config import METRICS_RATE_INTERVAL
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "log_server_"
+
+
+class Histogram:
+    """预先分桶的直方图
+
+    observe 只做一次二分查找和两次加法，不加锁：多线程同时记录时偶尔丢失一次计数，对统计结果没有影响。
+    """
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, counts, q):
+        """按桶估算分位数（取所在桶的上限）"""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return {
+            "count": sum(counts),
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(counts, 0.5),
+            "p90": self.quantile(counts, 0.9),
+            "p99": self.quantile(counts, 0.99),
+            "buckets": counts,
+        }
+
+
+class Metrics:
+    """运行指标：各模块在热路径上只做无锁计数，采集时再汇总
+
+    - 每个设备的接收条数/字节数记在 TCPClient 上（只有该连接的线程或事件循环写入）
+    - 端到端延迟：TCP收到数据到 WebSocket 发送完成，每帧记录一次（取帧内最早的消息）
+    - 日志写入延迟：记录产生到写入文件缓冲区，以及每次批量提交的耗时
+    速率基于固定间隔的采样：计数最多每 rate_interval 秒记录一次样本，速率为较早一个样本以来的平均值
+    （至少 rate_interval 秒），多个采集方互不影响。
+    """
+
+    def __init__(self, rate_interval=METRICS_RATE_INTERVAL):
+        self.started = time.time()
+        self.rate_interval = rate_interval
+        self.e2e_latency = Histogram("e2e_latency_seconds", "TCP收到数据到WebSocket发送完成的延迟")
+        self.log_write_latency = Histogram("log_write_latency_seconds", "日志记录产生到写入文件的延迟")
+        self.log_commit_time = Histogram("log_commit_seconds", "日志批量提交（flush）耗时")
+        self.histograms = (self.e2e_latency, self.log_write_latency, self.log_commit_time)
+        self.tcp_server = None
+        self.ws_server = None
+        self.message_queue = None
+        self.bridge = None
+        self.log_writer = None
+        self.lock = threading.Lock()  # 只在采集时使用
+        # 速率采样 (时间, (总条数, 总字节数), {设备: (条数, 字节数)})，保留最近两个
+        self.samples = deque([(time.monotonic(), (0, 0), {})], maxlen=2)
+
+    def bind(self, tcp_server=None, ws_server=None, message_queue=None, bridge=None, log_writer=None):
+        """登记需要采集的对象"""
+        self.tcp_server = tcp_server or self.tcp_server
+        self.ws_server = ws_server or self.ws_server
+        self.message_queue = message_queue if message_queue is not None else self.message_queue
+        self.bridge = bridge or self.bridge
+        self.log_writer = log_writer or self.log_writer
+
+    def collect(self, device_limit=None):
+        """汇总当前指标，device_limit 不为None时 devices 只包含接收速率最高的 device_limit 个设备"""
+        with self.lock:
+            now = time.monotonic()
+            devices = {}
+            closed_messages = closed_bytes = 0
+            if self.tcp_server is not None:
+                registry = self.tcp_server.registry
+                closed_messages, closed_bytes = registry.closed_rx_messages, registry.closed_rx_bytes
+                for client in registry.clients():
+                    devices[client.display_name] = (client.rx_messages, client.rx_bytes)
+            total_messages = closed_messages + sum(messages for messages, _ in devices.values())
+            total_bytes = closed_bytes + sum(size for _, size in devices.values())
+            if now - self.samples[-1][0] >= self.rate_interval:
+                self.samples.append((now, (total_messages, total_bytes), devices))
+            last_time, last_totals, last_devices = self.samples[0]
+            elapsed = max(now - last_time, 1e-6)
+
+            device_rates = []
+            for name, (messages, size) in devices.items():
+                last_messages, last_bytes = last_devices.get(name, (0, 0))
+                device_rates.append({
+                    "sn": name,
+                    "messages": messages,
+                    "bytes": size,
+                    "messages_per_sec": round(max(messages - last_messages, 0) / elapsed, 2),
+                    "bytes_per_sec": round(max(size - last_bytes, 0) / elapsed, 2),
+                })
+            device_rates.sort(key=lambda item: item["messages_per_sec"], reverse=True)
+
+            data = {
+                "uptime": round(time.time() - self.started, 1),
+                "threads": threading.active_count(),
+                "ingest": {
+                    "messages": total_messages,
+                    "bytes": total_bytes,
+                    "messages_per_sec": round(max(total_messages - last_totals[0], 0) / elapsed, 2),
+                    "bytes_per_sec": round(max(total_bytes - last_totals[1], 0) / elapsed, 2),
+                },
+                "tcp_clients": len(devices),
+                "message_queue": self.message_queue.qsize() if self.message_queue is not None else None,
+                "log_queue": self.log_writer.queue.qsize() if self.log_writer is not None else None,
+                "log_open_files": len(self.log_writer.file_pool.handlers) if self.log_writer is not None else None,
+                "devices": device_rates if device_limit is None else device_rates[:device_limit],
+            }
+
+        if self.bridge is not None:
+            data["bridge"] = {
+                "batches": self.bridge.batches,
+                "items": self.bridge.items,
+                "coalesced": self.bridge.coalescer.folded,
+            }
+        if self.ws_server is not None:
+            viewers = self.ws_server.get_viewer_stats()
+            data["viewers"] = viewers
+            data["viewer_count"] = len(viewers)
+            data["replay"] = self.ws_server.replay_store.stats()
+        data["histograms"] = {histogram.name: histogram.snapshot() for histogram in self.histograms}
+        data["bucket_bounds"] = list(LATENCY_BUCKETS)
+        return data
+
+    def to_prometheus(self, data):
+        """转换为Prometheus文本格式"""
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{METRIC_PREFIX}{name}{format_labels(labels)} {value}")
+
+        ingest = data["ingest"]
+        metric("uptime_seconds", "gauge", "运行时间", [({}, data["uptime"])])
+        metric("threads", "gauge", "线程数", [({}, data["threads"])])
+        metric("tcp_clients", "gauge", "在线TCP客户端数", [({}, data["tcp_clients"])])
+        metric("ingest_messages_total", "counter", "接收的消息条数", [({}, ingest["messages"])])
+        metric("ingest_bytes_total", "counter", "接收的字节数", [({}, ingest["bytes"])])
+        devices = data["devices"]
+        metric("device_messages_total", "counter", "每个在线设备接收的消息条数",
+               [({"sn": item["sn"]}, item["messages"]) for item in devices])
+        metric("device_bytes_total", "counter", "每个在线设备接收的字节数",
+               [({"sn": item["sn"]}, item["bytes"]) for item in devices])
+        if data["message_queue"] is not None:
+            metric("message_queue_depth", "gauge", "消息队列长度", [({}, data["message_queue"])])
+        if data["log_queue"] is not None:
+            metric("log_queue_depth", "gauge", "日志写入队列长度", [({}, data["log_queue"])])
+            metric("log_open_files", "gauge", "打开的SN日志文件数", [({}, data["log_open_files"])])
+        if "viewers" in data:
+            metric("viewers", "gauge", "WebSocket客户端数", [({}, data["viewer_count"])])
+            metric("viewer_queue_depth", "gauge", "每个WebSocket客户端的发送队列长度",
+                   [({"remote": viewer["remote"]}, viewer["queued"]) for viewer in data["viewers"]])
+            metric("viewer_dropped_total", "counter", "每个WebSocket客户端丢弃的消息数",
+                   [({"remote": viewer["remote"]}, viewer["dropped"]) for viewer in data["viewers"]])
+        if "bridge" in data:
+            metric("bridge_batches_total", "counter", "消息桥接推送的批次数", [({}, data["bridge"]["batches"])])
+            metric("bridge_coalesced_total", "counter", "连接风暴时合并掉的消息数", [({}, data["bridge"]["coalesced"])])
+
+        for histogram in self.histograms:
+            snapshot = data["histograms"][histogram.name]
+            name = f"{METRIC_PREFIX}{histogram.name}"
+            lines.append(f"# HELP {name} {histogram.description}")
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + ["+Inf"], snapshot["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum {snapshot['sum']}")
+            lines.append(f"{name}_count {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+metrics = Metrics()
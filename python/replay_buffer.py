@@ -0,0 +1,215 @@
+import json
+import time
+import heapq
+import threading
+from array import array
+from collections import OrderedDict
+from config import (REPLAY_BUFFER_BYTES, REPLAY_BUFFER_SLOTS, REPLAY_BUFFER_INITIAL_BYTES, REPLAY_TOTAL_BYTES,
+                    REPLAY_IDLE_SECONDS, REPLAY_MAX_ITEMS)
+
+SYSTEM_NAME = "系统"
+SLOT_BYTES = 16  # 每条消息的索引开销：起始位置、长度、时间戳
+
+
+class MessageRing:
+    """单个设备最近消息的环形缓冲区
+
+    消息（已序列化的JSON）依次写入 bytearray，写到末尾放不下时从头开始，
+    覆盖的旧消息随之淘汰；起始位置、长度和时间戳保存在定长数组中。grow() 扩大缓冲区并保留已有消息。
+    """
+
+    def __init__(self, capacity=REPLAY_BUFFER_BYTES, slots=REPLAY_BUFFER_SLOTS):
+        self.data = bytearray(capacity)
+        self.starts = array('I', [0]) * slots
+        self.lengths = array('I', [0]) * slots
+        self.times = array('d', [0.0]) * slots
+        self.head = 0      # 最旧一条消息所在的槽位
+        self.count = 0
+        self.write_pos = 0
+        self.used = 0      # 保存的消息字节数
+
+    @property
+    def memory(self):
+        return len(self.data) + len(self.starts) * SLOT_BYTES
+
+    @property
+    def last_time(self):
+        """最近一条消息的时间戳，没有消息时为0"""
+        if not self.count:
+            return 0.0
+        return self.times[(self.head + self.count - 1) % len(self.starts)]
+
+    def full(self, size):
+        """写入size字节的消息是否需要淘汰旧消息"""
+        return self.count == len(self.starts) or self.used + size > len(self.data)
+
+    def grow(self, capacity, slots):
+        """换成更大的缓冲区，已有消息按顺序复制到开头"""
+        items = self.recent()
+        self.data = bytearray(capacity)
+        self.starts = array('I', [0]) * slots
+        self.lengths = array('I', [0]) * slots
+        self.times = array('d', [0.0]) * slots
+        self.head = self.count = self.write_pos = self.used = 0
+        for timestamp, payload in items:
+            self.append(payload, timestamp)
+
+    def _evict_oldest(self):
+        self.used -= self.lengths[self.head]
+        self.head = (self.head + 1) % len(self.starts)
+        self.count -= 1
+
+    def append(self, payload, timestamp):
+        """写入一条消息，超过缓冲区大小的消息不保存"""
+        size = len(payload)
+        capacity = len(self.data)
+        if size > capacity:
+            return
+        slots = len(self.starts)
+        pos = self.write_pos
+        if pos + size > capacity:
+            # 末尾放不下，末尾剩余的旧消息一并淘汰，从头开始写
+            while self.count and self.starts[self.head] >= pos:
+                self._evict_oldest()
+            pos = 0
+        # 淘汰将被覆盖的旧消息
+        while self.count and self.starts[self.head] < pos + size and pos < self.starts[self.head] + self.lengths[self.head]:
+            self._evict_oldest()
+        if self.count == slots:
+            self._evict_oldest()
+        self.data[pos:pos + size] = payload
+        slot = (self.head + self.count) % slots
+        self.starts[slot] = pos
+        self.lengths[slot] = size
+        self.times[slot] = timestamp
+        self.count += 1
+        self.used += size
+        self.write_pos = pos + size
+
+    def recent(self, count=None, since=None):
+        """按时间顺序返回 [(时间戳, 消息)]：最近count条，或since之后的消息"""
+        slots = len(self.starts)
+        items = []
+        for i in range(self.count - 1, -1, -1):
+            slot = (self.head + i) % slots
+            timestamp = self.times[slot]
+            if (count is not None and len(items) >= count) or (since is not None and timestamp < since):
+                break
+            start = self.starts[slot]
+            items.append((timestamp, bytes(self.data[start:start + self.lengths[slot]])))
+        items.reverse()
+        return items
+
+
+class ReplayStore:
+    """按设备（显示名称）保存最近消息，新打开的监控页面可以直接从内存回放
+
+    设备缓冲区从 initial 字节开始，写满时倍增到 capacity；总内存超过 max_memory 时不再扩容，
+    只淘汰 idle_seconds 内没有新消息的设备腾出空间。新设备没有空间时淘汰最久没有新消息的设备。
+    系统消息单独保存且不会被淘汰。写入在消息桥接线程，回放在事件循环的线程池中，因此需要加锁。
+    """
+
+    def __init__(self, capacity=REPLAY_BUFFER_BYTES, slots=REPLAY_BUFFER_SLOTS, max_memory=REPLAY_TOTAL_BYTES,
+                 initial=REPLAY_BUFFER_INITIAL_BYTES, idle_seconds=REPLAY_IDLE_SECONDS):
+        self.capacity = capacity
+        self.slots = slots
+        self.max_memory = max_memory
+        self.initial = min(initial, capacity)
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.system = MessageRing(capacity, slots)
+        self.rings = OrderedDict()  # {显示名称: MessageRing}，按最近写入排序
+        self.memory = self.system.memory
+        self.evicted = 0
+
+    def record(self, items, parts=None):
+        """记录一批推送给前端的消息（只保存 type 为 message 的消息）
+
+        parts 为与 items 对应的已序列化消息，传入时直接保存，不再重复序列化。
+        """
+        if parts is None:
+            parts = [json.dumps(item) for item in items]
+        now = time.time()
+        with self.lock:
+            for item, part in zip(items, parts):
+                if item.get("type") != "message":
+                    continue
+                payload = part.encode()
+                name = item.get("addr")
+                if name == SYSTEM_NAME:
+                    self.system.append(payload, now)
+                    continue
+                ring = self.rings.get(name)
+                if ring is None:
+                    ring = self._new_ring(name, now)
+                else:
+                    self.rings.move_to_end(name)
+                    if ring.full(len(payload)):
+                        self._grow(name, ring, len(payload), now)
+                ring.append(payload, now)
+
+    def _ring_slots(self, capacity):
+        return max(1, self.slots * capacity // self.capacity)
+
+    def _new_ring(self, name, now):
+        ring = MessageRing(self.initial, self._ring_slots(self.initial))
+        # 新设备至少需要一个初始缓冲区，空间不够时按最久没有新消息的顺序淘汰
+        self._reserve(ring.memory, now)
+        self.rings[name] = ring
+        self.memory += ring.memory
+        return ring
+
+    def _grow(self, name, ring, size, now):
+        """缓冲区写满时倍增（直到放得下size字节），总内存不够时只淘汰空闲设备，仍不够则不扩容"""
+        capacity = min(len(ring.data) * 2, self.capacity)
+        while capacity < size and capacity < self.capacity:
+            capacity = min(capacity * 2, self.capacity)
+        if capacity == len(ring.data):
+            return
+        slots = self._ring_slots(capacity)
+        extra = capacity + slots * SLOT_BYTES - ring.memory
+        if not self._reserve(extra, now, keep=name, idle_only=True):
+            return
+        self.memory -= ring.memory
+        ring.grow(capacity, slots)
+        self.memory += ring.memory
+
+    def _reserve(self, size, now, keep=None, idle_only=False):
+        """按最久没有新消息的顺序淘汰设备，直到能再放下size字节，返回是否足够
+
+        idle_only 时只淘汰 idle_seconds 内没有新消息的设备；keep 为不能淘汰的设备。
+        """
+        idle_before = now - self.idle_seconds
+        while self.memory + size > self.max_memory and self.rings:
+            name, ring = next(iter(self.rings.items()))
+            if name == keep or (idle_only and ring.last_time > idle_before):
+                break
+            del self.rings[name]
+            self.memory -= ring.memory
+            self.evicted += 1
+        return self.memory + size <= self.max_memory
+
+    def replay(self, count=None, seconds=None, match=None, max_items=REPLAY_MAX_ITEMS):
+        """生成回放帧（已序列化）：每个设备最近count条或最近seconds秒的消息，按时间合并，最多max_items条
+
+        match(显示名称) 判断是否回放该设备，None表示全部设备；系统消息总是回放。
+        """
+        since = time.time() - seconds if seconds is not None else None
+        if count is None and since is None:
+            count = 0
+        with self.lock:
+            sources = [self.system.recent(count, since)]
+            targets = self.rings.keys() if match is None else [name for name in self.rings if match(name)]
+            for name in targets:
+                sources.append(self.rings[name].recent(count, since))
+        items = list(heapq.merge(*sources, key=lambda item: item[0]))[-max_items:]
+        return '{"type": "replay", "items": [' + ', '.join(payload.decode() for _, payload in items) + ']}'
+
+    def stats(self):
+        with self.lock:
+            return {
+                "devices": len(self.rings),
+                "messages": self.system.count + sum(ring.count for ring in self.rings.values()),
+                "memory": self.memory,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,109 @@
+class Subscription:
+    """单个Web客户端订阅的设备：显示名称（SN）、SN前缀，或全部设备"""
+
+    def __init__(self, all_devices=True):
+        self.all = all_devices
+        self.names = set()
+        self.prefixes = set()
+
+    def matches(self, name):
+        return self.all or name in self.names or any(name.startswith(prefix) for prefix in self.prefixes)
+
+    def to_dict(self):
+        return {"all": self.all, "sns": sorted(self.names), "prefixes": sorted(self.prefixes)}
+
+
+class SubscriptionIndex:
+    """按设备查找订阅了它的Web客户端（在事件循环线程中使用）
+
+    订阅全部设备的客户端单独保存；其余按显示名称精确索引，前缀按长度分组，
+    查找一条设备消息的订阅者只需对每种前缀长度查一次字典。
+    """
+
+    def __init__(self):
+        self.subscriptions = {}  # {viewer: Subscription}
+        self.wildcard = set()    # 订阅全部设备的viewer
+        self.by_name = {}        # {显示名称: {viewer}}
+        self.by_prefix = {}      # {前缀: {viewer}}
+        self.prefix_lengths = {}  # {前缀长度: 该长度的前缀数量}
+
+    def add_viewer(self, viewer):
+        """新连接默认订阅全部设备，与原来的行为一致"""
+        self.subscriptions[viewer] = Subscription()
+        self.wildcard.add(viewer)
+
+    def remove_viewer(self, viewer):
+        self.update(viewer, Subscription(all_devices=False))
+        self.wildcard.discard(viewer)
+        self.subscriptions.pop(viewer, None)
+
+    def get(self, viewer):
+        return self.subscriptions.get(viewer)
+
+    def subscribe(self, viewer, names=(), prefixes=(), all_devices=False, replace=False):
+        """增加订阅，replace为True时替换原有订阅"""
+        current = self.subscriptions[viewer]
+        subscription = Subscription(all_devices=all_devices or (current.all and not replace))
+        if not replace:
+            subscription.names |= current.names
+            subscription.prefixes |= current.prefixes
+        subscription.names |= set(names)
+        subscription.prefixes |= {prefix for prefix in prefixes if prefix}
+        self.update(viewer, subscription)
+        return subscription
+
+    def unsubscribe(self, viewer, names=(), prefixes=(), all_devices=False):
+        """取消订阅，all_devices为True时取消订阅全部设备"""
+        current = self.subscriptions[viewer]
+        subscription = Subscription(all_devices=current.all and not all_devices)
+        subscription.names = current.names - set(names)
+        subscription.prefixes = current.prefixes - set(prefixes)
+        self.update(viewer, subscription)
+        return subscription
+
+    def update(self, viewer, subscription):
+        """用新的订阅替换viewer原有的订阅，更新各索引"""
+        current = self.subscriptions.get(viewer)
+        if current is not None:
+            for name in current.names - subscription.names:
+                self._discard(self.by_name, name, viewer)
+            for prefix in current.prefixes - subscription.prefixes:
+                if self._discard(self.by_prefix, prefix, viewer):
+                    self.prefix_lengths[len(prefix)] -= 1
+                    if not self.prefix_lengths[len(prefix)]:
+                        del self.prefix_lengths[len(prefix)]
+            old_names, old_prefixes = current.names, current.prefixes
+        else:
+            old_names, old_prefixes = set(), set()
+        for name in subscription.names - old_names:
+            self.by_name.setdefault(name, set()).add(viewer)
+        for prefix in subscription.prefixes - old_prefixes:
+            if prefix not in self.by_prefix:
+                self.prefix_lengths[len(prefix)] = self.prefix_lengths.get(len(prefix), 0) + 1
+            self.by_prefix.setdefault(prefix, set()).add(viewer)
+        if subscription.all:
+            self.wildcard.add(viewer)
+        else:
+            self.wildcard.discard(viewer)
+        self.subscriptions[viewer] = subscription
+
+    @staticmethod
+    def _discard(index, key, viewer):
+        """从索引中移除，返回该键是否已无订阅者"""
+        viewers = index.get(key)
+        if viewers is None:
+            return False
+        viewers.discard(viewer)
+        if not viewers:
+            del index[key]
+            return True
+        return False
+
+    def match(self, name):
+        """订阅了该设备的viewer（不含订阅全部设备的viewer）"""
+        viewers = set(self.by_name.get(name, ()))
+        for length in self.prefix_lengths:
+            matched = self.by_prefix.get(name[:length])
+            if matched:
+                viewers |= matched
+        return viewers
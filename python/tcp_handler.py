@@ -1,18 +1,33 @@
+import time
+import select
 import socket
+import asyncio
 import threading
 from datetime import datetime
 from queue import Queue
-from logger_config import logger, sn_logger
+from logger_config import logger, sn_logger, SNLogger
+from framing import StreamFramer
+from client_registry import ClientRegistry
+from config import FRAME_FLUSH_TIMEOUT, TCP_WRITE_BUFFER_HIGH, SEND_TIMEOUT
 
 class TCPClient:
-    def __init__(self, conn, addr_str):
+    def __init__(self, conn, addr_str, transport=None):
         self.conn = conn
+        self.transport = transport  # asyncio模式下的Transport
         self.addr_str = addr_str
         self.wifi_name = None
         self.sn = None
         self.display_name = addr_str
         self.is_alive = True
         self._logger = logger  # 默认使用通用logger
+        # 下发指令的发送队列（在事件循环中使用）
+        self.send_lock = asyncio.Lock()  # 保证同一设备的指令按顺序写入
+        self.pending_sends = 0           # 排队及正在写入的指令数
+        self.writable = asyncio.Event()  # asyncio模式下写缓冲区低于高水位时置位
+        self.writable.set()
+        # 接收统计（只由该连接的线程或事件循环写入，无需加锁）
+        self.rx_messages = 0
+        self.rx_bytes = 0
 
     def update_info(self, wifi_name, sn):
         """更新客户端信息"""
@@ -24,10 +39,67 @@ class TCPClient:
             self._logger = sn_logger.get_logger(sn)
         self._logger.info(f"客户端信息已更新: {self.display_name}")
 
+    def release_log(self):
+        """不再写入本客户端的SN日志：关闭LogWriter中打开的日志文件"""
+        if isinstance(self._logger, SNLogger):
+            self._logger.release()
+
+    def send(self, data):
+        """向客户端发送数据"""
+        if self.transport is not None:
+            self.transport.write(data)
+        else:
+            self.conn.sendall(data)
+
+    async def write(self, data, executor, timeout=SEND_TIMEOUT):
+        """在事件循环中发送数据，不阻塞事件循环
+
+        asyncio模式写入transport后等待写缓冲区回落到高水位以下（设备接收慢时形成背压），
+        线程模式在线程池中执行阻塞写入（超过timeout秒失败）。线程中的写入无法中途取消，
+        等待被取消时仍等写入结束才返回，调用方持有的 send_lock 不会提前释放，下一条指令不会与之交错。
+        """
+        if self.transport is not None:
+            if self.transport.is_closing():
+                raise ConnectionError("连接已关闭")
+            self.transport.write(data)
+            await self.writable.wait()
+        else:
+            future = asyncio.get_running_loop().run_in_executor(executor, self.send_blocking, data, timeout)
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                await asyncio.wait([future])
+                future.exception()  # 结果已无人等待，取出异常避免 "never retrieved" 警告
+                raise
+
+    def send_blocking(self, data, timeout):
+        """线程模式下的阻塞发送：用poll等待可写，不受接收线程给socket设置的超时影响
+
+        超过timeout秒仍未写完时抛出TimeoutError；此时已写出一部分的话设备收到的指令不完整，关闭连接。
+        """
+        deadline = time.monotonic() + timeout
+        poller = select.poll()
+        poller.register(self.conn, select.POLLOUT)
+        view = memoryview(data)
+        while view:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not poller.poll(remaining * 1000):
+                if len(view) < len(data):
+                    self.is_alive = False
+                    self.close()
+                raise TimeoutError("发送超时")
+            try:
+                view = view[self.conn.send(view):]
+            except (socket.timeout, BlockingIOError):
+                continue
+
     def close(self):
         """安全关闭连接"""
         try:
-            self.conn.close()
+            if self.transport is not None:
+                self.transport.close()
+            else:
+                self.conn.close()
         except:
             pass
         finally:
@@ -64,11 +136,15 @@ def parse_client_info(message):
         # 解析Wifi名称
         wifi_start = message.find("Wifi :") + 6
         wifi_end = message.find(",", wifi_start)
+        if wifi_end == -1:
+            wifi_end = len(message)
         wifi_name = message[wifi_start:wifi_end].strip() if wifi_start > 5 else None
 
         # 解析SN号
         sn_start = message.find("SN:") + 3
         sn_end = message.find(",", sn_start)
+        if sn_end == -1:
+            sn_end = len(message)
         sn = message[sn_start:sn_end].strip() if sn_start > 2 else None
 
         logger.info(f"解析到客户端信息 - Wifi: {wifi_name}, SN: {sn}")
@@ -82,98 +158,139 @@ class TCPServer:
         self.host = host
         self.port = port
         self.message_queue = message_queue
-        self.tcp_clients = {}  # 存储TCP客户端 {addr_str: TCPClient}
-        self.sn_to_addr = {}   # 存储SN到addr_str的映射 {sn: addr_str}
+        # 客户端登记表，变化以增量事件放入消息队列
+        self.registry = ClientRegistry(on_event=message_queue.put if message_queue is not None else None)
+        # 客户端断开后立即关闭其SN日志文件（多进程接入时设备重连会落到其他进程，不能继续持有该文件）
+        self.release_logs_on_disconnect = False
 
-    def handle_tcp_client(self, conn, addr):
-        """ 处理TCP客户端数据接收 """
-        addr_str = addr_to_str(addr)
-        client = TCPClient(conn, addr_str)
-        self.tcp_clients[addr_str] = client
+    def client_list(self):
+        """当前所有客户端的显示名称"""
+        return self.registry.names_snapshot()
+
+    def on_client_connect(self, client):
+        """ 新客户端接入：登记并发送连接通知 """
         current_time = get_current_time()
-        client.log('info', f"新的TCP客户端连接: {addr_str}")
-        
+        client.log('info', f"新的TCP客户端连接: {client.addr_str}")
+
         # 发送连接通知
         self.message_queue.put({
             "type": "message",
             "addr": "系统",
-            "data": format_message("系统", f"新客户端连接: {addr_str}", current_time)
+            "data": format_message("系统", f"新客户端连接: {client.addr_str}", current_time),
+            "event": "connect"  # 连接类通知，消息桥接在连接风暴时合并
         })
-        self.message_queue.put({"type": "client_update", "clients": [c.display_name for c in self.tcp_clients.values()]})
-        
+        self.registry.add(client)
+
+    def handle_handshake(self, client, line, current_time):
+        """ 解析首次连接消息并更新客户端信息，解析成功时返回True """
+        wifi_name, sn = parse_client_info(line)
+        if not (wifi_name and sn):
+            return False
+
+        client.update_info(wifi_name, sn)
+        # 更新索引，同SN的旧连接会被顶替
+        old_client = self.registry.identify(client)
+        if old_client is not None:
+            old_client.log('warning', f"检测到重复SN连接，断开旧连接: {old_client.addr_str}")
+            # 发送断开连接通知
+            self.message_queue.put({
+                "type": "message",
+                "addr": "系统",
+                "data": format_message("系统", f"检测到重复SN({sn})连接，断开旧连接: {old_client.addr_str}", current_time)
+            })
+            old_client.close()
+        self.message_queue.put({
+            "type": "message",
+            "addr": "系统",
+            "data": format_message("系统", f"识别到设备信息 - Wifi: {wifi_name}, SN: {sn}", current_time),
+            "event": "identify"
+        })
+        return True
+
+    def on_client_lines(self, client, lines):
+        """ 处理分帧后的完整行：识别首次连接信息，其余行合并为一次批量入队 """
+        if not lines:
+            return
+        client.rx_messages += len(lines)
+        recv_time = time.monotonic()
+        current_time = get_current_time()
+        batch = []
+        for line in lines:
+            # 检查是否是首次连接消息
+            if "Wifi :" in line and "SN:" in line:
+                # 连接消息之前的行先以旧的显示名称发出
+                self.put_batch(batch, recv_time)
+                batch = []
+                if self.handle_handshake(client, line, current_time):
+                    continue  # 跳过这条连接消息的显示
+            batch.append({
+                "type": "message",
+                "addr": client.display_name,
+                "data": format_message(client.display_name, line, current_time)
+            })
+            client.log('info', f"收到TCP客户端 {client.display_name} 消息: {line}")
+        self.put_batch(batch, recv_time)
+
+    def put_batch(self, messages, recv_time):
+        """ 一次recv产生的多条消息合并为一个队列元素，附带接收时间用于统计端到端延迟 """
+        if messages:
+            self.message_queue.put({"type": "batch", "items": messages, "recv_time": recv_time})
+
+    def on_client_disconnect(self, client):
+        """ 客户端断开：清理登记信息并发送断开通知 """
+        client.close()
+        addr_str = client.addr_str
+        # 已被同SN的新连接顶替的客户端不再重复通知
+        if self.registry.remove(client):
+            current_time = get_current_time()
+            client.log('info', f"TCP客户端断开连接: {addr_str}")
+            if self.release_logs_on_disconnect:
+                client.release_log()
+            # 发送断开连接通知
+            self.message_queue.put({
+                "type": "message",
+                "addr": "系统",
+                "data": format_message("系统", f"客户端断开连接: {addr_str}", current_time),
+                "event": "disconnect"
+            })
+
+    def handle_tcp_client(self, conn, addr):
+        """ 处理TCP客户端数据接收（每连接一个线程） """
+        client = TCPClient(conn, addr_to_str(addr))
+        framer = StreamFramer()
+        self.on_client_connect(client)
+
+        timeout = 5
         try:
             while client.is_alive:
                 try:
-                    data = conn.recv(1024)
-                    if not data:
+                    # 有不完整的行时缩短超时，超时后直接输出
+                    wanted = FRAME_FLUSH_TIMEOUT if framer.has_pending else 5
+                    if wanted != timeout:
+                        timeout = wanted
+                        conn.settimeout(timeout)
+                    nbytes = conn.recv_into(framer.buffer)
+                    if not nbytes:
                         break
-                    current_time = get_current_time()
-                    decoded_data = data.decode()
-
-                    # 检查是否是首次连接消息
-                    if "Wifi :" in decoded_data and "SN:" in decoded_data:
-                        wifi_name, sn = parse_client_info(decoded_data)
-                        if wifi_name and sn:
-                            # 检查是否存在重名SN
-                            if sn in self.sn_to_addr:
-                                old_addr = self.sn_to_addr[sn]
-                                if old_addr != addr_str and old_addr in self.tcp_clients:
-                                    old_client = self.tcp_clients[old_addr]
-                                    old_client.log('warning', f"检测到重复SN连接，断开旧连接: {old_addr}")
-                                    # 发送断开连接通知
-                                    self.message_queue.put({
-                                        "type": "message",
-                                        "addr": "系统",
-                                        "data": format_message("系统", f"检测到重复SN({sn})连接，断开旧连接: {old_addr}", current_time)
-                                    })
-                                    old_client.close()
-                                    del self.tcp_clients[old_addr]
-                            
-                            # 更新SN映射
-                            self.sn_to_addr[sn] = addr_str
-                            client.update_info(wifi_name, sn)
-                            # 更新客户端列表并发送通知
-                            self.message_queue.put({
-                                "type": "message",
-                                "addr": "系统",
-                                "data": format_message("系统", f"识别到设备信息 - Wifi: {wifi_name}, SN: {sn}", current_time)
-                            })
-                            self.message_queue.put({"type": "client_update", "clients": [c.display_name for c in self.tcp_clients.values()]})
-                            continue  # 跳过这条连接消息的显示
-
-                    # 发送普通消息
-                    msg = {
-                        "type": "message",
-                        "addr": client.display_name,
-                        "data": format_message(client.display_name, decoded_data, current_time)
-                    }
-                    self.message_queue.put(msg)
-                    client.log('info', f"收到TCP客户端 {client.display_name} 消息: {decoded_data}")
+                    client.rx_bytes += nbytes
+                    self.on_client_lines(client, framer.feed_buffer(nbytes))
                 except socket.timeout:
+                    if framer.has_pending:
+                        self.on_client_lines(client, framer.flush())
                     continue
                 except Exception as e:
                     client.log('error', f"接收TCP客户端 {client.display_name} 数据时出错: {str(e)}")
                     break
         finally:
-            client.close()
-            if addr_str in self.tcp_clients:
-                current_time = get_current_time()
-                del self.tcp_clients[addr_str]
-                # 如果是有SN的设备，也要清理SN映射
-                if client.sn and client.sn in self.sn_to_addr and self.sn_to_addr[client.sn] == addr_str:
-                    del self.sn_to_addr[client.sn]
-                client.log('info', f"TCP客户端断开连接: {addr_str}")
-                # 发送断开连接通知
-                self.message_queue.put({
-                    "type": "message",
-                    "addr": "系统",
-                    "data": format_message("系统", f"客户端断开连接: {addr_str}", current_time)
-                })
-                self.message_queue.put({"type": "client_update", "clients": [c.display_name for c in self.tcp_clients.values()]})
+            try:
+                self.on_client_lines(client, framer.flush())
+            finally:
+                self.on_client_disconnect(client)
 
     def start(self):
-        """ 启动TCP服务器 """
+        """ 启动TCP服务器（线程模式） """
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # 与asyncio模式一致，便于切换模式后立即重启
         server.bind((self.host, self.port))
         server.listen(15)
         server.settimeout(1)  # 设置超时，使accept不会永久阻塞
@@ -189,9 +306,79 @@ class TCPServer:
             except Exception as e:
                 logger.error(f"接受TCP连接时出错: {str(e)}")
 
+    async def start_async(self, reuse_port=False):
+        """ 启动TCP服务器（asyncio模式，需在WebSocket服务器所在的事件循环中调用）
+
+        reuse_port 为True时使用SO_REUSEPORT，多个接入进程可以监听同一端口，由内核分配连接
+        """
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: TCPClientProtocol(self), self.host, self.port, backlog=1024,
+                                          reuse_port=reuse_port or None)
+        logger.info(f"TCP服务器(asyncio)启动在 {self.host}:{self.port}")
+        return server
+
     def get_client_by_display_name(self, display_name):
         """根据显示名称获取客户端"""
-        for client in self.tcp_clients.values():
-            if client.display_name == display_name:
-                return client
-        return None 
\ No newline at end of file
+        return self.registry.get_by_name(display_name)
+
+
+class TCPClientProtocol(asyncio.BufferedProtocol):
+    """ asyncio模式下的单个TCP连接，数据直接写入分帧器的预分配缓冲区 """
+
+    def __init__(self, server):
+        self.server = server
+        self.framer = StreamFramer()
+        self.client = None
+        self.flush_handle = None
+
+    def connection_made(self, transport):
+        addr = transport.get_extra_info('peername')
+        self.client = TCPClient(transport.get_extra_info('socket'), addr_to_str(addr), transport=transport)
+        transport.set_write_buffer_limits(high=TCP_WRITE_BUFFER_HIGH)
+        self.server.on_client_connect(self.client)
+
+    def pause_writing(self):
+        self.client.writable.clear()
+
+    def resume_writing(self):
+        self.client.writable.set()
+
+    def get_buffer(self, sizehint):
+        return self.framer.view
+
+    def buffer_updated(self, nbytes):
+        self.client.rx_bytes += nbytes
+        try:
+            self.server.on_client_lines(self.client, self.framer.feed_buffer(nbytes))
+        except Exception as e:
+            self.client.log('error', f"接收TCP客户端 {self.client.display_name} 数据时出错: {str(e)}")
+            self.client.close()
+            return
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """ 有不完整的行时，超时后直接输出 """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.framer.has_pending:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(FRAME_FLUSH_TIMEOUT, self._flush_pending)
+
+    def _flush_pending(self):
+        self.flush_handle = None
+        self.server.on_client_lines(self.client, self.framer.flush())
+
+    def eof_received(self):
+        return False  # 返回False让transport关闭连接
+
+    def connection_lost(self, exc):
+        self.client.writable.set()  # 唤醒等待写入的指令，由发送方检查连接状态
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        if exc is not None:
+            self.client.log('error', f"接收TCP客户端 {self.client.display_name} 数据时出错: {str(exc)}")
+        try:
+            self.server.on_client_lines(self.client, self.framer.flush())
+        finally:
+            self.server.on_client_disconnect(self.client)
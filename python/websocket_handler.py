@@ -1,87 +1,337 @@
+import time
 import asyncio
 import json
+from collections import deque
 import websockets
 from logger_config import logger
+from command_sender import CommandSender
+from replay_buffer import ReplayStore, SYSTEM_NAME
+from subscriptions import SubscriptionIndex
+from metrics import metrics
+from config import WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY
+
+# 只保留最新状态即可的消息类型，coalesce 策略下直接替换队列中的旧值
+STATE_MESSAGE_TYPES = ("client_update",)
+# 丢弃后前端客户端列表会不一致的消息类型（batch中可能包含客户端增量事件），丢弃后补发一次完整列表
+RESYNC_MESSAGE_TYPES = ("batch", "client_joined", "client_left", "client_renamed")
+
+
+class WebViewer:
+    """单个浏览器连接：有界发送队列 + 独立的发送任务，慢速连接不影响其他连接"""
+
+    def __init__(self, websocket, max_queue=WS_SEND_QUEUE_SIZE, policy=WS_OVERFLOW_POLICY, snapshot=None):
+        if policy not in ("drop_oldest", "coalesce", "disconnect"):
+            raise ValueError(f"不支持的溢出策略: {policy}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = deque()  # [(消息类型, 已序列化的消息, TCP接收时间)]
+        self.ready = asyncio.Event()
+        self.task = None
+        self.closed = False
+        self.skipped = 0      # coalesce 策略下尚未告知前端的跳过条数
+        self.snapshot = snapshot  # 返回完整客户端列表消息的函数
+        self.resync = False       # 丢弃过客户端增量事件，需要补发完整列表
+        # 统计计数
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    def enqueue(self, kind, payload, recv_time=None):
+        """放入一条已序列化的消息，队列满时按溢出策略处理；recv_time 用于统计端到端延迟"""
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue and not self._handle_overflow(kind):
+            return
+        self.queue.append((kind, payload, recv_time))
+        self.ready.set()
+
+    def _handle_overflow(self, kind):
+        """处理队列溢出，返回新消息是否仍应入队"""
+        if self.policy == "disconnect":
+            self.dropped += len(self.queue) + 1
+            logger.warning(f"Web客户端 {self.remote} 发送队列已满，断开连接")
+            self.stop()
+            asyncio.ensure_future(self.websocket.close(code=1013, reason="send queue overflow"))
+            return False
+        if self.policy == "coalesce":
+            if kind in STATE_MESSAGE_TYPES:
+                # 状态类消息只保留最新的一条
+                before = len(self.queue)
+                self.queue = deque(item for item in self.queue if item[0] != kind)
+                self.coalesced += before - len(self.queue)
+                if len(self.queue) < self.max_queue:
+                    return True
+            self.skipped += 1
+        kind = self.queue.popleft()[0]
+        if kind in RESYNC_MESSAGE_TYPES and self.snapshot is not None:
+            self.resync = True
+        self.dropped += 1
+        return True
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                if self.skipped:
+                    notice = json.dumps({
+                        "type": "message",
+                        "addr": "系统",
+                        "data": f"连接过慢，已跳过 {self.skipped} 条消息"
+                    })
+                    self.skipped = 0
+                    await self.websocket.send(notice)
+                if self.resync:
+                    self.resync = False
+                    await self.websocket.send(self.snapshot())
+                kind, payload, recv_time = self.queue.popleft()
+                await self.websocket.send(payload)
+                self.sent += 1
+                if recv_time is not None:
+                    metrics.e2e_latency.observe(time.monotonic() - recv_time)
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"向Web客户端 {self.remote} 发送消息失败: {e}")
+
+    def stop(self):
+        """停止发送任务，丢弃未发送的消息"""
+        self.closed = True
+        self.queue.clear()
+        self.ready.set()
+
+    @property
+    def remote(self):
+        return self.websocket.remote_address
+
+    def stats(self):
+        return {
+            "remote": str(self.remote),
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
 
 class WebSocketServer:
     def __init__(self, host="0.0.0.0", port=8765, tcp_server=None):
         self.host = host
         self.port = port
         self.tcp_server = tcp_server
-        self.websocket_clients = set()
+        self.websocket_clients = {}  # {websocket: WebViewer}
+        self.command_sender = CommandSender(tcp_server)
+        self.send_tasks = set()      # 正在执行的下发指令任务
+        self.replay_store = ReplayStore()  # 最近消息，由消息桥接线程写入
+        self.subscriptions = SubscriptionIndex()  # 各Web客户端订阅的设备
         self.loop = None
 
+    def client_snapshot(self):
+        """完整的客户端列表消息（已序列化）"""
+        return json.dumps({
+            "type": "client_update",
+            "clients": self.tcp_server.client_list()
+        })
+
     async def notify_web_clients(self, data):
-        """ 将TCP数据推送给所有WebSocket客户端 """
+        """ 将TCP数据推送给所有WebSocket客户端（只序列化一次，放入各自的发送队列） """
         if self.websocket_clients:
             message = json.dumps(data)
-            try:
-                await asyncio.wait([ws.send(message) for ws in self.websocket_clients])
-                logger.info(f"通知所有Web客户端: {message}")
-            except Exception as e:
-                logger.error(f"通知Web客户端失败: {e}")
+            kind = data.get("type")
+            for viewer in list(self.websocket_clients.values()):
+                viewer.enqueue(kind, message)
+            logger.debug(f"通知所有Web客户端: {message}")
+
+    def notify_batch(self, items, recv_time=None, parts=None):
+        """ 将一批消息推送给WebSocket客户端（在事件循环线程中调用）
+
+        设备消息只发给订阅了该设备的客户端，系统消息和客户端列表变化发给所有客户端；
+        每条消息只序列化一次（parts 为已序列化的消息），再按各客户端需要的消息拼成batch帧。
+        """
+        if not self.websocket_clients or not items:
+            return
+        if parts is None:
+            parts = [json.dumps(item) for item in items]
+        shared = []      # 发给所有客户端的消息序号
+        by_device = {}   # {设备显示名称: [消息序号]}
+        for i, item in enumerate(items):
+            if item.get("type") == "message" and item.get("addr") != SYSTEM_NAME:
+                by_device.setdefault(item["addr"], []).append(i)
+            else:
+                shared.append(i)
+
+        routed = {}      # {viewer: [消息序号]}，不含订阅全部设备的客户端
+        for name, indices in by_device.items():
+            for viewer in self.subscriptions.match(name):
+                routed.setdefault(viewer, []).extend(indices)
+
+        full_frame = shared_frame = None
+        for viewer in list(self.websocket_clients.values()):
+            if viewer in self.subscriptions.wildcard:
+                if full_frame is None:
+                    full_frame = self._frame(items, parts, range(len(items)))
+                viewer.enqueue(*full_frame, recv_time)
+            elif viewer in routed:
+                viewer.enqueue(*self._frame(items, parts, sorted(shared + routed[viewer])), recv_time)
+            elif shared:
+                if shared_frame is None:
+                    shared_frame = self._frame(items, parts, shared)
+                viewer.enqueue(*shared_frame)
+        logger.debug(f"批量通知Web客户端: {len(items)} 条消息")
+
+    @staticmethod
+    def _frame(items, parts, indices):
+        """由已序列化的消息拼出 (消息类型, 帧)，多条时为batch帧"""
+        if len(indices) == 1:
+            return items[indices[0]].get("type"), parts[indices[0]]
+        return "batch", '{"type": "batch", "items": [' + ', '.join(parts[i] for i in indices) + ']}'
+
+    def get_viewer_stats(self):
+        """各Web客户端的发送队列统计"""
+        stats = []
+        for viewer in self.websocket_clients.values():
+            item = viewer.stats()
+            subscription = self.subscriptions.get(viewer)
+            if subscription is not None:
+                item["subscription"] = subscription.to_dict()
+            stats.append(item)
+        return stats
 
     async def handle_websocket(self, websocket, path):
-        self.websocket_clients.add(websocket)
+        viewer = WebViewer(websocket, snapshot=self.client_snapshot)
+        viewer.start()
+        self.subscriptions.add_viewer(viewer)
+        self.websocket_clients[websocket] = viewer
         try:
-            # 发送当前连接状态
-            await self.notify_web_clients({
-                "type": "client_update",
-                "clients": [client.display_name for client in self.tcp_server.tcp_clients.values()]
-            })
-            
             while True:
                 message = await websocket.recv()
                 data = json.loads(message)
                 logger.info(f"收到WebSocket消息: {data}")
                 
                 if data["type"] == "init":
-                    # 响应初始化请求
-                    await self.notify_web_clients({
-                        "type": "client_update",
-                        "clients": [client.display_name for client in self.tcp_server.tcp_clients.values()]
-                    })
+                    # 响应初始化请求：只向请求方发送完整列表，之后通过增量事件更新
+                    viewer.enqueue("client_update", self.client_snapshot())
+                    # 可选回放最近的消息: {"replay": {"count": N}} 或 {"replay": {"seconds": T}}
+                    if data.get("replay"):
+                        self.spawn(self.send_replay(viewer, data["replay"]))
+                elif data["type"] == "stats":
+                    # 只回复给请求方
+                    viewer.enqueue("viewer_stats", json.dumps({
+                        "type": "viewer_stats",
+                        "viewers": self.get_viewer_stats()
+                    }))
                 elif data["type"] == "send":
-                    target_name = data["addr"]
-                    msg = data["message"]
-                    
-                    # 查找目标客户端
-                    target_client = self.tcp_server.get_client_by_display_name(target_name)
-
-                    if target_client and target_client.is_alive:
-                        try:
-                            target_client.conn.sendall(msg.encode())
-                            logger.info(f"发送消息到TCP客户端 {target_name}: {msg}")
-                            await self.notify_web_clients({
-                                "type": "message",
-                                "addr": "系统",
-                                "data": f"[{target_name}]: {msg}"
-                            })
-                        except Exception as e:
-                            logger.error(f"发送消息到TCP客户端 {target_name} 失败: {str(e)}")
-                            target_client.is_alive = False
-                            await self.notify_web_clients({
-                                "type": "message",
-                                "addr": "系统",
-                                "data": f"发送失败: 客户端可能已断开，消息内容: {msg}"
-                            })
-                            await self.notify_web_clients({
-                                "type": "client_update", 
-                                "clients": [c.display_name for c in self.tcp_server.tcp_clients.values()]
-                            })
-                    else:
-                        logger.warning(f"目标TCP客户端不存在或已断开: {target_name}")
-                        await self.notify_web_clients({
-                            "type": "message",
-                            "addr": "系统",
-                            "data": f"发送失败: 客户端不存在或已断开，目标客户端: [{target_name}]"
-                        })
+                    # 写入设备在独立任务中进行，慢设备不阻塞本连接后续消息的处理
+                    self.spawn(self.handle_send(data["addr"], data["message"]))
+                elif data["type"] == "multicast":
+                    self.spawn(self.handle_multicast(viewer, data))
+                elif data["type"] in ("subscribe", "unsubscribe"):
+                    self.handle_subscribe(viewer, data)
+        except websockets.ConnectionClosed:
+            pass
         except Exception as e:
             logger.error(f"WebSocket错误: {str(e)}")
         finally:
-            self.websocket_clients.remove(websocket)
+            del self.websocket_clients[websocket]
+            self.subscriptions.remove_viewer(viewer)
+            viewer.stop()
             logger.info("WebSocket客户端断开连接")
 
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.send_tasks.add(task)
+        task.add_done_callback(self.send_tasks.discard)
+
+    def handle_subscribe(self, viewer, data):
+        """订阅/取消订阅设备：sns 为SN列表（"*" 表示全部设备，"ABC*" 表示前缀），
+        prefixes 为前缀列表，all 为全部设备；subscribe 时 replace 为 true 则替换原有订阅"""
+        names, prefixes = [], list(data.get("prefixes") or [])
+        all_devices = bool(data.get("all"))
+        for sn in data.get("sns") or []:
+            if sn == "*":
+                all_devices = True
+            elif sn.endswith("*"):
+                prefixes.append(sn[:-1])
+            else:
+                names.append(sn)
+        if data["type"] == "subscribe":
+            subscription = self.subscriptions.subscribe(viewer, names, prefixes, all_devices, bool(data.get("replace")))
+        else:
+            subscription = self.subscriptions.unsubscribe(viewer, names, prefixes, all_devices)
+        viewer.enqueue("subscription", json.dumps({"type": "subscription", **subscription.to_dict()}))
+
+    async def send_replay(self, viewer, options):
+        """从内存回放缓冲区取出最近的消息，作为一个replay帧只发给请求方"""
+        try:
+            count = options.get("count")
+            seconds = options.get("seconds")
+            count = min(int(count), self.replay_store.slots) if count is not None else None
+            seconds = float(seconds) if seconds is not None else None
+        except (AttributeError, TypeError, ValueError):
+            logger.warning(f"无效的回放参数: {options}")
+            return
+        # 只回放订阅的设备
+        subscription = self.subscriptions.get(viewer)
+        match = None if subscription is None or subscription.all else subscription.matches
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(None, lambda: self.replay_store.replay(count=count, seconds=seconds, match=match))
+        viewer.enqueue("replay", frame)
+
+    async def handle_send(self, target_name, msg):
+        """向单个设备下发指令"""
+        # 查找目标客户端
+        target_client = self.tcp_server.get_client_by_display_name(target_name)
+        if not (target_client and target_client.is_alive):
+            logger.warning(f"目标TCP客户端不存在或已断开: {target_name}")
+            await self.notify_web_clients({
+                "type": "message",
+                "addr": "系统",
+                "data": f"发送失败: 客户端不存在或已断开，目标客户端: [{target_name}]"
+            })
+            return
+
+        result = await self.command_sender.send(target_client, msg.encode())
+        if result["ok"]:
+            logger.info(f"发送消息到TCP客户端 {target_name}: {msg}")
+            await self.notify_web_clients({
+                "type": "message",
+                "addr": "系统",
+                "data": f"[{target_name}]: {msg}"
+            })
+        else:
+            await self.notify_web_clients({
+                "type": "message",
+                "addr": "系统",
+                "data": f"发送失败({result['error']}): [{target_name}]，消息内容: {msg}"
+            })
+
+    async def handle_multicast(self, viewer, data):
+        """向一组设备下发指令：targets 为 "all" 或SN列表，prefix 为SN前缀；发送结果只回复给请求方"""
+        msg = data["message"]
+        clients, missing = self.command_sender.resolve_targets(data.get("targets"), data.get("prefix"))
+        results = await self.command_sender.multicast(clients, msg.encode())
+        results.extend({"target": name, "ok": False, "error": "客户端不存在"} for name in missing)
+        sent = sum(1 for result in results if result["ok"])
+        viewer.enqueue("send_result", json.dumps({
+            "type": "send_result",
+            "id": data.get("id"),
+            "message": msg,
+            "sent": sent,
+            "failed": len(results) - sent,
+            "results": results
+        }))
+        await self.notify_web_clients({
+            "type": "message",
+            "addr": "系统",
+            "data": f"[多播 {len(results)} 个设备，成功 {sent} 个]: {msg}"
+        })
+
     async def start(self):
         """启动WebSocket服务器"""
         self.loop = asyncio.get_event_loop()
@@ -1,9 +1,10 @@
 // 服务器配置
 const SERVER_HOST = window.location.hostname;  // 使用当前域名
 const SERVER_PORT = 8080;
-const WS_PORT = 8765;
+const WS_PORT = 8765;  // 独立的WebSocket端口，仍可单独连接
 const SERVER_URL = `http://${SERVER_HOST}:${SERVER_PORT}`;
-const WS_URL = `ws://${SERVER_HOST}:${WS_PORT}`;
+const WS_URL = `ws://${SERVER_HOST}:${SERVER_PORT}/ws`;  // 与HTTP共用端口
+const REPLAY_COUNT = 200;  // 连接后从服务器内存回放每个设备最近的消息条数
 
 // 移除此处的ws声明,因为后面已经重新声明了ws变量
 let shouldAutoScroll = true;
@@ -179,6 +180,29 @@ function updateClientFilter(checkbox) {
         filteredClients.delete(clientId);
     }
     refreshMessages();
+    syncSubscription(false);
+}
+
+let subscriptionTimer = null;
+
+// 将勾选的设备同步为服务器端订阅，只接收勾选设备的消息；全部勾选时订阅全部设备
+function syncSubscription(immediate) {
+    clearTimeout(subscriptionTimer);
+    const send = () => {
+        if (!ws || ws.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        const allChecked = Array.from(clientItems.keys()).every(client => filteredClients.has(client));
+        ws.send(JSON.stringify(allChecked
+            ? {type: "subscribe", replace: true, all: true}
+            : {type: "subscribe", replace: true, sns: Array.from(filteredClients)}));
+    };
+    if (immediate) {
+        send();
+    } else {
+        // 全选/取消全选会逐个触发，合并为一次
+        subscriptionTimer = setTimeout(send, 200);
+    }
 }
 
 function refreshMessages() {
@@ -238,10 +262,15 @@ function connectWebSocket() {
         const wsStatus = document.getElementById('ws-status');
         wsStatus.textContent = 'WebSocket: 已连接';
         wsStatus.className = 'ws-status connected';
+        // 重连时先恢复订阅，回放也只包含订阅的设备
+        if (filteredClients.size > 0) {
+            syncSubscription(true);
+        }
         // 请求初始化数据
         ws.send(JSON.stringify({
             type: "init",
-            message: "request_current_state"
+            message: "request_current_state",
+            replay: {count: REPLAY_COUNT}
         }));
     };
 
@@ -279,54 +308,139 @@ function connectWebSocket() {
     // Move the onmessage handler inside connectWebSocket
     ws.onmessage = function(event) {
         const data = JSON.parse(event.data);
-        if (data.type === "client_update") {
-            document.getElementById("client-count").innerText = data.clients.length;
-            let clientList = document.getElementById("clients");
-            let select = document.getElementById("client-select");
-            clientList.innerHTML = "";
-            select.innerHTML = "";
+        if (data.type === "batch") {
+            // 批量帧：逐条处理，计数和滚动只在最后更新一次
+            data.items.forEach(item => handleServerMessage(item, true));
+            updateAllClientCounts();
+            scrollToBottom();
+        } else if (data.type === "replay") {
+            // 回放帧包含连接前的消息（重连时也包含已显示的消息），直接替换现有消息
+            allMessages = data.items;
+            refreshMessages();
+            updateAllClientCounts();
+        } else {
+            handleServerMessage(data, false);
+        }
+    };
+
+    // Remove the alert from here as it should only show on error
+}
+
+// 处理服务器推送的单条消息，inBatch为true时由调用方统一更新计数和滚动
+function handleServerMessage(data, inBatch) {
+    if (data.type === "client_update") {
+        // 完整列表：只在初始化（或连接过慢丢弃了增量事件）时收到
+        setClientList(data.clients);
+    } else if (data.type === "client_joined") {
+        addClient(data.client);
+        updateClientCount();
+        selectAllIfNone();
+    } else if (data.type === "client_left") {
+        removeClient(data.client);
+        updateClientCount();
+    } else if (data.type === "client_renamed") {
+        renameClient(data.old, data.new);
+        updateClientCount();
+        selectAllIfNone();
+    } else if (data.type === "send_result") {
+        handleSendResult(data);
+    } else if (data.type === "message") {
+        // 保存消息
+        allMessages.push(data);
+        
+        // 更新消息计数
+        if (!inBatch) {
+            updateAllClientCounts();
+        }
+        
+        // 如果消息应该显示，则添加到界面
+        if (shouldShowMessage(data)) {
+            let messages = document.getElementById("messages");
+            let div = document.createElement("div");
             
-            data.clients.forEach(client => {
-                // 使用新的创建列表项函数
-                const li = updateClientListItem(client);
-                clientList.appendChild(li);
-
-                // 更新发送消息的下拉框
-                let option = document.createElement("option");
-                option.value = client;
-                option.innerText = client;
-                select.appendChild(option);
-            });
-
-            // 如果是首次加载，默认选中所有客户端
-            if (filteredClients.size === 0) {
-                selectAllClients(true);
+            if (data.addr === "系统") {
+                div.className = "system-message";
             }
-        } else if (data.type === "message") {
-            // 保存消息
-            allMessages.push(data);
             
-            // 更新消息计数
-            updateAllClientCounts();
-            
-            // 如果消息应该显示，则添加到界面
-            if (shouldShowMessage(data)) {
-                let messages = document.getElementById("messages");
-                let div = document.createElement("div");
-                
-                if (data.addr === "系统") {
-                    div.className = "system-message";
-                }
-                
-                // 使用ANSI解析器处理消息内容
-                div.innerHTML = parseAnsiToHtml(data.data);
-                messages.appendChild(div);
+            // 使用ANSI解析器处理消息内容
+            div.innerHTML = parseAnsiToHtml(data.data);
+            messages.appendChild(div);
+            if (!inBatch) {
                 scrollToBottom();
             }
         }
-    };
+    }
+}
 
-    // Remove the alert from here as it should only show on error
+// 客户端显示名称 -> {li, option}，用于按增量事件更新列表
+let clientItems = new Map();
+
+// 用完整列表重建客户端列表
+function setClientList(clients) {
+    document.getElementById("clients").innerHTML = "";
+    document.getElementById("client-select").innerHTML = "";
+    clientItems.clear();
+    clients.forEach(addClient);
+    updateClientCount();
+    selectAllIfNone();
+}
+
+// 如果是首次加载（或还没有勾选任何客户端），默认选中所有客户端
+function selectAllIfNone() {
+    if (filteredClients.size === 0) {
+        selectAllClients(true);
+    }
+}
+
+function addClient(client) {
+    if (clientItems.has(client)) {
+        return;
+    }
+    const li = updateClientListItem(client);
+    document.getElementById("clients").appendChild(li);
+
+    // 更新发送消息的下拉框
+    const option = document.createElement("option");
+    option.value = client;
+    option.innerText = client;
+    document.getElementById("client-select").appendChild(option);
+    clientItems.set(client, {li, option});
+}
+
+function removeClient(client) {
+    const item = clientItems.get(client);
+    if (!item) {
+        return;
+    }
+    item.li.remove();
+    item.option.remove();
+    clientItems.delete(client);
+}
+
+// 设备识别出SN后显示名称由地址变为SN，原位置替换，保留过滤选择
+function renameClient(oldName, newName) {
+    const item = clientItems.get(oldName);
+    if (!item || clientItems.has(newName)) {
+        removeClient(oldName);
+        addClient(newName);
+        return;
+    }
+    if (filteredClients.delete(oldName)) {
+        filteredClients.add(newName);
+        syncSubscription(false);
+    }
+    const li = updateClientListItem(newName);
+    item.li.replaceWith(li);
+    const selected = item.option.selected;
+    item.option.value = newName;
+    item.option.innerText = newName;
+    item.option.selected = selected;
+    clientItems.delete(oldName);
+    clientItems.set(newName, {li, option: item.option});
+}
+
+function updateClientCount() {
+    document.getElementById("client-count").innerText = clientItems.size;
 }
 
 // 获取每个客户端的消息数量
@@ -373,16 +487,62 @@ function updateAllClientCounts() {
     });
 }
 
+// 根据发送方式构造发送请求，返回null表示输入不完整
+function buildSendRequest(messageText) {
+    const mode = document.getElementById("send-mode").value;
+    if (mode === "single") {
+        const select = document.getElementById("client-select");
+        if (!select.value) {
+            alert("请选择一个客户端");
+            return null;
+        }
+        return {type: "send", addr: select.value, message: messageText};
+    }
+
+    const request = {type: "multicast", id: Date.now(), message: messageText};
+    if (mode === "checked") {
+        if (filteredClients.size === 0) {
+            alert("请勾选至少一个客户端");
+            return null;
+        }
+        request.targets = Array.from(filteredClients);
+    } else if (mode === "prefix") {
+        const prefix = document.getElementById("send-prefix").value.trim();
+        if (!prefix) {
+            alert("请输入SN前缀");
+            return null;
+        }
+        request.prefix = prefix;
+    } else {
+        if (!confirm(`确定要向全部 ${clientItems.size} 个设备发送该指令吗？`)) {
+            return null;
+        }
+        request.targets = "all";
+    }
+    return request;
+}
+
+function handleSendModeChange() {
+    const mode = document.getElementById("send-mode").value;
+    document.getElementById("client-select").style.display = mode === "single" ? "" : "none";
+    document.getElementById("send-prefix").style.display = mode === "prefix" ? "" : "none";
+}
+
+// 多播发送结果：汇总显示，列出失败的设备
+function handleSendResult(data) {
+    const failures = data.results.filter(result => !result.ok);
+    let text = `多播发送完成: 成功 ${data.sent} 个，失败 ${data.failed} 个，消息内容: ${data.message}`;
+    if (failures.length > 0) {
+        const shown = failures.slice(0, 20).map(result => `${result.target}(${result.error})`).join(", ");
+        text += `\n失败设备: ${shown}${failures.length > 20 ? ` 等 ${failures.length} 个` : ""}`;
+    }
+    handleServerMessage({type: "message", addr: "系统", data: text}, false);
+}
+
 function sendMessage() {
-    const select = document.getElementById("client-select");
     const messageInput = document.getElementById("message");
     const messageText = messageInput.value.trim();
     
-    if (!select.value) {
-        alert("请选择一个客户端");
-        return;
-    }
-    
     if (!messageText) {
         alert("请输入消息内容");
         return;
@@ -393,13 +553,12 @@ function sendMessage() {
         return;
     }
 
+    const messageData = buildSendRequest(messageText);
+    if (!messageData) {
+        return;
+    }
+
     try {
-        const messageData = {
-            type: "send",
-            addr: select.value,
-            message: messageText
-        };
-        
         console.log("发送消息:", messageData);
         ws.send(JSON.stringify(messageData));
         
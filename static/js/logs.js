@@ -17,6 +17,18 @@ let currentDate = null;
 let currentChunk = 0;
 let totalChunks = 0;
 let isLoading = false;
+let targetLine = null; // 从搜索结果跳转时需要定位的行号
+let followSource = null; // 实时跟踪当前日志的SSE连接
+
+// 支持 logs.html?sn=...&date=...&line=... 直接定位到指定日志行
+const pageParams = new URLSearchParams(window.location.search);
+let targetDate = pageParams.get('date');
+if (pageParams.get('sn')) {
+    currentSN = pageParams.get('sn');
+}
+if (parseInt(pageParams.get('line')) > 0) {
+    targetLine = parseInt(pageParams.get('line'));
+}
 
 function initializePage() {
     console.log('初始化页面');
@@ -92,6 +104,9 @@ function fetchSNList() {
             });
             
             console.log('SN列表更新完成，选项数量:', snSelect.options.length);
+            if (snList.includes(currentSN)) {
+                snSelect.value = currentSN;
+            }
             
             // 手动触发一次日期列表获取
             fetchDateList();
@@ -170,8 +185,9 @@ function fetchDateList() {
             
             console.log('日期列表更新完成，选项数量:', dateSelect.options.length);
             
-            // 默认选择第一个日期并加载内容
-            currentDate = dates[0];
+            // 默认选择第一个日期并加载内容（从搜索结果跳转时选择指定日期）
+            currentDate = targetDate && dates.includes(targetDate) ? targetDate : dates[0];
+            targetDate = null;
             dateSelect.value = currentDate;
             console.log('设置当前日期为:', currentDate);
             
@@ -200,6 +216,7 @@ function handleSNChange() {
     
     currentSN = snSelect.value;
     console.log('SN变更为:', currentSN);
+    stopFollow();
     // 更新日期列表
     fetchDateList();
 }
@@ -213,6 +230,7 @@ function handleDateChange() {
     
     currentDate = dateSelect.value;
     console.log('日期变更为:', currentDate);
+    stopFollow();
     fetchLogContent();
 }
 
@@ -254,8 +272,8 @@ function fetchLogContent() {
         ? `default/${currentDate}.log`
         : `${currentSN}/${currentDate}.log`;
     console.log('正在获取日志内容，路径:', path);
-    // 重置分片状态
-    currentChunk = 0;
+    // 重置分片状态，需要定位到指定行时从该行所在的分片开始加载
+    currentChunk = targetLine ? Math.floor((targetLine - 1) / 1000) : 0;
     totalChunks = 0;
     
     // 清空现有内容
@@ -310,6 +328,10 @@ function loadMoreLogs() {
             const container = document.getElementById('log-lines-container');
             if (container) {
                 displayLogContent(data.content, data.start_line);
+                if (targetLine) {
+                    highlightLine(targetLine);
+                    targetLine = null;
+                }
             }
         })
         .catch(error => {
@@ -332,11 +354,14 @@ function displayLogContent(content, startLine) {
         return;
     }
     
-    // 先按行分割，然后过滤掉空行或只包含空白字符的行
-    const lines = content.split('\n').filter(line => line.trim());
+    // 按行分割，跳过空行或只包含空白字符的行（行号保持与文件一致）
+    const lines = content.split('\n');
     
     // 创建日志行容器
     lines.forEach((line, index) => {
+        if (!line.trim()) {
+            return;
+        }
         const lineNumber = startLine + index + 1;
         const parts = line.match(/^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (\w+) - \[([^\]]+)\] - (.+)$/);
         
@@ -351,6 +376,7 @@ function displayLogContent(content, startLine) {
             
             const logLine = document.createElement('div');
             logLine.className = 'log-line';
+            logLine.dataset.line = lineNumber;
             logLine.innerHTML = `
                 <div class="line-number">${lineNumber}</div>
                 <div class="line-content">
@@ -369,6 +395,7 @@ function displayLogContent(content, startLine) {
             const parsedLine = parseAnsiColor(line);
             const logLine = document.createElement('div');
             logLine.className = 'log-line';
+            logLine.dataset.line = lineNumber;
             logLine.innerHTML = `
                 <div class="line-number">${lineNumber}</div>
                 <div class="line-content">
@@ -380,6 +407,16 @@ function displayLogContent(content, startLine) {
     });
 }
 
+function highlightLine(lineNumber) {
+    const logLine = document.querySelector(`.log-line[data-line="${lineNumber}"]`);
+    if (!logLine) {
+        console.warn('找不到需要定位的日志行:', lineNumber);
+        return;
+    }
+    logLine.classList.add('highlighted');
+    logLine.scrollIntoView({ block: 'center' });
+}
+
 // ANSI颜色代码映射
 const ANSI_COLORS = {
     '30': '#000000', // 黑
@@ -415,9 +452,75 @@ function parseAnsiColor(text) {
 }
 
 function refreshLogs() {
+    if (followSource) {
+        startFollow();
+        return;
+    }
     fetchLogContent();
 }
 
+function handleFollowChange() {
+    const toggle = document.getElementById('follow-toggle');
+    if (toggle && toggle.checked) {
+        startFollow();
+    } else {
+        stopFollow();
+        fetchLogContent();
+    }
+}
+
+// 跟踪设备当前的server.log：先显示末尾的内容，之后服务端推送新写入的行
+function startFollow() {
+    if (followSource) {
+        followSource.close();
+    }
+    const container = document.getElementById('log-lines-container');
+    if (container) {
+        container.innerHTML = '';
+    }
+    hideLoadMore();
+    hideLoading();
+
+    const url = `${baseUrl}/api/logs/follow/${currentSN}`;
+    console.log('开始实时跟踪日志:', url);
+    followSource = new EventSource(url);
+    followSource.addEventListener('lines', event => {
+        const data = JSON.parse(event.data);
+        const logViewer = document.querySelector('.log-viewer');
+        const atBottom = logViewer && logViewer.scrollHeight - logViewer.scrollTop - logViewer.clientHeight < 100;
+        if (data.reset && container) {
+            container.innerHTML = '';
+        }
+        // 跨天轮转后跟踪的是新日期的日志
+        if (data.date !== currentDate) {
+            currentDate = data.date;
+            if (container && data.start_line === 0) {
+                container.innerHTML = '';
+            }
+        }
+        displayLogContent(data.content, data.start_line);
+        if (atBottom && logViewer) {
+            logViewer.scrollTop = logViewer.scrollHeight;
+        }
+    });
+    followSource.onerror = () => {
+        // EventSource会自动重连，并通过Last-Event-ID从上次的位置继续
+        console.warn('日志跟踪连接中断，正在重连...');
+    };
+}
+
+function stopFollow() {
+    if (followSource) {
+        followSource.close();
+        followSource = null;
+        console.log('停止实时跟踪日志');
+    }
+    const toggle = document.getElementById('follow-toggle');
+    if (toggle) {
+        toggle.checked = false;
+    }
+}
+
 function createLogItem(log) {
     const div = document.createElement('div');
     div.className = 'log-item';
@@ -529,7 +632,7 @@ function downloadCurrentLog() {
 
 // 处理滚动事件
 function handleScroll(event) {
-    if (isLoading) return;
+    if (isLoading || followSource) return;
     
     const logViewer = event.target;
     const scrollBottom = logViewer.scrollHeight - logViewer.scrollTop - logViewer.clientHeight;